@@ -0,0 +1,412 @@
+import argparse
+import contextlib
+import json
+import os
+import platform
+import resource
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+
+import catalog
+import compile_pcd
+import extract_intensity
+import merge_lidar
+import pipeline
+import range_image
+import split_lidar
+from manifest import MANIFEST_NAME
+from pcd_io import make_cloud, write_pcd
+from spatial_index import VoxelIndex, curve_order
+
+# Remission tags of the synthetic scans: 0 -> LIDAR0, 1 -> LIDAR1, 2 -> in neither partition
+TAG_SHARES = (0.55, 0.4, 0.05)
+
+# Semantic classes drawn for the synthetic labels (SemanticKITTI ids)
+SEMANTIC_CLASSES = np.array([0, 1, 10, 11, 13, 15, 16, 18, 20, 30, 31, 32, 40, 44, 48, 49, 50, 51, 52,
+                             60, 70, 71, 72, 80, 81, 99, 252, 253, 254, 255, 256, 257, 258, 259])
+
+# A stage is flagged as a regression when it is this much slower than the baseline
+REGRESSION_THRESHOLD = 0.10
+
+# Search radius (m) of the neighbour-query timing on merged frames
+SEARCH_RADIUS = 1.0
+
+
+def frame_ids(num_frames):
+    """Frame ids in the scripts' naming: 000, 005, 010, ..."""
+    return [f"{5 * i:03d}" for i in range(num_frames)]
+
+
+def layout(root):
+    """Synthetic tree paths, mirroring the directories the scripts expect"""
+    return {
+        "sequences": os.path.join(root, "data", "sequences"),
+        "filtered": {tag: os.path.join(root, partition) for tag, partition in split_lidar.PARTITIONS.items()},
+        "intensity_pcd": os.path.join(root, "pcd_data", "{scene}", "{scene}", "lidar_point_cloud_top_rear_lidar"),
+        "extracted": os.path.join(root, "extracted_intensity_lidar1"),
+        "lidar_pcd": {0: os.path.join(root, "lidar_pcd", "lidar_0"), 1: os.path.join(root, "lidar_pcd", "lidar_1")},
+        "merged": os.path.join(root, "merged_lidar_points"),
+        "merged_quantized": os.path.join(root, "merged_lidar_points_quantized"),
+        "merged_reordered": os.path.join(root, "merged_lidar_points_reordered"),
+        "merged_pcd": os.path.join(root, "new"),
+        "pipeline": os.path.join(root, "pipeline_merged"),
+    }
+
+
+def generate(root, num_scenes, num_frames, num_points, seed=0):
+    """Write synthetic scans, labels and PCDs for every scene and frame; returns the scene ids"""
+    rng = np.random.default_rng(seed)
+    paths = layout(root)
+    scenes = [f"{i:02d}" for i in range(num_scenes)]
+
+    for scene in scenes:
+        velodyne_dir = os.path.join(paths["sequences"], scene, "velodyne")
+        label_dir = os.path.join(paths["sequences"], scene, "labels")
+        intensity_pcd_dir = paths["intensity_pcd"].format(scene=scene)
+        for directory in (velodyne_dir, label_dir, intensity_pcd_dir,
+                          *(os.path.join(pcd_dir, scene, "velodyne") for pcd_dir in paths["lidar_pcd"].values())):
+            os.makedirs(directory, exist_ok=True)
+
+        for frame in frame_ids(num_frames):
+            # Scan: xyz within 80 m around the sensor, remission column holds the sensor tag
+            points = np.empty((num_points, 4), dtype=np.float32)
+            points[:, :2] = rng.uniform(-80, 80, (num_points, 2))
+            points[:, 2] = rng.uniform(-3, 5, num_points)
+            points[:, 3] = rng.choice(len(TAG_SHARES), num_points, p=TAG_SHARES)
+            semantic = rng.choice(SEMANTIC_CLASSES, num_points).astype(np.uint32)
+            instance = np.where(rng.random(num_points) < 0.2, rng.integers(1, 50, num_points), 0).astype(np.uint32)
+            labels = semantic | (instance << 16)
+            points.tofile(os.path.join(velodyne_dir, f"{frame}.bin"))
+            labels.tofile(os.path.join(label_dir, f"{frame}.label"))
+
+            # One PCD per sensor with that sensor's points, x/y/z/rgb/intensity
+            for tag, pcd_dir in paths["lidar_pcd"].items():
+                mask = points[:, 3] == tag
+                colors = rng.integers(0, 256, (int(mask.sum()), 3), dtype=np.uint8)
+                intensity = rng.integers(0, 256, int(mask.sum())).astype(np.float32)
+                cloud = make_cloud(points[mask, :3], colors, {"intensity": intensity})
+                write_pcd(os.path.join(pcd_dir, scene, "velodyne", f"{frame}.pcd"), cloud)
+                if tag == 1:
+                    # Same cloud under the numeric name extract_intensity and pipeline read
+                    write_pcd(os.path.join(intensity_pcd_dir, f"{int(frame)}.pcd"), cloud)
+    return scenes
+
+
+def configure(root, scenes, num_frames):
+    """Point every script's module constants at the synthetic tree"""
+    paths = layout(root)
+    os.chdir(root)  # split_lidar's partitions are relative to the working directory
+    catalog.CATALOG_CACHE_DIR = os.path.join(root, "catalog-cache")
+
+    split_lidar.base_input_dir = paths["sequences"]
+    split_lidar.scenes = scenes
+
+    # LIDAR0 has no intensity PCDs here, so its filtered scans are merged as they are
+    merge_lidar.LIDAR0_DIR = paths["filtered"][0]
+    merge_lidar.LIDAR1_DIR = paths["extracted"]
+    merge_lidar.LIDAR0_LABEL_DIR = paths["filtered"][0]
+    merge_lidar.LIDAR1_LABEL_DIR = paths["filtered"][1]
+    merge_lidar.OUTPUT_DIR = paths["merged"]
+    merge_lidar.scenes = scenes
+    merge_lidar.FRAME_RANGE = (0, None)
+
+    compile_pcd.LIDAR0_DIR = paths["lidar_pcd"][0]
+    compile_pcd.LIDAR1_DIR = paths["lidar_pcd"][1]
+    compile_pcd.OUTPUT_DIR = paths["merged_pcd"]
+    compile_pcd.scenes = scenes
+    compile_pcd.FRAME_RANGE = (0, None)
+
+    range_image.INPUT_DIR = paths["merged"]
+
+    pipeline.INPUT_DIR = paths["sequences"]
+    pipeline.OUTPUT_DIR = paths["pipeline"]
+    pipeline.INTENSITY_PCD_DIRS = {1: paths["intensity_pcd"]}
+    pipeline.FILTERED_DIRS = paths["filtered"]
+    pipeline.INTENSITY_DIRS = {0: paths["filtered"][0], 1: paths["extracted"]}
+
+
+def run_split(root, scenes, args):
+    split_lidar.main(["--workers", str(args.workers)])
+
+
+def run_intensity(root, scenes, args):
+    """extract_intensity over every scene's LIDAR1 partition"""
+    paths = layout(root)
+    for scene in scenes:
+        extract_intensity.PCD_BASE_DIR = paths["intensity_pcd"].format(scene=scene)
+        extract_intensity.BIN_BASE_DIR = os.path.join(paths["filtered"][1], scene, "velodyne")
+        extract_intensity.OUTPUT_DIR = os.path.join(paths["extracted"], scene, "velodyne")
+        extract_intensity.main(["--workers", str(args.workers)])
+
+
+def run_merge(root, scenes, args):
+    merge_lidar.main(["--workers", str(args.workers), "--force"])
+
+
+def run_merge_quantized(root, scenes, args):
+    merge_lidar.OUTPUT_DIR = layout(root)["merged_quantized"]
+    merge_lidar.main(["--workers", str(args.workers), "--force", "--codec", "quantized"])
+
+
+def run_merge_reordered(root, scenes, args):
+    merge_lidar.OUTPUT_DIR = layout(root)["merged_reordered"]
+    merge_lidar.main(["--workers", str(args.workers), "--force", "--codec", "quantized", "--reorder", "morton"])
+
+
+def run_range_image(root, scenes, args):
+    range_image.main(["--workers", str(args.workers), "--force"])
+
+
+def run_pcd_merge(root, scenes, args):
+    compile_pcd.main(["--workers", str(args.workers)])
+
+
+def run_pipeline(root, scenes, args):
+    pipeline.main(["--workers", str(args.workers)])
+
+
+def tree_files(*directories):
+    """Paths of the files under some directories"""
+    return [os.path.join(dirpath, name)
+            for directory in directories for dirpath, _, filenames in os.walk(directory) for name in filenames]
+
+
+def stage_inputs(stage, root, scenes):
+    """(points, bytes) a stage reads"""
+    paths = layout(root)
+    if stage in ("split", "pipeline"):
+        files = tree_files(paths["sequences"])
+    elif stage == "intensity":
+        files = [path for path in tree_files(paths["filtered"][1]) if path.endswith(".bin")]
+        files += tree_files(*(paths["intensity_pcd"].format(scene=scene) for scene in scenes))
+    elif stage in OUTPUT_TREES:
+        files = tree_files(paths["filtered"][0], paths["extracted"])
+        files += [path for path in tree_files(paths["filtered"][1]) if path.endswith(".label")]
+    elif stage == "range_image":
+        files = [path for path in tree_files(paths["merged"]) if path.endswith((".bin", ".label"))]
+    else:
+        files = tree_files(*paths["lidar_pcd"].values())
+        # x, y, z, rgb, intensity: 20 bytes per point (headers are negligible)
+        return sum(os.path.getsize(path) for path in files) // 20, sum(os.path.getsize(path) for path in files)
+    points = sum(os.path.getsize(path) for path in files if path.endswith(".bin")) // 16
+    return points, sum(os.path.getsize(path) for path in files)
+
+
+# Stages whose output size is of interest -> the tree they write
+OUTPUT_TREES = {"merge": "merged", "merge_quantized": "merged_quantized", "merge_reordered": "merged_reordered"}
+
+
+def stage_outputs(stage, root):
+    """Bytes a stage wrote, for the stages whose output size is of interest (else None)"""
+    if stage not in OUTPUT_TREES:
+        return None
+    return sum(os.path.getsize(path) for path in tree_files(layout(root)[OUTPUT_TREES[stage]])
+               if os.path.basename(path) != MANIFEST_NAME)
+
+
+def time_radius_search(root, radius=SEARCH_RADIUS, curve="morton"):
+    """Seconds to look up every point's nearest neighbour within `radius` in the plain merged frames
+
+    Returns (seconds in scan order, seconds after sorting each frame along
+    `curve`); the sort itself is not timed.
+    """
+    timings = {"raw": 0.0, curve: 0.0}
+    for path in tree_files(layout(root)["merged"]):
+        if not path.endswith(".bin"):
+            continue
+        xyz = np.fromfile(path, dtype=np.float32).reshape(-1, 4)[:, :3]
+        order, _ = curve_order(xyz, curve)
+        for name, points in (("raw", xyz), (curve, xyz[order])):
+            start = time.perf_counter()
+            VoxelIndex(points, radius).query(points)
+            timings[name] += time.perf_counter() - start
+    return timings["raw"], timings[curve]
+
+
+# Stages whose outputs a stage reads
+DEPENDENCIES = {"intensity": ["split"], "merge": ["split", "intensity"], "merge_quantized": ["split", "intensity"],
+                "merge_reordered": ["split", "intensity"], "range_image": ["split", "intensity", "merge"]}
+
+# Stage name -> runner, in dependency order
+STAGES = {
+    "split": run_split,
+    "intensity": run_intensity,
+    "merge": run_merge,
+    "merge_quantized": run_merge_quantized,
+    "merge_reordered": run_merge_reordered,
+    "range_image": run_range_image,
+    "pcd_merge": run_pcd_merge,
+    "pipeline": run_pipeline,
+}
+
+
+def _peak_rss_mb():
+    """Peak resident set size of this process and of its finished children, in MB"""
+    scale = 1 if sys.platform == "darwin" else 1024  # ru_maxrss is bytes on macOS, KB on Linux
+    own = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * scale / 1e6
+    children = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss * scale / 1e6
+    return own, children
+
+
+def _run_stage(stage, root, scenes, num_frames, args):
+    """Run one stage in a fresh process, with its log discarded; returns (seconds, peak RSS MB, exit status)
+
+    The exit status is that of a script exiting with sys.exit (0 if it returned).
+    """
+    configure(root, scenes, num_frames)
+    status = 0
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        start = time.perf_counter()
+        try:
+            STAGES[stage](root, scenes, args)
+        except SystemExit as e:
+            status = e.code or 0
+        seconds = time.perf_counter() - start
+    own, children = _peak_rss_mb()
+    return seconds, max(own, children), status
+
+
+def time_stage(stage, root, scenes, num_frames, args):
+    """Best-of-`repeat` timing of a stage, each run in its own process
+
+    A stage that fails is not timed: its result is {"failed": True, "exit_status": ...}.
+    """
+    runs = []
+    for _ in range(args.repeat):
+        with ProcessPoolExecutor(max_workers=1) as pool:
+            runs.append(pool.submit(_run_stage, stage, root, scenes, num_frames, args).result())
+        if runs[-1][2]:
+            return {"failed": True, "exit_status": runs[-1][2]}
+    seconds = min(run[0] for run in runs)
+    points, size = stage_inputs(stage, root, scenes)
+    result = {
+        "seconds": round(seconds, 4),
+        "points": points,
+        "bytes": size,
+        "points_per_sec": round(points / seconds),
+        "mb_per_sec": round(size / 1e6 / seconds, 2),
+        "peak_rss_mb": round(max(run[1] for run in runs), 1),
+    }
+    # A plain merge writes exactly what it reads, so the input size is the raw output size
+    output_bytes = stage_outputs(stage, root)
+    if output_bytes is not None:
+        result["output_bytes"] = output_bytes
+        result["bytes_saved"] = size - output_bytes
+    return result
+
+
+def compare(results, baseline, threshold=REGRESSION_THRESHOLD):
+    """Lines comparing stage throughput to a baseline run, and the stages that regressed
+
+    A stage that failed counts as a regression; one without a baseline
+    throughput (missing, failed or zero) is not compared.
+    """
+    lines = []
+    regressions = []
+    for stage, result in results["stages"].items():
+        before = baseline.get("stages", {}).get(stage)
+        if before is None:
+            continue
+        if result.get("failed"):
+            regressions.append(stage)
+            lines.append(f"[REGRESSION] {stage}: failed")
+            continue
+        if not before.get("points_per_sec"):
+            lines.append(f"[WARNING] {stage}: no baseline throughput to compare with")
+            continue
+        ratio = result["points_per_sec"] / before["points_per_sec"]
+        status = "OK"
+        if ratio < 1 - threshold:
+            status = "REGRESSION"
+            regressions.append(stage)
+        lines.append(f"[{status}] {stage}: {before['points_per_sec']:,} -> {result['points_per_sec']:,} points/s "
+                     f"({ratio:.2f}x)")
+    return lines, regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Time every stage on synthetic SemanticKITTI-style data")
+    parser.add_argument("--scenes", type=int, default=2, help="Number of synthetic scenes (default: 2)")
+    parser.add_argument("--frames", type=int, default=10, help="Frames per scene (default: 10)")
+    parser.add_argument("--points", type=int, default=120000, help="Points per scan (default: 120000)")
+    parser.add_argument("--stages", nargs="+", choices=list(STAGES), default=list(STAGES),
+                        help="Stages to time (default: all, in dependency order)")
+    parser.add_argument("--workers", type=int, default=1, help="--workers passed to every stage (default: 1)")
+    parser.add_argument("--repeat", type=int, default=1, help="Runs per stage; the fastest is kept (default: 1)")
+    parser.add_argument("--root", help="Directory for the synthetic data (default: a temporary directory)")
+    parser.add_argument("--output", help="Write the results as JSON to this file")
+    parser.add_argument("--compare", metavar="BASELINE", help="Compare against an earlier --output file")
+    args = parser.parse_args(argv)
+
+    with contextlib.ExitStack() as stack:
+        root = args.root or stack.enter_context(tempfile.TemporaryDirectory(prefix="lidar-bench-"))
+        root = os.path.abspath(root)
+
+        start = time.perf_counter()
+        scenes = generate(root, args.scenes, args.frames, args.points)
+        print(f"[OK] Generated {args.scenes} scenes x {args.frames} frames x {args.points:,} points "
+              f"in {time.perf_counter() - start:.1f}s under {root}")
+
+        results = {
+            "config": {"scenes": args.scenes, "frames": args.frames, "points": args.points,
+                       "workers": args.workers, "repeat": args.repeat},
+            "environment": {"python": platform.python_version(), "numpy": np.__version__,
+                            "platform": platform.platform(), "cpus": os.cpu_count()},
+            "stages": {},
+        }
+        # Stages run in dependency order; untimed dependencies of timed stages run once first
+        needed = {dependency for stage in args.stages for dependency in DEPENDENCIES.get(stage, [])}
+        failed = []
+        for stage in STAGES:
+            if stage not in args.stages:
+                if stage in needed:
+                    status = _run_stage(stage, root, scenes, args.frames, args)[2]
+                    if status:
+                        failed.append(stage)
+                        print(f"[ERROR] {stage} (run for the stages that need it) exited with status {status}")
+                continue
+            result = time_stage(stage, root, scenes, args.frames, args)
+            results["stages"][stage] = result
+            if result.get("failed"):
+                failed.append(stage)
+                print(f"[ERROR] {stage}: exited with status {result['exit_status']}, not timed")
+                continue
+            print(f"[OK] {stage}: {result['seconds']:.3f}s, {result['points_per_sec']:,} points/s, "
+                  f"{result['mb_per_sec']} MB/s, peak RSS {result['peak_rss_mb']} MB")
+            if result.get("bytes_saved"):
+                print(f"     {stage} output: {result['output_bytes'] / 1e6:.1f} MB, "
+                      f"{result['bytes_saved'] / 1e6:.1f} MB ({result['bytes_saved'] / result['bytes']:.0%}) "
+                      "smaller than raw")
+
+        # Neighbour queries on the plain merged frames, in scan order and Morton order
+        if "merge" in args.stages and "merge" not in failed:
+            raw_seconds, sorted_seconds = time_radius_search(root)
+            results["radius_search"] = {"radius": SEARCH_RADIUS, "raw_seconds": round(raw_seconds, 4),
+                                        "morton_seconds": round(sorted_seconds, 4),
+                                        "speedup": round(raw_seconds / sorted_seconds, 2)}
+            print(f"[OK] radius search ({SEARCH_RADIUS} m): {raw_seconds:.3f}s in scan order, "
+                  f"{sorted_seconds:.3f}s in Morton order ({raw_seconds / sorted_seconds:.2f}x)")
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+        print(f"Results written to {args.output}")
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        lines, regressions = compare(results, baseline)
+        print("\n".join(lines))
+        if regressions:
+            sys.exit(1)
+
+    if failed:
+        print(f"\n{len(failed)} stages failed: {', '.join(failed)}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
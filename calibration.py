@@ -0,0 +1,82 @@
+import json
+from collections import namedtuple
+import numpy as np
+
+# One lidar of the rig: its point and label trees and its 4x4 sensor-to-rig
+# extrinsic (None when the sensor is already in the rig frame)
+Sensor = namedtuple("Sensor", "name points_dir labels_dir extrinsic")
+
+
+def add_calibration_argument(parser):
+    """Add the shared --calibration option to a script's argument parser"""
+    parser.add_argument("--calibration", metavar="FILE",
+                        help="JSON rig description: sensor name -> {\"extrinsic\": 4x4 matrix, \"points\": dir, "
+                             "\"labels\": dir}, in merge order (default: LIDAR0 and LIDAR1, untransformed)")
+
+
+def parse_extrinsic(name, matrix):
+    """Validate a 4x4 rigid transform; None if it is the identity"""
+    extrinsic = np.asarray(matrix, dtype=np.float64)
+    if extrinsic.shape != (4, 4):
+        raise ValueError(f"{name}: extrinsic must be a 4x4 matrix, got shape {extrinsic.shape}")
+    if not np.allclose(extrinsic[3], (0, 0, 0, 1)):
+        raise ValueError(f"{name}: last extrinsic row must be [0, 0, 0, 1]")
+    if np.allclose(extrinsic, np.eye(4)):
+        return None
+    return extrinsic.astype(np.float32)
+
+
+def load_rig(path, defaults):
+    """Sensors of a rig, in merge order
+
+    `defaults` maps sensor name -> (points dir, labels dir) and is the rig
+    used without a calibration file. A calibration file lists the sensors to
+    merge; each entry may give its extrinsic and its trees (sensors not in
+    `defaults` must give both trees).
+    """
+    if path is None:
+        return [Sensor(name, points_dir, labels_dir, None) for name, (points_dir, labels_dir) in defaults.items()]
+
+    with open(path) as f:
+        calibration = json.load(f)
+    if not calibration:
+        raise ValueError(f"No sensors in calibration file {path}")
+
+    rig = []
+    for name, entry in calibration.items():
+        points_dir, labels_dir = defaults.get(name, (None, None))
+        points_dir = entry.get("points", points_dir)
+        labels_dir = entry.get("labels", labels_dir)
+        if points_dir is None or labels_dir is None:
+            raise ValueError(f"{name}: calibration entry needs \"points\" and \"labels\" directories")
+        extrinsic = parse_extrinsic(name, entry["extrinsic"]) if "extrinsic" in entry else None
+        rig.append(Sensor(name, points_dir, labels_dir, extrinsic))
+    if len(rig) > np.iinfo(np.uint8).max + 1:
+        raise ValueError(f"At most 256 sensors fit the uint8 sensor-id channel, got {len(rig)}")
+    return rig
+
+
+def rig_settings(rig):
+    """Extrinsics of a rig for the build manifest (None if no sensor is transformed)"""
+    extrinsics = {sensor.name: sensor.extrinsic.tolist() for sensor in rig if sensor.extrinsic is not None}
+    return extrinsics or None
+
+
+def transform_into(out, points, extrinsic):
+    """Write Nx4 [x, y, z, remission] points into `out` (same shape), xyz mapped by a 4x4 extrinsic
+
+    The rotation is one float32 matmul straight into `out`; nothing is
+    allocated per sensor.
+    """
+    if extrinsic is None:
+        out[:] = points
+        return out
+    np.matmul(points[:, :3], extrinsic[:3, :3].T, out=out[:, :3])
+    out[:, :3] += extrinsic[:3, 3]
+    out[:, 3] = points[:, 3]
+    return out
+
+
+def sensor_ids(counts):
+    """uint8 id (merge order) of every point of sensors with these point counts"""
+    return np.repeat(np.arange(len(counts), dtype=np.uint8), counts)
@@ -0,0 +1,264 @@
+import hashlib
+import json
+import os
+import time
+from collections import namedtuple
+
+# Where the listings of input trees are cached, one JSON file per tree root
+CATALOG_CACHE_DIR = os.path.join(os.path.expanduser("~"), ".cache", "lidar_catalog")
+
+# A directory changed less than this long (ns) before it was listed is listed
+# again next time: a later change within the same mtime tick would go unseen
+RACY_NS = 2 * 10**9
+
+# Levels listed below a tree root: <root>/<scene>/<subdir>/<files>
+TREE_DEPTH = 2
+
+# Modality -> (subdirectory, extension, bytes per point or None if the size does not give the count)
+MODALITIES = {
+    "points": ("velodyne", ".bin", 16),
+    "labels": ("labels", ".label", 4),
+    "pcd": ("velodyne", ".pcd", None),
+    "qpoints": ("velodyne", ".qbin", None),
+    "qlabels": ("labels", ".qlabel", None),
+}
+POINT_SIZES = {ext: point_size for _, ext, point_size in MODALITIES.values()}
+
+
+class FileEntry(namedtuple("FileEntry", "path st_size st_mtime_ns")):
+    """One catalogued file; st_size and st_mtime_ns let it stand in for a stat result"""
+
+    __slots__ = ()
+
+    @property
+    def count(self):
+        """Points implied by the file size (None for PCDs or a size that is not a whole number of points)"""
+        point_size = POINT_SIZES.get(os.path.splitext(self.path)[1])
+        if point_size is None or self.st_size % point_size:
+            return None
+        return self.st_size // point_size
+
+
+class TreeCatalog:
+    """Listing of a <root>/<scene>/<subdir>/<file> tree, cached across runs
+
+    Every directory is listed with one os.scandir pass. The listing is kept in
+    CATALOG_CACHE_DIR and a directory is only listed again when its mtime
+    changed, so an unchanged tree costs one stat per directory instead of one
+    per file. Files replaced by rename (as all scripts here write) change their
+    directory's mtime; a file rewritten in place does not, so pass
+    refresh=True after editing files in place.
+    """
+
+    def __init__(self, root, cache_dir=None, refresh=False):
+        self.root = os.path.abspath(root)
+        cache_dir = CATALOG_CACHE_DIR if cache_dir is None else cache_dir
+        digest = hashlib.sha1(self.root.encode()).hexdigest()[:16]
+        self.cache_path = os.path.join(cache_dir, f"{digest}.json") if cache_dir else None
+        self.dirs = {}
+        self.listed = 0
+        self._files = {}
+
+        cached = {} if refresh else self._load()
+        self._walk("", cached, 0)
+        if self.listed or self.dirs.keys() != cached.keys():
+            self._save()
+
+    def _load(self):
+        if self.cache_path is None or not os.path.exists(self.cache_path):
+            return {}
+        try:
+            with open(self.cache_path) as f:
+                cache = json.load(f)
+        except ValueError:
+            return {}
+        return cache["dirs"] if cache.get("root") == self.root else {}
+
+    def _save(self):
+        if self.cache_path is None:
+            return
+        os.makedirs(os.path.dirname(self.cache_path), exist_ok=True)
+        tmp_path = f"{self.cache_path}.tmp.{os.getpid()}"
+        with open(tmp_path, "w") as f:
+            json.dump({"root": self.root, "dirs": self.dirs}, f)
+        os.replace(tmp_path, self.cache_path)
+
+    def _walk(self, rel, cached, depth):
+        path = os.path.join(self.root, rel)
+        try:
+            mtime = os.stat(path).st_mtime_ns
+        except FileNotFoundError:
+            return
+
+        # Reuse the cached listing while the directory is unchanged
+        entry = cached.get(rel)
+        if entry is None or entry["mtime_ns"] != mtime or entry["listed_ns"] - mtime < RACY_NS:
+            entry = self._list(path, mtime)
+            self.listed += 1
+        self.dirs[rel] = entry
+
+        if depth < TREE_DEPTH:
+            for name in entry["dirs"]:
+                self._walk(os.path.join(rel, name) if rel else name, cached, depth + 1)
+
+    @staticmethod
+    def _list(path, mtime):
+        files = {}
+        dirs = []
+        with os.scandir(path) as entries:
+            for entry in entries:
+                if entry.is_dir():
+                    dirs.append(entry.name)
+                elif entry.is_file():
+                    st = entry.stat()
+                    files[entry.name] = [st.st_size, st.st_mtime_ns]
+        return {"mtime_ns": mtime, "listed_ns": time.time_ns(), "dirs": sorted(dirs), "files": files}
+
+    def scenes(self):
+        return self.dirs[""]["dirs"] if "" in self.dirs else []
+
+    def files(self, scene, subdir, ext):
+        """{frame id: FileEntry} of the `ext` files in <root>/<scene>/<subdir>"""
+        key = (scene, subdir, ext)
+        if key not in self._files:
+            directory = os.path.join(scene, subdir)
+            listing = self.dirs.get(directory, {"files": {}})["files"]
+            self._files[key] = {name[:-len(ext)]: FileEntry(os.path.join(self.root, directory, name), *stat)
+                                for name, stat in listing.items() if name.endswith(ext)}
+        return self._files[key]
+
+
+def select_frames(frame_ids, frames=None, start=None, stop=None, stride=None):
+    """(selected, missing, excluded): the frame ids matching a selection, in numeric order
+
+    `frames` is an explicit list of ids (compared numerically, so "5" is
+    "005"); explicit ids that are not in `frame_ids` come back as `missing`,
+    those that `start`/`stop`/`stride` leave out as `excluded`.
+    `start`/`stop` bound the ids to [start, stop) and `stride` keeps every
+    stride-th id counted from `start` (or 0).
+    """
+    by_number = {int(frame): frame for frame in frame_ids if frame.isdigit()}
+    missing = []
+    if frames is not None:
+        numbers = []
+        for frame in frames:
+            if int(frame) in by_number:
+                numbers.append(int(frame))
+            else:
+                missing.append(frame)
+    else:
+        numbers = by_number
+
+    origin = start or 0
+    selected = []
+    excluded = []
+    for number in sorted(set(numbers)):
+        if (start is None or number >= start) and (stop is None or number < stop) \
+                and (not stride or (number - origin) % stride == 0):
+            selected.append(by_number[number])
+        elif frames is not None:
+            excluded.append(by_number[number])
+    return selected, missing, excluded
+
+
+def excluded_messages(excluded):
+    """Warning naming the explicitly requested frames that --range/--stride left out"""
+    if not excluded:
+        return []
+    return [f"[WARNING] Frames outside --range/--stride, skipped: {', '.join(excluded)}"]
+
+
+def add_selection_arguments(parser, start=None, stop=None, stride=None):
+    """Add the shared scene/frame selection options to a script's argument parser
+
+    The keyword arguments are the script's default frame selection; an
+    explicit --frames list is only narrowed by a --range/--stride given with it.
+    """
+    parser.add_argument("--scenes", nargs="+", help="Scenes to process (default: every scene found)")
+    parser.add_argument("--frames", nargs="+", type=int, metavar="ID", help="Process exactly these frame ids")
+    parser.add_argument("--range", nargs=2, type=int, metavar=("START", "STOP"),
+                        help=f"Process frame ids in [START, STOP) (default without --frames: {start}, {stop})")
+    parser.add_argument("--stride", type=int,
+                        help=f"Process every STRIDE-th frame id, counted from START "
+                             f"(default without --frames: {stride})")
+    parser.set_defaults(default_selection=(start, stop, stride))
+    parser.add_argument("--refresh-catalog", action="store_true",
+                        help="List the input trees again instead of trusting the cached catalog")
+
+
+def frame_query(args):
+    """The select_frames keyword arguments of parsed selection options"""
+    default_start, default_stop, default_stride = args.default_selection
+    if args.frames is not None:
+        # Explicit ids are not narrowed by the script's defaults
+        default_start = default_stop = default_stride = None
+    start, stop = args.range or (default_start, default_stop)
+    stride = default_stride if args.stride is None else args.stride
+    return {"frames": args.frames, "start": start, "stop": stop, "stride": stride}
+
+
+class Catalog:
+    """Scenes and frames of several sensors' trees, by scene, frame, sensor and modality
+
+    `layout` maps sensor -> {modality: tree root}, with modalities from
+    MODALITIES. The first modality of the first sensor is the reference: its
+    scenes and frames are the ones selected, the others are looked up by
+    frame id. Every distinct root is listed (or loaded from cache) once.
+    """
+
+    def __init__(self, layout, cache_dir=None, refresh=False):
+        self.layout = layout
+        self.trees = {}
+        for modalities in layout.values():
+            for root in modalities.values():
+                if root not in self.trees:
+                    self.trees[root] = TreeCatalog(root, cache_dir, refresh)
+        self.sensor = next(iter(layout))
+        self.modality = next(iter(layout[self.sensor]))
+
+    @property
+    def listed(self):
+        """Directories actually listed (the rest came from the cache)"""
+        return sum(tree.listed for tree in self.trees.values())
+
+    def scenes(self):
+        """Scenes of the reference tree"""
+        return self.trees[self.layout[self.sensor][self.modality]].scenes()
+
+    def files(self, sensor, modality, scene):
+        """{frame id: FileEntry} of one sensor's modality in a scene ({} if the sensor lacks it)"""
+        root = self.layout[sensor].get(modality)
+        if root is None:
+            return {}
+        subdir, ext, _ = MODALITIES[modality]
+        return self.trees[root].files(scene, subdir, ext)
+
+    def entry(self, sensor, modality, scene, frame):
+        """FileEntry of one file, or None if it is missing"""
+        return self.files(sensor, modality, scene).get(frame)
+
+    def path(self, sensor, modality, scene, frame):
+        """Where a file of the layout lives, whether or not it exists"""
+        subdir, ext, _ = MODALITIES[modality]
+        return os.path.join(self.layout[sensor][modality], scene, subdir, f"{frame}{ext}")
+
+    def select(self, scene, frames=None, start=None, stop=None, stride=None):
+        """(frame ids, messages) of a scene's reference frames matching a selection"""
+        selected, missing, excluded = select_frames(list(self.files(self.sensor, self.modality, scene)),
+                                                    frames, start, stop, stride)
+        messages = [f"[WARNING] {self.sensor} has no {self.modality} file for frame {frame}" for frame in missing]
+        return selected, messages + excluded_messages(excluded)
+
+    def check(self, scene, frame):
+        """Problems visible from file sizes alone: partial points, or point and label counts that differ"""
+        problems = []
+        for sensor, modalities in self.layout.items():
+            entries = {modality: self.entry(sensor, modality, scene, frame) for modality in modalities}
+            for modality, entry in entries.items():
+                if entry is not None and MODALITIES[modality][2] and entry.count is None:
+                    problems.append(f"{sensor} {modality} size {entry.st_size} is not a whole number of points")
+            points, labels = entries.get("points"), entries.get("labels")
+            if points is not None and labels is not None and None not in (points.count, labels.count) \
+                    and points.count != labels.count:
+                problems.append(f"{sensor} has {points.count:,} points but {labels.count:,} labels")
+        return problems
@@ -1,54 +1,84 @@
+import argparse
 import os
+from functools import partial
 import numpy as np
-from pypcd4 import PointCloud
+from catalog import Catalog, add_selection_arguments, frame_query
+from frame_io import add_io_depth_argument, mapped, write_behind
+from metrics import Monitor, add_metrics_arguments, report_scene, stage
+from parallel import add_workers_argument, frame_result, run_scenes
+from pcd_cache import add_pcd_cache_arguments, pcd_cache_from_args
+from pcd_io import field_columns, make_cloud, read_pcd, read_pcd_header, unpack_rgb, write_pcd
+from spatial_index import (CURVE_BITS, VoxelGrid, add_reorder_arguments, add_voxel_arguments, compression_report,
+                           curve_order)
 
 # Directory paths
 LIDAR0_DIR = "/home/ezarisma/Downloads/Practice/Semantic-KITTI-API-DPAI-main-ver3/lidar_pcd/lidar_0"
 LIDAR1_DIR = "/home/ezarisma/Downloads/Practice/Semantic-KITTI-API-DPAI-main-ver3/lidar_pcd/lidar_1"
 OUTPUT_DIR = "/home/ezarisma/Downloads/Practice/Semantic-KITTI-API-DPAI-main-ver3/new"
 
-# Scenes and frames to merge
-scenes = ["00", "01", "02", "03", "04", "05", "06", "07"]
-frames_to_merge = ["000", "005", "010", "015", "020", "025", "030", "035", "040", "045", 
-                   "050", "055", "060", "065", "070", "075", "080", "085", "090", "095"]
+# Scenes to merge (None: every scene of the LIDAR0 tree) and the default
+# frame selection: every 5th frame id below 100
+scenes = None
+FRAME_RANGE = (0, 100)
+FRAME_STRIDE = 5
 
-print("MERGING LIDAR0 AND LIDAR1 .PCD FILES INTO SINGLE FILES")
-print("=" * 80)
+# Output encoding: "binary" or "binary_compressed"
+PCD_DATA_FORMAT = "binary"
 
-# Create output directory
-os.makedirs(OUTPUT_DIR, exist_ok=True)
+# Fields folded into the packed colors
+COLOR_FIELDS = ("rgb", "r", "g", "b")
 
-def read_pcd_file(pcd_path):
-    """Read PCD file and return point cloud data"""
+# Extra fields averaged in centroid voxel reduction (the others come from the voxel's first point)
+AVERAGED_FIELDS = ("intensity", "remission")
+
+def read_pcd_file(pcd_path, errors, cache=None):
+    """Read PCD file and return point cloud data (its decoded fields mapped from `cache` if given)"""
     try:
-        # Read the PCD file using pypcd4
-        pc = PointCloud.from_path(pcd_path)
-        
-        # Get points (x, y, z)
-        points = pc.numpy(("x", "y", "z"))
+        header = read_pcd_header(pcd_path)
+        fields = header["dtype"].names
+        if cache is None:
+            # Map the PCD payload; the arrays below are views into it where possible
+            cloud = read_pcd(pcd_path, header)
+            points = field_columns(cloud, ("x", "y", "z"))
+            rgb = cloud
+        else:
+            # One mapped array per field
+            cloud = cache.read(pcd_path, fields, header)
+            points = np.column_stack([cloud[name] for name in ("x", "y", "z")])
+            rgb = cloud.get("rgb")
         
         # Get colors if available
         colors = None
-        if "rgb" in pc.fields:
-            # Handle RGB field (stored as float in PCD format)
-            rgb_data = pc.numpy("rgb")
-            # Convert float RGB to uint8 (0-255)
-            rgb_uint8 = np.frombuffer(rgb_data.astype(np.float32).tobytes(), dtype=np.uint8)
-            colors = rgb_uint8.reshape(-1, 4)[:, :3]  # Remove alpha channel if present
-        elif all(f in pc.fields for f in ['r', 'g', 'b']):
+        if "rgb" in fields:
+            # Packed float RGB -> its uint8 channel bytes (alpha dropped)
+            colors = unpack_rgb(rgb)
+        elif all(f in fields for f in ['r', 'g', 'b']):
             # If separate r, g, b fields exist
-            colors = pc.numpy(("r", "g", "b"))
+            colors = np.column_stack([cloud[name] for name in ("r", "g", "b")])
+        
+        # Keep every other field (intensity, ring, timestamp, ...) with its own dtype
+        extras = {}
+        for field in fields:
+            if field not in COLOR_FIELDS and field not in ("x", "y", "z"):
+                extras[field] = cloud[field]
         
-        count = len(pc)
+        count = len(points)
         
-        return points, colors, count, pc
+        return points, colors, count, extras
         
     except FileNotFoundError:
         return None, None, 0, None
     except Exception as e:
-        print(f"Error reading PCD file {pcd_path}: {e}")
+        errors.append(f"Error reading PCD file {pcd_path}: {e}")
         return None, None, 0, None
 
+def pcd_point_count(pcd_path):
+    """Number of points in a PCD file, from its header only (0 if missing/unreadable)"""
+    try:
+        return read_pcd_header(pcd_path)["points"]
+    except (OSError, ValueError, KeyError):
+        return 0
+
 def merge_point_clouds(points1, colors1, points2, colors2):
     """Merge two point clouds"""
     if points2 is None or len(points2) == 0:
@@ -66,116 +96,197 @@ def merge_point_clouds(points1, colors1, points2, colors2):
     
     return merged_points, merged_colors
 
-def save_pcd_file(points, colors, output_path, original_pc):
-    """Save PCD file by copying and modifying an existing PointCloud"""
-    try:
-        if original_pc is None:
-            raise Exception("No original point cloud provided")
-        
-        # Create a copy of the original point cloud
-        pc_copy = PointCloud.from_path(original_pc._path) if hasattr(original_pc, '_path') else original_pc
-        
-        # Create new data array
-        dtype = []
-        if colors is not None:
-            dtype = [('x', 'f4'), ('y', 'f4'), ('z', 'f4'), ('rgb', 'f4')]
-        else:
-            dtype = [('x', 'f4'), ('y', 'f4'), ('z', 'f4')]
-        
-        data = np.zeros(len(points), dtype=dtype)
-        data['x'] = points[:, 0].astype('f4')
-        data['y'] = points[:, 1].astype('f4')
-        data['z'] = points[:, 2].astype('f4')
-        
+def merge_extra_fields(extras1, extras2):
+    """Concatenate the extra fields present in both clouds"""
+    return {name: np.concatenate((extras1[name], extras2[name]))
+            for name in extras1 if name in extras2}
+
+def downsample_cloud(points, colors, extras, voxel_size, mode):
+    """Reduce points, colors and extra fields to one point per voxel"""
+    grid = VoxelGrid(points, voxel_size)
+    intensity_name = next((name for name in AVERAGED_FIELDS if name in extras), None)
+    if mode == "centroid":
+        first = grid.first()
+        points = grid.mean(points).astype(points.dtype)
         if colors is not None:
-            # Pack RGB into float32
-            if colors.dtype != np.uint8:
-                colors_uint8 = colors.astype(np.uint8)
-            else:
-                colors_uint8 = colors
-            
-            rgb_packed = np.zeros(len(points), dtype=np.float32)
-            for i in range(len(points)):
-                r, g, b = colors_uint8[i] if len(colors_uint8[i]) == 3 else (colors_uint8[i][0], colors_uint8[i][1], colors_uint8[i][2])
-                rgb_packed[i] = np.frombuffer(np.array([r, g, b, 0], dtype=np.uint8).tobytes(), dtype=np.float32)[0]
-            
-            data['rgb'] = rgb_packed
-        
-        # Update the point cloud with new data
-        pc_copy._data = data
-        pc_copy.save(output_path)
+            colors = np.rint(grid.mean(colors)).astype(colors.dtype)
+        extras = {name: grid.mean(values).astype(values.dtype) if name in AVERAGED_FIELDS else values[first]
+                  for name, values in extras.items()}
+        return points, colors, extras
+
+    keep = grid.representatives(mode, extras[intensity_name] if intensity_name else None)
+    return (points[keep], colors[keep] if colors is not None else None,
+            {name: values[keep] for name, values in extras.items()})
+
+def reorder_cloud(points, colors, extras, curve, bits=CURVE_BITS):
+    """Sort points, colors and extra fields along a space-filling curve"""
+    order, _ = curve_order(points[:, :3], curve, bits)
+    return (points[order], colors[order] if colors is not None else None,
+            {name: values[order] for name, values in extras.items()})
+
+def save_pcd_file(points, colors, output_path, errors, extras=None):
+    """Save points, packed colors and extra fields straight to a PCD file"""
+    try:
+        cloud = make_cloud(points, colors, extras)
+        write_behind(output_path, write_pcd, output_path, cloud, PCD_DATA_FORMAT)
         return True
         
     except Exception as e:
-        print(f"Error saving PCD file using copy method {output_path}: {e}")
+        errors.append(f"Error saving PCD file {output_path}: {e}")
         return False
 
-for scene in scenes:
-    print(f"\nScene {scene}")
+def input_catalog(refresh=False):
+    """Catalog of both sensors' PCD trees"""
+    return Catalog({"LIDAR0": {"pcd": LIDAR0_DIR}, "LIDAR1": {"pcd": LIDAR1_DIR}}, refresh=refresh)
+
+def plan_scene(scene, catalog, query):
+    """Return (messages, items) for one scene: one work item per selected frame to merge"""
+    lidar0_scene_dir = os.path.join(LIDAR0_DIR, scene, "velodyne")
+    if not catalog.files("LIDAR0", "pcd", scene):
+        return [f"Missing LIDAR0 directory: {lidar0_scene_dir}"], []
     
     # Create scene directory in output
     scene_output_dir = os.path.join(OUTPUT_DIR, scene, "velodyne")
     os.makedirs(scene_output_dir, exist_ok=True)
     
-    lidar0_scene_dir = os.path.join(LIDAR0_DIR, scene, "velodyne")
-    lidar1_scene_dir = os.path.join(LIDAR1_DIR, scene, "velodyne")
-    
-    if not os.path.exists(lidar0_scene_dir):
-        print(f"Missing LIDAR0 directory: {lidar0_scene_dir}")
-        continue
-    
-    for frame in frames_to_merge:
-        lidar0_file = os.path.join(lidar0_scene_dir, f"{frame}.pcd")
-        lidar1_file = os.path.join(lidar1_scene_dir, f"{frame}.pcd")
+    frames, messages = catalog.select(scene, **query)
+    items = []
+    for frame in frames:
+        lidar0_file = catalog.entry("LIDAR0", "pcd", scene, frame).path
+        lidar1_entry = catalog.entry("LIDAR1", "pcd", scene, frame)
+        lidar1_file = catalog.path("LIDAR1", "pcd", scene, frame)
+        lidar1_size = lidar1_entry.st_size if lidar1_entry is not None else None
         output_file = os.path.join(scene_output_dir, f"{frame}.pcd")
+        items.append((scene, frame, lidar0_file, lidar1_file, lidar1_size, output_file))
+    return messages, items
+
+def frame_inputs(item):
+    """Both PCDs of a frame; the frame loop advises them into the page cache before they are mapped"""
+    _, _, lidar0_file, lidar1_file, lidar1_size, _ = item
+    return [mapped(lidar0_file), mapped(lidar1_file)] if lidar1_size else [mapped(lidar0_file)]
+
+def merge_frame(item, voxel_size=None, voxel_mode="centroid", reorder=None, reorder_bits=CURVE_BITS, cache=None):
+    """Merge the LIDAR0 and LIDAR1 PCDs of one frame, optionally reduced to a voxel grid and sorted along a curve
+
+    PCD fields are read through `cache` if given.
+    """
+    _, frame, lidar0_file, lidar1_file, lidar1_size, output_file = item
+    prefix = f"Processing frame {frame}: "
+    errors = []
+    
+    try:
+        # Read LIDAR0 data
+        with stage("load"):
+            points0, colors0, count0, extras0 = read_pcd_file(lidar0_file, errors, cache)
         
-        print(f"Processing frame {frame}: ", end="")
+        if points0 is None or count0 ==0:
+            return frame_result("skipped", *errors, prefix + "Failed to read LIDAR0 file")
         
-        try:
-            # Read LIDAR0 data
-            points0, colors0, count0, pc0 = read_pcd_file(lidar0_file)
-            
-            if points0 is None or count0 ==0:
-                print("Failed to read LIDAR0 file")
-                continue
-            
-            # Check if LIDAR1 file exists and has data
-            lidar1_exists = os.path.exists(lidar1_file) and os.path.getsize(lidar1_file) > 0
-            points1, colors1, count1 = None, None, 0, None
-            
-            if lidar1_exists:
+        # Check if LIDAR1 file exists and has data (the catalog has its size)
+        lidar1_exists = bool(lidar1_size)
+        points1, colors1, count1, extras1 = None, None, 0, None
+        
+        if lidar1_exists:
+            # Header-only point count; the payload is only read if there is data
+            count1 = pcd_point_count(lidar1_file)
+            if count1 > 0:
                 # Read LIDAR1 data
-                points1, colors1, count1, pc1 = read_pcd_file(lidar1_file)
-            
-            # Only merge if LIDAR1 has MORE THAN 0 points
-            if lidar1_exists and points1 is not None and count1 > 0:
-                # Merge point clouds
+                with stage("load"):
+                    points1, colors1, count1, extras1 = read_pcd_file(lidar1_file, errors, cache)
+        
+        # Only merge if LIDAR1 has MORE THAN 0 points
+        if lidar1_exists and points1 is not None and count1 > 0:
+            # Merge point clouds
+            with stage("merge"):
                 merged_points, merged_colors = merge_point_clouds(points0, colors0, points1, colors1)
+                merged_extras = merge_extra_fields(extras0, extras1)
                 total_points = len(merged_points)
+                lines = [prefix + f"MERGED - {count0:,} + {count1:,} = {total_points:,} points"]
                 
-                success = save_pcd_file(merged_points, merged_colors, output_file, pc0)
-                
-                if success:
-                    print(f"MERGED - {count0:,} + {count1:,} = {total_points:,} points")
-                else:
-                    print("Failed to save merged file")
-            else:
+                if voxel_size:
+                    merged_points, merged_colors, merged_extras = downsample_cloud(
+                        merged_points, merged_colors, merged_extras, voxel_size, voxel_mode)
+                    lines.append(compression_report(voxel_size, voxel_mode, total_points, len(merged_points)))
             
-                # Use only LIDAR0 data (LIDAR1 has 0 points or doesn't exist)
-                success = save_pcd_file(points0, colors0, output_file, pc0)
-                
-                if success:
-                    if save_pcd_file(points0, colors0, output_file):
-                        if lidar1_exists and count1 == 0:
-                            print(f"LIDAR0 ONLY - {count0:,} points (LIDAR1 has 0 points)")
-                        elif lidar1_exists and points1 is None:
-                            print(f"LIDAR0 ONLY - {count0:,} points (LIDAR1 file corrupted)")
-                        else:
-                            print(f"LIDAR0 ONLY - {count0:,} points (LIDAR1 file missing)")
-                else:
-                    print("Failed to save LIDAR0 file")
-                    
-        except Exception as e:
-            print(f"Error: {e}")
-
-print("\nPCD file merging completed!")
+            if reorder:
+                with stage("reorder"):
+                    merged_points, merged_colors, merged_extras = reorder_cloud(
+                        merged_points, merged_colors, merged_extras, reorder, reorder_bits)
+            
+            with stage("write"):
+                saved = save_pcd_file(merged_points, merged_colors, output_file, errors, merged_extras)
+            if saved:
+                return frame_result("ok", *errors, *lines, points0=count0, points1=count1,
+                                    points_in=total_points, points_out=len(merged_points))
+            return frame_result("error", *errors, prefix + "Failed to save merged file")
+        
+        # Use only LIDAR0 data (LIDAR1 has 0 points or doesn't exist)
+        voxel_lines = []
+        if voxel_size:
+            with stage("merge"):
+                points0, colors0, extras0 = downsample_cloud(points0, colors0, extras0, voxel_size, voxel_mode)
+            voxel_lines.append(compression_report(voxel_size, voxel_mode, count0, len(points0)))
+        if reorder:
+            with stage("reorder"):
+                points0, colors0, extras0 = reorder_cloud(points0, colors0, extras0, reorder, reorder_bits)
+        with stage("write"):
+            saved = save_pcd_file(points0, colors0, output_file, errors, extras0)
+        if not saved:
+            return frame_result("error", *errors, prefix + "Failed to save LIDAR0 file")
+        
+        if lidar1_exists and count1 == 0:
+            reason = "LIDAR1 has 0 points"
+        elif lidar1_exists and points1 is None:
+            reason = "LIDAR1 file corrupted"
+        else:
+            reason = "LIDAR1 file missing"
+        return frame_result("ok", *errors, prefix + f"LIDAR0 ONLY - {count0:,} points ({reason})",
+                            *voxel_lines, points0=count0, points1=0, points_in=count0, points_out=len(points0))
+        
+    except Exception as e:
+        return frame_result("error", *errors, prefix + f"Error: {e}")
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Merge LIDAR0 and LIDAR1 .pcd files per frame")
+    add_workers_argument(parser)
+    add_io_depth_argument(parser)
+    add_voxel_arguments(parser)
+    add_reorder_arguments(parser)
+    add_pcd_cache_arguments(parser)
+    add_metrics_arguments(parser)
+    add_selection_arguments(parser, *FRAME_RANGE, FRAME_STRIDE)
+    args = parser.parse_args(argv)
+    cache = pcd_cache_from_args(args)
+    
+    print("MERGING LIDAR0 AND LIDAR1 .PCD FILES INTO SINGLE FILES")
+    print("=" * 80)
+    
+    # Create output directory
+    os.makedirs(OUTPUT_DIR, exist_ok=True)
+    
+    catalog = input_catalog(args.refresh_catalog)
+    query = frame_query(args)
+    messages = {}
+    plans = []
+    for scene in args.scenes or scenes or catalog.scenes():
+        messages[scene], items = plan_scene(scene, catalog, query)
+        plans.append((scene, items))
+    
+    merge = partial(merge_frame, voxel_size=args.voxel_size, voxel_mode=args.voxel_mode,
+                    reorder=args.reorder, reorder_bits=args.reorder_bits, cache=cache)
+    monitor = Monitor.from_args("compile_pcd", args)
+    # With the field cache, PCDs are only read on a miss: nothing to read ahead
+    prefetch = frame_inputs if cache is None else None
+    for scene, results in run_scenes(merge, plans, args.workers, prefetch=prefetch,
+                                     io_depth=args.io_depth, monitor=monitor):
+        report_scene(scene, messages[scene], results, args.verbose)
+    monitor.close()
+    if cache is not None:
+        removed, freed = cache.evict()
+        if removed:
+            print(f"[OK] PCD cache over {cache.max_mb:g} MB: evicted {removed} fields ({freed / 1e6:.1f} MB)")
+    
+    print("\nPCD file merging completed!")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,188 @@
+import os
+import numpy as np
+
+from manifest import scan_dir
+from pcd_io import read_pcd
+from point_codec import ENCODED_EXTS, decode, encoded_name
+
+
+def map_array(path, dtype, columns=None):
+    """Read-only np.memmap of a raw binary file, reshaped to (-1, columns) if given
+
+    Empty files cannot be mapped and come back as empty arrays.
+    """
+    dtype = np.dtype(dtype)
+    shape = (-1, columns) if columns else (-1,)
+    if os.path.getsize(path) == 0:
+        return np.empty((0, columns) if columns else 0, dtype=dtype)
+    return np.memmap(path, dtype=dtype, mode="r").reshape(shape)
+
+
+def load_mapped(path, dtype, columns=None):
+    """map_array of a raw frame file, or the decoded array of its quantized counterpart if only that exists"""
+    if not os.path.exists(path) and os.path.exists(encoded_name(path)):
+        return decode(np.fromfile(encoded_name(path), dtype=np.uint8))
+    return map_array(path, dtype, columns)
+
+
+class Frame:
+    """One scan of a SemanticKITTI-style tree
+
+    Points and labels are mapped on first access, and every column accessor is
+    a view into the mapping, so nothing is copied until the caller does so.
+    Frames stored quantized (.qbin/.qlabel) are decoded into memory instead.
+    Pickling keeps only the paths.
+    """
+
+    def __init__(self, root, scene, frame, pcd_dir="velodyne"):
+        self.root = root
+        self.scene = scene
+        self.frame = frame
+        self.bin_path = os.path.join(root, scene, "velodyne", f"{frame}.bin")
+        self.label_path = os.path.join(root, scene, "labels", f"{frame}.label")
+        self.pcd_path = os.path.join(root, scene, pcd_dir, f"{frame}.pcd")
+        self._points = None
+        self._labels = None
+
+    def __repr__(self):
+        return f"Frame({self.root!r}, {self.scene!r}, {self.frame!r})"
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state["_points"] = None
+        state["_labels"] = None
+        return state
+
+    def __len__(self):
+        return len(self.points)
+
+    @property
+    def points(self):
+        """Nx4 float32 [x, y, z, remission]"""
+        if self._points is None:
+            self._points = load_mapped(self.bin_path, np.float32, 4)
+        return self._points
+
+    @property
+    def labels(self):
+        """N uint32 raw labels (semantic in the lower 16 bits, instance in the upper 16)"""
+        if self._labels is None:
+            self._labels = load_mapped(self.label_path, np.uint32)
+        return self._labels
+
+    @property
+    def has_labels(self):
+        return os.path.exists(self.label_path) or os.path.exists(encoded_name(self.label_path))
+
+    @property
+    def has_pcd(self):
+        return os.path.exists(self.pcd_path)
+
+    @property
+    def xyz(self):
+        return self.points[:, :3]
+
+    @property
+    def remission(self):
+        return self.points[:, 3]
+
+    @property
+    def semantic(self):
+        """Lower 16 bits of the labels, as a uint16 view"""
+        return self.labels.view("<u2").reshape(-1, 2)[:, 0]
+
+    @property
+    def instance(self):
+        """Upper 16 bits of the labels, as a uint16 view"""
+        return self.labels.view("<u2").reshape(-1, 2)[:, 1]
+
+    @property
+    def pcd(self):
+        """The frame's PCD as a structured array (memory-mapped for binary PCDs)"""
+        return read_pcd(self.pcd_path)
+
+
+class Sequence:
+    """The frames of one scene, optionally restricted to a subset of frame ids
+
+    Indexing with an int or a frame id ("005") returns a Frame; a slice
+    returns a Sequence over that range of frames.
+    """
+
+    def __init__(self, root, scene, frames=None, pcd_dir="velodyne"):
+        self.root = root
+        self.scene = scene
+        self.pcd_dir = pcd_dir
+        if frames is None:
+            names = scan_dir(os.path.join(root, scene, "velodyne"))
+            frames = sorted({os.path.splitext(name)[0] for name in names
+                             if os.path.splitext(name)[1] in (".bin", ENCODED_EXTS[".bin"])})
+        self.frames = list(frames)
+
+    def __repr__(self):
+        return f"Sequence({self.root!r}, {self.scene!r}, {len(self.frames)} frames)"
+
+    def __len__(self):
+        return len(self.frames)
+
+    def __iter__(self):
+        for frame in self.frames:
+            yield Frame(self.root, self.scene, frame, self.pcd_dir)
+
+    def __getitem__(self, key):
+        if isinstance(key, slice):
+            return Sequence(self.root, self.scene, self.frames[key], self.pcd_dir)
+        if isinstance(key, str):
+            if key not in self.frames:
+                raise KeyError(f"Scene {self.scene} has no frame {key}")
+            return Frame(self.root, self.scene, key, self.pcd_dir)
+        return Frame(self.root, self.scene, self.frames[key], self.pcd_dir)
+
+    def frame_range(self, start=None, stop=None):
+        """Frames whose ids fall in [start, stop), compared numerically"""
+        return Sequence(self.root, self.scene,
+                        [frame for frame in self.frames
+                         if (start is None or int(frame) >= int(start))
+                         and (stop is None or int(frame) < int(stop))],
+                        self.pcd_dir)
+
+
+class Dataset:
+    """All scenes of a SemanticKITTI-style tree (<root>/<scene>/velodyne, labels)
+
+    `dataset["00"]` is a Sequence; a list or slice of scenes gives a Dataset
+    restricted to those scenes.
+    """
+
+    def __init__(self, root, scenes=None, pcd_dir="velodyne"):
+        self.root = root
+        self.pcd_dir = pcd_dir
+        if scenes is None:
+            with os.scandir(root) as entries:
+                scenes = sorted(entry.name for entry in entries
+                                if entry.is_dir() and os.path.isdir(os.path.join(entry.path, "velodyne")))
+        self.scenes = list(scenes)
+
+    def __repr__(self):
+        return f"Dataset({self.root!r}, scenes={self.scenes})"
+
+    def __len__(self):
+        return len(self.scenes)
+
+    def __iter__(self):
+        for scene in self.scenes:
+            yield Sequence(self.root, scene, pcd_dir=self.pcd_dir)
+
+    def __getitem__(self, key):
+        if isinstance(key, slice):
+            return Dataset(self.root, self.scenes[key], self.pcd_dir)
+        if isinstance(key, (list, tuple)):
+            return Dataset(self.root, key, self.pcd_dir)
+        if key not in self.scenes:
+            raise KeyError(f"No scene {key} under {self.root}")
+        return Sequence(self.root, key, pcd_dir=self.pcd_dir)
+
+    def frames(self):
+        """Iterate over every Frame of every scene"""
+        for sequence in self:
+            yield from sequence
@@ -1,113 +1,223 @@
+import argparse
 import os
 import glob
+from functools import partial
 import numpy as np
-from pypcd4 import PointCloud
+from frame_io import add_io_depth_argument, fromfile, mapped, write_array
+from metrics import Monitor, add_metrics_arguments, stage
+from parallel import add_workers_argument, frame_result, run_items
+from pcd_cache import add_pcd_cache_arguments, pcd_cache_from_args, read_fields
+from pcd_io import read_pcd_header
+from spatial_index import VoxelIndex
 
 # --- DIRECTORY DEFINITIONS ---
 PCD_BASE_DIR = "/home/ezarisma/Downloads/Practice/Semantic-KITTI-API-DPAI-main-ver3/pcd_data/07/07/lidar_point_cloud_top_rear_lidar"
 
-BIN_BASE_DIR = "/home/ezarisma/Downloads/Practice/Semantic-KITTI-API-DPAI-main-ver3/filtered/sequences_lidar1/07/velodyne" 
+BIN_BASE_DIR = "/home/ezarisma/Downloads/Practice/Semantic-KITTI-API-DPAI-main-ver3/filtered/sequences_lidar1/07/velodyne"
 
 # Define the new directory to save the MODIFIED BIN files
 OUTPUT_DIR = os.path.join(os.path.dirname(os.path.dirname(PCD_BASE_DIR)), "extracted_intensity")
 
-# Create the output directory if it doesn't exist
-os.makedirs(OUTPUT_DIR, exist_ok=True)
-print(f"Output directory created at: {OUTPUT_DIR}")
-print("-" * 50)
+# Default --match radius in meters: a BIN point takes the intensity of the nearest PCD point this close
+MATCH_TOLERANCE = 0.01
 
-# 1. Get a sorted list of all numeric .pcd files
-all_pcd_files = sorted(glob.glob(os.path.join(PCD_BASE_DIR, "*.pcd")))
-target_stems = []
 
-for full_path in all_pcd_files:
-    filename_stem = os.path.splitext(os.path.basename(full_path))[0]
-    try:
-        int(filename_stem)
-        target_stems.append(filename_stem)
-    except ValueError:
-        continue
+def find_target_stems(pcd_base_dir):
+    """Get a sorted list of all numeric .pcd file stems"""
+    all_pcd_files = sorted(glob.glob(os.path.join(pcd_base_dir, "*.pcd")))
+    target_stems = []
+
+    for full_path in all_pcd_files:
+        filename_stem = os.path.splitext(os.path.basename(full_path))[0]
+        try:
+            int(filename_stem)
+            target_stems.append(filename_stem)
+        except ValueError:
+            continue
+    return target_stems
+
+
+def intensity_field(header):
+    """Name of the field holding intensity in a PCD header"""
+    # Safely extract intensity field to be the new remission
+    if 'intensity' in header['fields']:
+        return 'intensity'
+    if 'remission' in header['fields']:
+        return 'remission'
+    raise ValueError("PCD file is missing both 'intensity' and 'remission' fields.")
+
+
+def load_intensity(pcd_path, cache=None):
+    """Return the intensity (or remission) column of a PCD file as a zero-copy view (or mapped from `cache`)"""
+    header = read_pcd_header(pcd_path)
+    name = intensity_field(header)
+    return read_fields(pcd_path, [name], cache, header)[name]
+
+
+def match_intensity(bin_xyz, pcd_path, tolerance, lines, cache=None):
+    """Intensity of the nearest PCD point for every BIN point (0 where none is within `tolerance`)
+
+    Appends a line with the match rate and match distances to `lines`.
+    """
+    header = read_pcd_header(pcd_path)
+    name = intensity_field(header)
+    cloud = read_fields(pcd_path, ["x", "y", "z", name], cache, header)
+    index = VoxelIndex(np.column_stack((cloud["x"], cloud["y"], cloud["z"])), tolerance)
+    indices, distances = index.query(bin_xyz)
+
+    matched = indices >= 0
+    intensity = np.zeros(len(bin_xyz), dtype=cloud[name].dtype)
+    intensity[matched] = cloud[name][indices[matched]]
+
+    num_matched = int(matched.sum())
+    line = f"  Matched {num_matched}/{len(bin_xyz)} BIN points to {len(cloud[name])} PCD points within {tolerance} m"
+    if num_matched:
+        line += f" (distance mean {distances[matched].mean():.4f}, max {distances[matched].max():.4f})"
+    if num_matched < len(bin_xyz):
+        line += f"; {len(bin_xyz) - num_matched} unmatched points get intensity 0"
+    lines.append(line)
+    return intensity
+
+
+def normalize_intensity(intensity_array, lines=None):
+    """Scale raw 0-255 intensity to [0, 1], appending the range report to `lines` when given"""
+    # NORMALIZE INTENSITY TO RANGE [0, 1] BY DIVIDING BY 255.0
+    if len(intensity_array) == 0:
+        return intensity_array  # Empty array
+
+    normalized_intensity = intensity_array / 255.0
+
+    # ERROR CHECK
+    if np.any(normalized_intensity < 0.0) or np.any(normalized_intensity > 1.0):
+        raise ValueError(f"Normalized intensity values out of range [0,1]. Min: {np.min(normalized_intensity):.3f}, Max: {np.max(normalized_intensity):.3f}")
+
+    if lines is None:
+        return normalized_intensity
+
+    original_min = np.min(intensity_array)
+    original_max = np.max(intensity_array)
+    normalized_min = np.min(normalized_intensity)
+    normalized_max = np.max(normalized_intensity)
+
+    lines.append(f"  Intensity range: [{original_min:.3f}, {original_max:.3f}] -> Normalized to [{normalized_min:.3f}, {normalized_max:.3f}]")
+    return normalized_intensity
+
 
-print(f"Found {len(target_stems)} PCD files to process.")
-print(f"Attempting to read existing BIN files from: {BIN_BASE_DIR}")
-print("-" * 50)
+def frame_inputs(stem, cache=None):
+    """PCD and BIN file of a stem, for the frame loop to prefetch (the PCD only when there is no field cache)"""
+    if not stem.isdigit():
+        return []
+    bin_path = os.path.join(BIN_BASE_DIR, f"{int(stem):03d}.bin")
+    return [bin_path] if cache is not None else [mapped(os.path.join(PCD_BASE_DIR, f"{stem}.pcd")), bin_path]
 
-# 2. Process each pair (PCD and BIN)
-for stem in target_stems:
+
+def extract_frame(stem, tolerance=None, verbose=False, cache=None):
+    """Replace the remission column of one BIN file with its PCD's normalized intensity
+
+    When the point counts differ and `tolerance` is set, BIN points are matched
+    to PCD points by position instead of by order. The intensity range report
+    is only computed when `verbose`. PCD fields come through `cache` if given.
+    """
     pcd_filename = f"{stem}.pcd"
-    
+
     # Pad stem to 3 digits for BIN filename
     try:
-        padded_stem = f"{int(stem):03d}"  
+        padded_stem = f"{int(stem):03d}"
     except ValueError:
-        print(f"  ERROR: Could not parse numeric stem from {pcd_filename}. Skipping.")
-        continue
-        
+        return frame_result("error", f"  ERROR: Could not parse numeric stem from {pcd_filename}. Skipping.")
+
     bin_filename = f"{padded_stem}.bin"
 
     pcd_path = os.path.join(PCD_BASE_DIR, pcd_filename)
     bin_path = os.path.join(BIN_BASE_DIR, bin_filename)
     output_path = os.path.join(OUTPUT_DIR, bin_filename)
 
-    print(f"Processing: {pcd_filename} -> {bin_filename} (Merging)")
+    lines = [f"Processing: {pcd_filename} -> {bin_filename} (Merging)"]
 
     try:
         # A. EXTRACT NEW INTENSITY VALUE FROM PCD
-        pc: PointCloud = PointCloud.from_path(pcd_path)
-        
-        # Safely extract intensity field to be the new remission
-        if 'intensity' in pc.fields:
-            intensity_array = pc.numpy(('intensity',)).flatten()
-        elif 'remission' in pc.fields:
-            intensity_array = pc.numpy(('remission',)).flatten()
-        else:
-            raise ValueError("PCD file is missing both 'intensity' and 'remission' fields.")
-
-        # NORMALIZE INTENSITY TO RANGE [0, 1] BY DIVIDING BY 255.0
-        if len(intensity_array) > 0:
-            normalized_intensity = intensity_array / 255.0
-  
-            # ERROR CHECK
-            if np.any(normalized_intensity < 0.0) or np.any(normalized_intensity > 1.0):
-                raise ValueError(f"Normalized intensity values out of range [0,1]. Min: {np.min(normalized_intensity):.3f}, Max: {np.max(normalized_intensity):.3f}")
-            
-            original_min = np.min(intensity_array)
-            original_max = np.max(intensity_array)
-            normalized_min = np.min(normalized_intensity)
-            normalized_max = np.max(normalized_intensity)
-            
-            print(f"  Intensity range: [{original_min:.3f}, {original_max:.3f}] -> Normalized to [{normalized_min:.3f}, {normalized_max:.3f}]")
-        else:
-            normalized_intensity = intensity_array  # Empty array
+        with stage("load"):
+            intensity_array = load_intensity(pcd_path, cache)
+        normalized_intensity = normalize_intensity(intensity_array, lines if verbose else None)
 
         # B. LOAD EXISTING BINARY DATA
-        bin_data = np.fromfile(bin_path, dtype=np.float32)
-        
+        with stage("load"):
+            bin_data = fromfile(bin_path, np.float32)
+
         # Reshape to (N, 4) if the size is a multiple of 4 floats
         if bin_data.size % 4 != 0:
             raise ValueError(f"BIN file size ({bin_data.size} floats) is not a multiple of 4. Data corrupt.")
-            
+
         bin_data = bin_data.reshape((-1, 4))
-        
+
         # C. VALIDATE AND MERGE
-        if len(bin_data) != len(normalized_intensity):
-            print(f"  ERROR: Point counts do not match! BIN: {len(bin_data)}, PCD: {len(normalized_intensity)}. Skipping.")
-            continue
-            
+        if len(bin_data) != len(normalized_intensity) and tolerance is not None:
+            # Counts differ (e.g. after remission filtering): match points by position
+            with stage("match"):
+                matched_intensity = match_intensity(bin_data[:, :3], pcd_path, tolerance, lines, cache)
+            normalized_intensity = normalize_intensity(matched_intensity)
+        elif len(bin_data) != len(normalized_intensity):
+            lines.append(f"  ERROR: Point counts do not match! BIN: {len(bin_data)}, PCD: {len(normalized_intensity)}. Skipping.")
+            return frame_result("skipped", *lines)
+
         # Replace the remission column (index 3) with the NORMALIZED intensity data
         bin_data[:, 3] = normalized_intensity
-        
+
         # D. SAVE MODIFIED DATA
-        bin_data.tofile(output_path)
-        
-        print(f"  SUCCESS: Replaced remission channel for {len(bin_data)} points and saved to {output_path}")
+        with stage("write"):
+            write_array(bin_data, output_path)
+
+        lines.append(f"  SUCCESS: Replaced remission channel for {len(bin_data)} points and saved to {output_path}")
+        return frame_result("ok", *lines, points=len(bin_data), points_in=len(bin_data), points_out=len(bin_data))
 
     except FileNotFoundError:
         # Catches the initial error if the BIN file is missing
-        print(f"  ERROR: Could not find matching BIN file at {bin_path}. Skipping.")
+        lines.append(f"  ERROR: Could not find matching BIN file at {bin_path}. Skipping.")
     except Exception as e:
-        print(f"  An unexpected error occurred for {pcd_filename}: {e}. Skipping.")
-        
+        lines.append(f"  An unexpected error occurred for {pcd_filename}: {e}. Skipping.")
+    return frame_result("error", *lines)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Copy PCD intensity into the remission column of BIN files")
+    add_workers_argument(parser)
+    add_io_depth_argument(parser)
+    parser.add_argument("--match", nargs="?", type=float, const=MATCH_TOLERANCE, metavar="TOLERANCE",
+                        help="When point counts differ, match BIN points to the nearest PCD point within "
+                             f"TOLERANCE meters (default {MATCH_TOLERANCE}) instead of skipping the frame")
+    add_pcd_cache_arguments(parser)
+    add_metrics_arguments(parser)
+    args = parser.parse_args(argv)
+    cache = pcd_cache_from_args(args)
+
+    # Create the output directory if it doesn't exist
+    os.makedirs(OUTPUT_DIR, exist_ok=True)
+    print(f"Output directory created at: {OUTPUT_DIR}")
+    print("-" * 50)
+
+    # 1. Get a sorted list of all numeric .pcd files
+    target_stems = find_target_stems(PCD_BASE_DIR)
+
+    print(f"Found {len(target_stems)} PCD files to process.")
+    print(f"Attempting to read existing BIN files from: {BIN_BASE_DIR}")
     print("-" * 50)
 
-print("All file merging complete!")
+    # 2. Process each pair (PCD and BIN)
+    monitor = Monitor.from_args("extract_intensity", args)
+    extract = partial(extract_frame, tolerance=args.match, verbose=args.verbose, cache=cache)
+    for result in run_items(extract, target_stems, args.workers,
+                            prefetch=partial(frame_inputs, cache=cache), io_depth=args.io_depth, monitor=monitor):
+        if args.verbose or result["status"] != "ok":
+            print("\n".join(result["lines"]))
+            print("-" * 50)
+    monitor.close()
+    if cache is not None:
+        removed, freed = cache.evict()
+        if removed:
+            print(f"[OK] PCD cache over {cache.max_mb:g} MB: evicted {removed} fields ({freed / 1e6:.1f} MB)")
+
+    print("All file merging complete!")
+
+
+if __name__ == "__main__":
+    main()
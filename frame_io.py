@@ -0,0 +1,315 @@
+import errno
+import os
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait
+from contextlib import ExitStack
+import numpy as np
+
+from manifest import atomic_tofile
+from metrics import add_read, add_write, current_frame
+
+# Default number of frames read ahead / written behind the one being processed
+IO_DEPTH = 2
+
+# Errors of a kernel-side copy that mean "not possible for these files", not a failure
+UNSUPPORTED_COPY_ERRORS = (errno.ENOSYS, errno.EXDEV, errno.EINVAL, errno.EOPNOTSUPP, errno.EBADF)
+
+# Read size when warming the page cache without posix_fadvise
+WARM_CHUNK_SIZE = 1 << 20
+
+# State of the frame loop running in this process: the thread pool, file
+# contents prefetched for upcoming frames (path -> future), read-ahead advice
+# given for upcoming memory-mapped files (path -> future) and the background
+# writes started by the frame being processed
+_pool = None
+_prefetched = {}
+_advised = {}
+_writes = None
+
+
+def add_io_depth_argument(parser):
+    """Add the shared --io-depth option to a script's argument parser"""
+    parser.add_argument("--io-depth", type=int, default=IO_DEPTH,
+                        help="Frames read ahead and written behind in background threads "
+                             f"(default: {IO_DEPTH}, 0 for plain synchronous I/O)")
+
+
+def add_max_memory_argument(parser):
+    """Add the shared --max-memory option to a script's argument parser"""
+    parser.add_argument("--max-memory", type=float, metavar="MB",
+                        help="Memory budget per worker: frames that would need more are streamed through in "
+                             "blocks of memory-mapped windows instead of being loaded whole (default: no limit)")
+
+
+def block_points(max_memory, bytes_per_point):
+    """Points per block that keep a streamed frame within `max_memory` MB"""
+    return max(1, int(max_memory * 1e6) // bytes_per_point)
+
+
+def map_windows(path, dtype, columns, block):
+    """Read-only np.memmap windows of at most `block` rows over a raw binary file, in order
+
+    Each window is its own mapping, so the pages of a window are released
+    once the caller drops it and the mapped part of the file never grows
+    past one window.
+    """
+    dtype = np.dtype(dtype)
+    row_bytes = dtype.itemsize * (columns or 1)
+    rows = os.path.getsize(path) // row_bytes
+    shape = (columns,) if columns else ()
+    for start in range(0, rows, block):
+        count = min(block, rows - start)
+        window = np.memmap(path, dtype=dtype, mode="r", offset=start * row_bytes, shape=(count,) + shape)
+        add_read(window.nbytes, 0.0, 0.0)
+        yield window
+
+
+class AppendWriter:
+    """A file written block by block through a temp file, renamed into place when the block loop succeeds
+
+    Used as a context manager: leaving it with an exception removes the
+    partial file, so as with atomic_tofile a partial output is never visible.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.tmp_path = f"{path}.tmp.{os.getpid()}"
+        self.file = open(self.tmp_path, "wb")
+        self.counters = current_frame()
+
+    def append(self, array):
+        start = time.perf_counter()
+        np.ascontiguousarray(array).tofile(self.file)
+        elapsed = time.perf_counter() - start
+        add_write(array.nbytes, elapsed, elapsed, self.counters)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.file.close()
+        if exc_type is None:
+            os.replace(self.tmp_path, self.path)
+        elif os.path.exists(self.tmp_path):
+            os.remove(self.tmp_path)
+        return False
+
+
+class MappedPath(str):
+    """A path the frame loop only asks the kernel to read ahead, for a file that is memory-mapped, not read"""
+
+
+def mapped(path):
+    """Mark a path returned by a prefetch function as memory-mapped (see MappedPath)"""
+    return MappedPath(path)
+
+
+def _advise(path):
+    """(bytes, seconds): start reading a file into the page cache without copying it into this process
+
+    Uses posix_fadvise(WILLNEED) where available, else reads the file through
+    a small buffer.
+    """
+    start = time.perf_counter()
+    try:
+        with open(path, "rb", buffering=0) as f:
+            size = os.fstat(f.fileno()).st_size
+            if hasattr(os, "posix_fadvise"):
+                os.posix_fadvise(f.fileno(), 0, size, os.POSIX_FADV_WILLNEED)
+            else:
+                buf = bytearray(WARM_CHUNK_SIZE)
+                while f.readinto(buf):
+                    pass
+    except FileNotFoundError:
+        size = 0
+    return size, time.perf_counter() - start
+
+
+def _read_file(path):
+    """(contents as a bytearray or None if the file is missing, seconds the read took)"""
+    start = time.perf_counter()
+    try:
+        with open(path, "rb", buffering=0) as f:
+            buf = bytearray(os.fstat(f.fileno()).st_size)
+            size = f.readinto(buf)
+            buf = buf if size == len(buf) else buf[:size]
+    except FileNotFoundError:
+        buf = None
+    return buf, time.perf_counter() - start
+
+
+def fromfile(path, dtype):
+    """np.fromfile, served from the prefetched contents when the frame loop read the file ahead
+
+    A prefetched array is a writable view of the read buffer, so nothing is
+    copied. Trailing bytes that do not fill a whole item are dropped, as
+    np.fromfile does.
+    """
+    start = time.perf_counter()
+    future = _prefetched.pop(path, None)
+    buf, seconds = future.result() if future is not None else (None, 0.0)
+    if buf is None:
+        array = np.fromfile(path, dtype=dtype)
+        elapsed = time.perf_counter() - start
+        add_read(array.nbytes, elapsed)
+        return array
+    add_read(len(buf), seconds, waited=time.perf_counter() - start)
+    dtype = np.dtype(dtype)
+    return np.frombuffer(buf, dtype=dtype, count=len(buf) // dtype.itemsize)
+
+
+def _timed_write(counters, background, path, func, args):
+    start = time.perf_counter()
+    func(*args)
+    elapsed = time.perf_counter() - start
+    add_write(os.path.getsize(path), elapsed, 0.0 if background else elapsed, counters)
+
+
+def write_behind(path, func, *args):
+    """Run func(*args), which writes `path`, on the I/O threads when a frame loop is running, else right away
+
+    The frame's result is only handed back once all its writes have finished,
+    so callers may treat the outputs as written when they see the result.
+    The arguments must not be modified afterwards.
+    """
+    if _writes is None:
+        _timed_write(current_frame(), False, path, func, args)
+    else:
+        _writes.append((_pool.submit(_timed_write, current_frame(), True, path, func, args), path))
+
+
+def write_array(array, path):
+    """atomic_tofile through the write-behind queue"""
+    write_behind(path, atomic_tofile, array, path)
+
+
+def _kernel_copy(src_fd, dst_fd, size, dst_offset):
+    """Copy all `size` bytes of src_fd to dst_fd at dst_offset inside the kernel; False if it cannot
+
+    Tries copy_file_range (reflinks or in-kernel copy), then sendfile.
+    """
+    for method in ("copy_file_range", "sendfile"):
+        if not hasattr(os, method):
+            continue
+        copied = 0
+        try:
+            if method == "sendfile":
+                os.lseek(dst_fd, dst_offset, os.SEEK_SET)
+            while copied < size:
+                if method == "copy_file_range":
+                    n = os.copy_file_range(src_fd, dst_fd, size - copied, copied, dst_offset + copied)
+                else:
+                    n = os.sendfile(dst_fd, src_fd, copied, size - copied)
+                if n == 0:
+                    raise OSError(errno.EIO, "Input file shrank while it was being copied")
+                copied += n
+            return True
+        except OSError as e:
+            if copied or e.errno not in UNSUPPORTED_COPY_ERRORS:
+                raise
+    return False
+
+
+def atomic_concat(paths, path):
+    """Write the files of `paths` back to back into `path`, via a temp file and rename
+
+    The bytes are copied inside the kernel and never pass through this
+    process. Inputs the kernel cannot copy (e.g. across filesystems on older
+    kernels) are read into one preallocated buffer and written from there.
+    """
+    tmp_path = f"{path}.tmp.{os.getpid()}"
+    try:
+        with ExitStack() as stack:
+            sources = [stack.enter_context(open(source, "rb")) for source in paths]
+            out = stack.enter_context(open(tmp_path, "wb"))
+            sizes = [os.fstat(source.fileno()).st_size for source in sources]
+            offsets = [sum(sizes[:i]) for i in range(len(sizes))]
+            os.ftruncate(out.fileno(), sum(sizes))
+
+            fallback = [i for i, source in enumerate(sources)
+                        if not _kernel_copy(source.fileno(), out.fileno(), sizes[i], offsets[i])]
+            if fallback:
+                view = memoryview(bytearray(max(sizes[i] for i in fallback)))
+                for i in fallback:
+                    chunk = view[:sizes[i]]
+                    if sources[i].readinto(chunk) != sizes[i]:
+                        raise OSError(errno.EIO, f"Input file shrank while it was being copied: {paths[i]}")
+                    os.pwrite(out.fileno(), chunk, offsets[i])
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+def concat_files(paths, path, nbytes=0):
+    """atomic_concat through the write-behind queue; `nbytes` (the inputs' total size) is counted as read"""
+    add_read(nbytes, 0.0, 0.0)
+    write_behind(path, atomic_concat, paths, path)
+
+
+def _prefetch(pool, paths):
+    for path in paths:
+        if path is None or path in _prefetched or path in _advised:
+            continue
+        if isinstance(path, MappedPath):
+            _advised[path] = pool.submit(_advise, path)
+        else:
+            _prefetched[path] = pool.submit(_read_file, path)
+
+
+def _finish(result, writes):
+    """Wait for a frame's writes; a failed write turns its result into an error"""
+    wait([future for future, _ in writes])
+    failures = [f"[ERROR] Writing {path}: {future.exception()}"
+                for future, path in writes if future.exception() is not None]
+    if failures and result["status"] != "error":
+        return {**result, "status": "error", "lines": result["lines"] + failures}
+    return result
+
+
+def run_frames(call, items, prefetch, io_depth=IO_DEPTH):
+    """Yield call(item) for every item, overlapping its I/O with the neighbouring frames
+
+    While one item is processed, the files prefetch(item) lists for the next
+    `io_depth` items are read on a thread pool (those marked mapped() are only
+    advised into the page cache), and the writes of the previous
+    items (made through write_array/write_behind) drain on the same pool.
+    Results come back in item order, each once its writes are done.
+    """
+    global _pool, _writes
+    items = list(items)
+    pending = deque()
+    with ThreadPoolExecutor(max_workers=io_depth) as pool:
+        _pool = pool
+        try:
+            for item in items[:io_depth]:
+                _prefetch(pool, prefetch(item))
+            for i, item in enumerate(items):
+                if i + io_depth < len(items):
+                    _prefetch(pool, prefetch(items[i + io_depth]))
+
+                _writes = []
+                result = call(item)
+                pending.append((result, _writes))
+                _writes = None
+                # Contents the frame did not claim only warmed the cache; count them as read ahead
+                for path in prefetch(item):
+                    future = _prefetched.pop(path, None)
+                    if future is not None:
+                        buf, seconds = future.result()
+                        add_read(len(buf) if buf is not None else 0, seconds, 0.0, result.get("metrics"))
+                    future = _advised.pop(path, None)
+                    if future is not None:
+                        add_read(*future.result(), 0.0, result.get("metrics"))
+
+                while len(pending) > io_depth:
+                    yield _finish(*pending.popleft())
+            while pending:
+                yield _finish(*pending.popleft())
+        finally:
+            _writes = None
+            _pool = None
+            _prefetched.clear()
+            _advised.clear()
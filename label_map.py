@@ -0,0 +1,133 @@
+import json
+import os
+import numpy as np
+
+try:
+    import yaml  # PyYAML, optional: only needed for .yaml/.yml label maps
+except ImportError:
+    yaml = None
+
+from label_stats import split_labels
+
+# What happens to the upper 16 bits (instance id) of a remapped label
+INSTANCE_MODES = ("keep", "strip", "compact")
+
+# Keys of a label map file that configure the map rather than map a class
+RESERVED_KEYS = ("default", "instances")
+
+# Semantic ids are the lower 16 bits of a label: the lookup table covers them all
+TABLE_SIZE = 1 << 16
+
+
+def add_label_map_arguments(parser):
+    """Add the shared label remapping options to a script's argument parser"""
+    parser.add_argument("--label-map", metavar="FILE",
+                        help="YAML or JSON label map: either {raw id: new id} or a SemanticKITTI-style config whose "
+                             "\"learning_map\" holds it (optional keys: \"default\", the id of unlisted classes, "
+                             "which otherwise keep theirs; \"instances\", as --instances)")
+    parser.add_argument("--instances", choices=INSTANCE_MODES,
+                        help="Instance ids of remapped labels: keep them, strip them (0) or compact them to 1..n "
+                             "per frame (default: the map's \"instances\", else keep)")
+
+
+def load_mapping(path):
+    """The parsed contents of a YAML or JSON label map file"""
+    with open(path) as f:
+        if os.path.splitext(path)[1].lower() in (".yaml", ".yml"):
+            if yaml is None:
+                raise ImportError("Reading a YAML label map needs PyYAML (pip install pyyaml)")
+            return yaml.safe_load(f)
+        return json.load(f)
+
+
+def label_map_from_args(args):
+    """LabelMap of parsed options, or None if labels are not remapped"""
+    if not args.label_map:
+        if args.instances:
+            raise ValueError("--instances needs a --label-map")
+        return None
+    config = load_mapping(args.label_map)
+    if not isinstance(config, dict):
+        raise ValueError(f"{args.label_map} must hold a mapping")
+    if "learning_map" in config:
+        mapping = config["learning_map"]
+    else:
+        mapping = {raw: new for raw, new in config.items() if raw not in RESERVED_KEYS}
+    if not isinstance(mapping, dict):
+        raise ValueError(f"{args.label_map}: the label map must be a mapping of raw id -> new id")
+    return LabelMap(mapping, config.get("default"), args.instances or config.get("instances", "keep"))
+
+
+class LabelMap:
+    """A raw -> new semantic id mapping compiled into a dense lookup table
+
+    Remapping a frame is one np.take over the semantic halves of its labels,
+    written straight into the output's lower halves; the upper halves get
+    the instance ids as configured. No per-class comparison and no
+    full-size temporary beyond the output array.
+    """
+
+    def __init__(self, mapping, default=None, instances="keep"):
+        if instances not in INSTANCE_MODES:
+            raise ValueError(f"Instance mode must be one of {', '.join(INSTANCE_MODES)}, got {instances!r}")
+        try:
+            self.mapping = {int(raw): int(new) for raw, new in mapping.items()}
+        except (TypeError, ValueError):
+            raise ValueError("A label map must map integer class ids to integer class ids") from None
+        self.default = None if default is None else int(default)
+        self.instances = instances
+        ids = list(self.mapping) + list(self.mapping.values()) + ([self.default] if self.default is not None else [])
+        if any(not 0 <= i < TABLE_SIZE for i in ids):
+            raise ValueError("Semantic ids of a label map must fit 16 bits")
+
+        if self.default is None:
+            self.table = np.arange(TABLE_SIZE, dtype=np.uint16)
+        else:
+            self.table = np.full(TABLE_SIZE, self.default, dtype=np.uint16)
+        self.table[list(self.mapping)] = list(self.mapping.values())
+
+    def __repr__(self):
+        return f"LabelMap({len(self.mapping)} classes, instances={self.instances})"
+
+    def __getstate__(self):
+        # Workers rebuild the 128 KB table instead of receiving it with every task
+        return {"mapping": self.mapping, "default": self.default, "instances": self.instances}
+
+    def __setstate__(self, state):
+        self.__init__(state["mapping"], state["default"], state["instances"])
+
+    def settings(self):
+        """The map as plain data, for the build manifest"""
+        return {"mapping": {str(raw): new for raw, new in sorted(self.mapping.items())},
+                "default": self.default, "instances": self.instances}
+
+    def instance_ids(self, label_blocks):
+        """Sorted raw instance ids found in any of the label blocks of one frame
+
+        Passed to apply() as `instance_ids`, it makes compacted ids agree
+        across the blocks of a frame that is remapped a block at a time.
+        """
+        ids = np.empty(0, dtype=np.uint16)
+        for labels in label_blocks:
+            ids = np.union1d(ids, split_labels(labels)[1])
+        return ids
+
+    def apply(self, labels, instance_ids=None):
+        """Remapped copy of uint32 labels
+
+        Compacted instance ids are numbered over `instance_ids` (see
+        instance_ids()) if given, else over the ids in `labels` alone.
+        """
+        semantic, instance = split_labels(labels)
+        out = np.empty(len(semantic), dtype=np.uint32)
+        out_semantic, out_instance = split_labels(out)
+        np.take(self.table, semantic, out=out_semantic)
+        if self.instances == "keep":
+            out_instance[:] = instance
+        elif self.instances == "strip":
+            out_instance[:] = 0
+        elif len(out):
+            # Instance ids 1..n in increasing order of their raw ids; 0 stays 0
+            ids = np.unique(instance) if instance_ids is None else instance_ids
+            out_instance[:] = np.searchsorted(ids, instance) + (ids[0] != 0)
+        return out
@@ -0,0 +1,227 @@
+import argparse
+import csv
+import json
+import os
+import numpy as np
+
+from dataset import Dataset
+from frame_io import add_io_depth_argument, mapped
+from metrics import Monitor, add_metrics_arguments, stage
+from parallel import add_workers_argument, frame_result, run_items
+
+# Key of the merged (all sensors) histogram of a frame
+MERGED = "MERGED"
+
+
+def split_labels(labels):
+    """(semantic, instance) uint16 views of raw uint32 labels (lower / upper 16 bits)"""
+    halves = np.ascontiguousarray(labels, dtype="<u4").view("<u2").reshape(-1, 2)
+    return halves[:, 0], halves[:, 1]
+
+
+def _add_padded(a, b):
+    """Sum two 1-D count arrays of possibly different lengths"""
+    if len(a) < len(b):
+        a, b = b, a
+    out = a.copy()
+    out[:len(b)] += b
+    return out
+
+
+class LabelHistogram:
+    """Per-class point counts, accumulated with np.bincount (no sorting)
+
+    `points[c]` is the number of points of semantic class c and
+    `instance_points[c]` how many of those carry a non-zero instance id.
+    Histograms add up, so partial results from workers can be merged in any
+    order.
+    """
+
+    def __init__(self, points=None, instance_points=None, frames=0):
+        self.points = np.zeros(0, dtype=np.int64) if points is None else np.asarray(points, dtype=np.int64)
+        self.instance_points = (np.zeros(0, dtype=np.int64) if instance_points is None
+                                else np.asarray(instance_points, dtype=np.int64))
+        self.frames = frames
+
+    @classmethod
+    def from_labels(cls, labels):
+        """Histogram of one frame's raw labels"""
+        semantic, instance = split_labels(labels)
+        return cls(np.bincount(semantic), np.bincount(semantic[instance != 0]), frames=1)
+
+    def __add__(self, other):
+        return LabelHistogram(_add_padded(self.points, other.points),
+                              _add_padded(self.instance_points, other.instance_points),
+                              self.frames + other.frames)
+
+    def __iadd__(self, other):
+        merged = self + other
+        self.points, self.instance_points, self.frames = merged.points, merged.instance_points, merged.frames
+        return self
+
+    @property
+    def total(self):
+        return int(self.points.sum())
+
+    @property
+    def classes(self):
+        """Semantic classes with at least one point"""
+        return np.flatnonzero(self.points)
+
+    def class_weights(self):
+        """Inverse-frequency weight per present class (1.0 for a class holding an even share of the points)"""
+        classes = self.classes
+        weights = self.total / (len(classes) * self.points[classes])
+        return dict(zip(classes.tolist(), weights.tolist()))
+
+    def to_dict(self):
+        classes = self.classes
+        instance_points = _add_padded(np.zeros_like(self.points), self.instance_points)
+        return {
+            "frames": self.frames,
+            "points": self.total,
+            "classes": {
+                int(c): {"points": int(self.points[c]), "instance_points": int(instance_points[c])}
+                for c in classes
+            },
+        }
+
+
+def frame_histograms(sensors):
+    """{name: LabelHistogram} for the (name, points, labels) sensors of one frame, plus MERGED
+
+    The merged histogram is the sum of the sensors', so the merged labels are
+    never counted again.
+    """
+    histograms = {name: LabelHistogram.from_labels(labels) for name, _, labels in sensors}
+    merged = LabelHistogram()
+    for histogram in histograms.values():
+        merged += histogram
+    merged.frames = 1
+    histograms[MERGED] = merged
+    return histograms
+
+
+class LabelStats:
+    """Label histograms per scene and sensor, plus dataset-wide totals"""
+
+    def __init__(self):
+        self.histograms = {}
+
+    def add(self, scene, histograms):
+        """Merge one frame's {sensor: LabelHistogram} into the scene's totals"""
+        scene_histograms = self.histograms.setdefault(scene, {})
+        for sensor, histogram in histograms.items():
+            if sensor in scene_histograms:
+                scene_histograms[sensor] += histogram
+            else:
+                scene_histograms[sensor] = LabelHistogram() + histogram
+
+    def dataset(self):
+        """{sensor: LabelHistogram} summed over all scenes"""
+        totals = {}
+        for scene_histograms in self.histograms.values():
+            for sensor, histogram in scene_histograms.items():
+                totals[sensor] = totals[sensor] + histogram if sensor in totals else histogram
+        return totals
+
+    def to_dict(self):
+        totals = self.dataset()
+        report = {
+            "scenes": {scene: {sensor: histogram.to_dict() for sensor, histogram in scene_histograms.items()}
+                       for scene, scene_histograms in sorted(self.histograms.items())},
+            "dataset": {sensor: histogram.to_dict() for sensor, histogram in totals.items()},
+        }
+        overall = totals.get(MERGED) or next(iter(totals.values()), None)
+        if overall is not None:
+            report["class_weights"] = {int(c): w for c, w in overall.class_weights().items()}
+        return report
+
+    def rows(self):
+        """One CSV row per (scene, sensor, class); scene is "ALL" for the dataset totals"""
+        scopes = [(scene, scene_histograms) for scene, scene_histograms in sorted(self.histograms.items())]
+        scopes.append(("ALL", self.dataset()))
+        for scene, histograms in scopes:
+            for sensor, histogram in histograms.items():
+                total = histogram.total
+                for c, counts in histogram.to_dict()["classes"].items():
+                    yield {
+                        "scene": scene,
+                        "sensor": sensor,
+                        "class": c,
+                        "points": counts["points"],
+                        "instance_points": counts["instance_points"],
+                        "fraction": counts["points"] / total,
+                    }
+
+    def write(self, path):
+        """Write the report as CSV if `path` ends in .csv, JSON otherwise"""
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        if path.endswith(".csv"):
+            with open(path, "w", newline="") as f:
+                writer = csv.DictWriter(f, fieldnames=["scene", "sensor", "class", "points",
+                                                       "instance_points", "fraction"])
+                writer.writeheader()
+                writer.writerows(self.rows())
+        else:
+            with open(path, "w") as f:
+                json.dump(self.to_dict(), f, indent=2)
+
+
+def add_stats_argument(parser):
+    """Add the shared --stats option to a script's argument parser"""
+    parser.add_argument("--stats", metavar="FILE",
+                        help="Write per-scene, per-sensor label histograms and class weights (.json or .csv)")
+
+
+def frame_inputs(frame):
+    """Label file of a Frame, advised into the page cache before it is mapped"""
+    return [mapped(frame.label_path)]
+
+
+def frame_stats(frame):
+    """Histogram of one Frame of a tree, read through its memory mapping"""
+    try:
+        with stage("histogram"):
+            histogram = LabelHistogram.from_labels(frame.labels)
+        return frame_result("ok", scene=frame.scene, histogram=histogram,
+                            points_in=histogram.total, points_out=histogram.total)
+    except Exception as e:
+        return frame_result("error", f"{frame.scene}/{frame.frame}: Error: {e}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Label histograms and class weights of a SemanticKITTI-style tree")
+    parser.add_argument("root", help="Tree with <scene>/labels/*.label files")
+    parser.add_argument("output", help="Report path (.json or .csv)")
+    parser.add_argument("--scenes", nargs="+", help="Scenes to include (default: all)")
+    parser.add_argument("--sensor", default=MERGED, help="Name the tree's labels are reported under")
+    add_workers_argument(parser)
+    add_io_depth_argument(parser)
+    add_metrics_arguments(parser)
+    args = parser.parse_args(argv)
+
+    dataset = Dataset(args.root, args.scenes)
+    stats = LabelStats()
+    monitor = Monitor.from_args("label_stats", args)
+    for result in run_items(frame_stats, [frame for frame in dataset.frames() if frame.has_labels],
+                            args.workers, chunksize=16, prefetch=frame_inputs, io_depth=args.io_depth,
+                            monitor=monitor):
+        if result["status"] == "ok":
+            stats.add(result["scene"], {args.sensor: result["histogram"]})
+        else:
+            print("\n".join(result["lines"]))
+    monitor.close()
+
+    stats.write(args.output)
+    overall = stats.dataset().get(args.sensor)
+    if overall is not None:
+        print(f"[OK] {overall.frames} frames, {overall.total:,} points, {len(overall.classes)} classes -> {args.output}")
+    else:
+        print(f"[WARNING] No labelled frames under {args.root}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,172 @@
+import hashlib
+import json
+import os
+import numpy as np
+
+# Manifest file kept at the root of every output tree
+MANIFEST_NAME = ".manifest"
+
+# Read size for content hashing
+HASH_CHUNK_SIZE = 1 << 20
+
+
+def add_manifest_arguments(parser):
+    """Add the shared incremental-rebuild options to a script's argument parser"""
+    parser.add_argument("--force", action="store_true",
+                        help="Rebuild every output even if the manifest says it is current")
+    parser.add_argument("--hash", action="store_true",
+                        help="Also compare input content hashes, not just size and mtime")
+
+
+def file_hash(path):
+    """SHA-1 of a file's contents"""
+    digest = hashlib.sha1()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def fingerprint(path, content_hash=False, st=None):
+    """Size, mtime and optional content hash of a file, or None if it is missing
+
+    Pass `st` when the caller already has the file's stat result (e.g. from
+    os.scandir) to avoid another stat call.
+    """
+    if st is None:
+        try:
+            st = os.stat(path)
+        except FileNotFoundError:
+            return None
+    fp = {"size": st.st_size, "mtime_ns": st.st_mtime_ns}
+    if content_hash:
+        fp["sha1"] = file_hash(path)
+    return fp
+
+
+def scan_dir(path):
+    """Stat every file of a directory with one os.scandir pass: name -> stat result ({} if missing)"""
+    try:
+        with os.scandir(path) as entries:
+            return {entry.name: entry.stat() for entry in entries if entry.is_file()}
+    except FileNotFoundError:
+        return {}
+
+
+def stat_files(paths):
+    """Stat every file of a list afresh: path -> stat result, or None if missing"""
+    stats = {}
+    for path in paths:
+        try:
+            stats[path] = os.stat(path)
+        except FileNotFoundError:
+            stats[path] = None
+    return stats
+
+
+def atomic_tofile(array, path):
+    """Write an array to `path` via a temp file and rename, so a partial file is never visible"""
+    tmp_path = f"{path}.tmp.{os.getpid()}"
+    try:
+        array.tofile(tmp_path)
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+def atomic_savez(path, **arrays):
+    """np.savez to `path` via a temp file and rename"""
+    tmp_path = f"{path}.tmp.{os.getpid()}"
+    try:
+        with open(tmp_path, "wb") as f:
+            np.savez(f, **arrays)
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+class Manifest:
+    """Build manifest of one output tree
+
+    Records, for every output file, the fingerprints of the inputs it was built
+    from. Entries are appended to a JSON-lines journal as soon as an output is
+    written, so an interrupted run resumes from the last finished frame; the
+    journal is compacted on close. Scripts adding files to another script's
+    output tree keep their own journal there under another `name`.
+    """
+
+    def __init__(self, output_dir, content_hash=False, name=MANIFEST_NAME):
+        self.output_dir = output_dir
+        self.path = os.path.join(output_dir, name)
+        self.content_hash = content_hash
+        self.entries = {}
+
+        if os.path.exists(self.path):
+            with open(self.path) as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        # Torn last line of an interrupted run
+                        continue
+                    if "inputs" in entry:
+                        self.entries[entry["output"]] = entry
+                    else:
+                        # Written by forget()
+                        self.entries.pop(entry["output"], None)
+
+    def _key(self, output):
+        return os.path.relpath(output, self.output_dir)
+
+    def fingerprints(self, inputs, stats=None):
+        """Fingerprint every input path (missing inputs map to None)
+
+        `stats` optionally maps each path to its already known stat result, or
+        None if the file is known to be missing.
+        """
+        if stats is None:
+            return {path: fingerprint(path, self.content_hash) for path in inputs}
+        return {path: fingerprint(path, self.content_hash, stats[path]) if stats[path] else None
+                for path in inputs}
+
+    def is_current(self, output, fingerprints, st=None):
+        """True if `output` exists and was built from inputs with these fingerprints
+
+        `st` is the output's stat result if the caller already has it.
+        """
+        entry = self.entries.get(self._key(output))
+        if entry is None or entry["inputs"] != fingerprints:
+            return False
+        # The output itself must still be the file we wrote
+        return fingerprint(output, st=st) == entry["output_fingerprint"]
+
+    def record(self, output, fingerprints):
+        """Mark `output` as built from inputs with these fingerprints"""
+        entry = {
+            "output": self._key(output),
+            "output_fingerprint": fingerprint(output),
+            "inputs": fingerprints,
+        }
+        self.entries[entry["output"]] = entry
+        with open(self.path, "a") as f:
+            f.write(json.dumps(entry) + "\n")
+
+    def forget(self, output):
+        """Drop the entry of `output`, so it is rebuilt whatever its inputs"""
+        key = self._key(output)
+        if self.entries.pop(key, None) is not None:
+            with open(self.path, "a") as f:
+                f.write(json.dumps({"output": key}) + "\n")
+
+    def close(self):
+        """Rewrite the journal with one line per output"""
+        os.makedirs(self.output_dir, exist_ok=True)
+        tmp_path = f"{self.path}.tmp.{os.getpid()}"
+        with open(tmp_path, "w") as f:
+            for key in sorted(self.entries):
+                f.write(json.dumps(self.entries[key]) + "\n")
+        os.replace(tmp_path, self.path)
@@ -1,70 +1,560 @@
+import argparse
 import os
+import sys
+from contextlib import ExitStack
+from functools import partial
 import numpy as np
 
-# Directory paths
+from calibration import add_calibration_argument, load_rig, rig_settings, sensor_ids, transform_into
+from catalog import Catalog, add_selection_arguments, frame_query
+from dataset import map_array
+from frame_io import (AppendWriter, add_io_depth_argument, add_max_memory_argument, block_points, concat_files,
+                      fromfile, map_windows, write_array, write_behind)
+from manifest import Manifest, add_manifest_arguments, atomic_savez, scan_dir, stat_files
+from metrics import Monitor, add_metrics_arguments, report_scene, stage
+from label_map import add_label_map_arguments, label_map_from_args
+from label_stats import MERGED, LabelHistogram, LabelStats, add_stats_argument, frame_histograms
+from parallel import add_workers_argument, frame_result, run_scenes
+from point_codec import add_codec_arguments, codec_from_args, encoded_path, write_labels, write_points
+from scene_archive import ArchiveWriter, archive_path
+from spatial_index import (CURVE_BITS, add_reorder_arguments, add_voxel_arguments, compression_report,
+                           curve_order, voxel_downsample)
+
+# Directory paths: points come from the intensity-injected trees, labels from the filtered trees
 LIDAR0_DIR = "/home/ezarisma/Downloads/Practice/Semantic-KITTI-API-DPAI-main-ver3/extracted_intensity_lidar0"
 LIDAR1_DIR = "/home/ezarisma/Downloads/Practice/Semantic-KITTI-API-DPAI-main-ver3/extracted_intensity_lidar1"
+LIDAR0_LABEL_DIR = "/home/ezarisma/Downloads/Practice/Semantic-KITTI-API-DPAI-main-ver3/filtered/sequences_lidar0"
+LIDAR1_LABEL_DIR = "/home/ezarisma/Downloads/Practice/Semantic-KITTI-API-DPAI-main-ver3/filtered/sequences_lidar1"
 OUTPUT_DIR = "/home/ezarisma/Downloads/Practice/Semantic-KITTI-API-DPAI-main-ver3/merged_lidar_points"
 
-# Scenes and frames to merge
-scenes = ["00", "01", "02","03", "04", "05","06", "07"]
-frames_to_merge = ["000", "005", "010", "015", "020","025", "030", "035", "040", "045","050", "055", "060", "065", "070","075", "080", "085", "090", "095"]
-
-print("MERGING LIDAR0 AND LIDAR1 POINTS INTO SINGLE FILES")
-print("=" * 80)
-
-# Create output directory
-os.makedirs(OUTPUT_DIR, exist_ok=True)
-
-for scene in scenes:
-    print(f"\nScene {scene}")
-    
-    # Create scene directory in output
-    scene_output_dir = os.path.join(OUTPUT_DIR, scene, "velodyne")
-    os.makedirs(scene_output_dir, exist_ok=True)
-    
-    lidar0_scene_dir = os.path.join(LIDAR0_DIR, scene, "velodyne")
-    lidar1_scene_dir = os.path.join(LIDAR1_DIR, scene, "velodyne")
-    
-    if not os.path.exists(lidar0_scene_dir):
-        print(f"Missing LIDAR0 directory")
-        continue
-    
-    for frame in frames_to_merge:
-        lidar0_file = os.path.join(lidar0_scene_dir, f"{frame}.bin")
-        lidar1_file = os.path.join(lidar1_scene_dir, f"{frame}.bin")
-        output_file = os.path.join(scene_output_dir, f"{frame}.bin")
-        
-        print(f"Processing frame {frame}: ", end="")
-        
-        if not os.path.exists(lidar0_file):
-            print("Missing LIDAR0 file")
+# Scenes to merge (None: every scene of the LIDAR0 tree) and the default
+# frame selection: every 5th frame id below 100
+scenes = None
+FRAME_RANGE = (0, 100)
+FRAME_STRIDE = 5
+
+# Working memory per point of a streamed block: the mapped windows, the
+# transformed copy, the remapped labels and the sensor ids (with headroom)
+BLOCK_BYTES_PER_POINT = 64
+
+
+def default_rig():
+    """Sensor name -> (points dir, labels dir) of the rig merged without a calibration file"""
+    return {"LIDAR0": (LIDAR0_DIR, LIDAR0_LABEL_DIR), "LIDAR1": (LIDAR1_DIR, LIDAR1_LABEL_DIR)}
+
+
+def input_catalog(rig, refresh=False):
+    """Catalog of the point and label trees of every sensor of the rig"""
+    return Catalog({sensor.name: {"points": sensor.points_dir, "labels": sensor.labels_dir} for sensor in rig},
+                   refresh=refresh)
+
+
+def plan_scene(scene, catalog, query, manifest, force=False, settings=None, with_sensor_ids=False, codec=None,
+               with_order=False):
+    """Return (messages, items) for one scene: one work item per selected frame that is not up to date
+
+    Frames come from the catalog (`query` holds the select_frames arguments),
+    which only locates their files: the inputs are stat'ed afresh for their
+    sizes and fingerprints. Item inputs are every sensor's points and labels,
+    in rig order.
+    Without a manifest (archive output) every frame is rebuilt and the
+    merged arrays are handed back to the parent instead of being written here.
+    `settings` (e.g. the voxel grid) are recorded with the input fingerprints,
+    so changing them rebuilds the frames. With a `codec` the merged points and
+    labels are .qbin/.qlabel files; `with_sensor_ids` and `with_order` add the
+    .sensor and order .npz outputs.
+    """
+    # Create scene directories in output
+    output_dirs = [os.path.join(OUTPUT_DIR, scene, "velodyne"), os.path.join(OUTPUT_DIR, scene, "labels")]
+    output_exts = [".bin", ".label"]
+    if with_sensor_ids:
+        output_dirs.append(os.path.join(OUTPUT_DIR, scene, "sensor"))
+        output_exts.append(".sensor")
+    if with_order:
+        output_dirs.append(os.path.join(OUTPUT_DIR, scene, "order"))
+        output_exts.append(".npz")
+    if manifest is not None:
+        for directory in output_dirs:
+            os.makedirs(directory, exist_ok=True)
+
+    if not catalog.files(catalog.sensor, "points", scene):
+        return [f"Missing {catalog.sensor} directory"], []
+    frames, messages = catalog.select(scene, **query)
+
+    # Outputs change every run, so they are listed here rather than catalogued
+    stats = {}
+    for directory in output_dirs:
+        for name, st in scan_dir(directory).items():
+            stats[os.path.join(directory, name)] = st
+
+    items = []
+    up_to_date = []
+    for frame in frames:
+        # A tuple, not a dict: two sensors of a rig may share a tree
+        inputs = tuple(catalog.path(sensor, modality, scene, frame)
+                       for sensor in catalog.layout for modality in ("points", "labels"))
+        input_stats = stat_files(inputs)
+        sizes = tuple(input_stats[path].st_size if input_stats[path] else None for path in inputs)
+        outputs = tuple(encoded_path(os.path.join(directory, f"{frame}{ext}"), codec) if ext in (".bin", ".label")
+                        else os.path.join(directory, f"{frame}{ext}")
+                        for directory, ext in zip(output_dirs, output_exts))
+
+        if manifest is None:
+            items.append((scene, frame, inputs, sizes, None, None))
+            continue
+
+        # Skip frames whose outputs were already built from these exact inputs
+        fingerprints = manifest.fingerprints(inputs, input_stats)
+        if settings:
+            fingerprints["settings"] = settings
+        if not force and all(output in stats and manifest.is_current(output, fingerprints, stats[output])
+                             for output in outputs):
+            up_to_date.append(frame)
             continue
-        
-        try:
-            # Load LIDAR0 data
-            points0 = np.fromfile(lidar0_file, dtype=np.float32).reshape(-1, 4)
-            
-            # Check if LIDAR1 file exists and has data
-            if os.path.exists(lidar1_file) and os.path.getsize(lidar1_file) > 0:
-                # Load LIDAR1 data
-                points1 = np.fromfile(lidar1_file, dtype=np.float32).reshape(-1, 4)
-                
-                # Concatenate points from both lidars
-                merged_points = np.vstack((points0, points1))
-                
-                print(f"MERGED - {len(points0):,} + {len(points1):,} = {len(merged_points):,} points")
-                print(f"        LIDAR0 intensity: [{points0[:, 3].min():.4f}, {points0[:, 3].max():.4f}]")
-                print(f"        LIDAR1 intensity: [{points1[:, 3].min():.4f}, {points1[:, 3].max():.4f}]")
-                print(f"        MERGED intensity: [{merged_points[:, 3].min():.4f}, {merged_points[:, 3].max():.4f}]")
+        items.append((scene, frame, inputs, sizes, outputs, fingerprints))
+
+    if up_to_date:
+        messages.append(f"Up to date, skipped {len(up_to_date)} frames: {', '.join(up_to_date)}")
+    return messages, items
+
+
+def load_sensor(points_file, labels_file, mapped=False):
+    """Load one sensor's points and labels (read-only memory mappings if `mapped`)"""
+    if mapped:
+        return map_array(points_file, np.float32, 4), map_array(labels_file, np.uint32)
+    points = fromfile(points_file, np.float32).reshape(-1, 4)
+    labels = fromfile(labels_file, np.uint32)
+    return points, labels
+
+
+def check_sensors(sensors):
+    """Raise if a sensor's (name, points, labels) do not have one label per point"""
+    for name, points, labels in sensors:
+        if len(points) != len(labels):
+            raise ValueError(f"{name} point/label count mismatch: {len(points):,} points vs {len(labels):,} labels")
+
+
+def merge_sensors(sensors, extrinsics=None):
+    """Concatenate the (name, points, labels) of every sensor, keeping one label per point
+
+    `extrinsics` optionally holds each sensor's 4x4 transform into the rig
+    frame (None for sensors already in it). Every sensor is copied, and
+    transformed, straight into its block of one preallocated output.
+    """
+    check_sensors(sensors)
+    extrinsics = extrinsics or [None] * len(sensors)
+
+    if len(sensors) == 1 and extrinsics[0] is None:
+        return sensors[0][1], sensors[0][2]
+
+    total = sum(len(points) for _, points, _ in sensors)
+    merged_points = np.empty((total, 4), dtype=np.float32)
+    merged_labels = np.empty(total, dtype=np.uint32)
+    start = 0
+    for (_, points, labels), extrinsic in zip(sensors, extrinsics):
+        end = start + len(points)
+        transform_into(merged_points[start:end], points, extrinsic)
+        merged_labels[start:end] = labels
+        start = end
+    return merged_points, merged_labels
+
+
+def merge_report(prefix, sensors, merged_points, histograms):
+    """Log lines describing one merged frame; `histograms` comes from frame_histograms(sensors)
+
+    `merged_points` may be None when the merged frame is just the sensors back
+    to back; its range is then taken from the sensors.
+    """
+    counts = {name: len(points) for name, points, _ in sensors}
+    ranges = {name: (points[:, 3].min(), points[:, 3].max()) for name, points, _ in sensors if len(points)}
+    total = sum(counts.values())
+    if merged_points is not None:
+        total = len(merged_points)
+        ranges[MERGED] = (merged_points[:, 3].min(), merged_points[:, 3].max())
+    return format_merge_report(prefix, counts, ranges, histograms, total)
+
+
+def format_merge_report(prefix, counts, ranges, histograms, total):
+    """The lines of merge_report from a frame's {sensor: points}, {sensor: (min, max) intensity} and histograms
+
+    Without a MERGED entry in `ranges` the merged range is that of the sensors.
+    """
+    if len(counts) == 1:
+        name, count = next(iter(counts.items()))
+        return [
+            prefix + f"{name} ONLY - {count:,} points (other sensors empty/missing)",
+            f"        {name} intensity: [{ranges[name][0]:.4f}, {ranges[name][1]:.4f}]",
+            f"        {name} semantic classes: {len(histograms[name].classes)}",
+        ]
+
+    merged_range = ranges.get(MERGED) or (min(ranges[name][0] for name in counts if name in ranges),
+                                          max(ranges[name][1] for name in counts if name in ranges))
+    lines = [prefix + f"MERGED - {' + '.join(f'{count:,}' for count in counts.values())} = {total:,} points"]
+    for name in counts:
+        lines.append(f"        {name} intensity: [{ranges[name][0]:.4f}, {ranges[name][1]:.4f}]")
+    lines.append(f"        MERGED intensity: [{merged_range[0]:.4f}, {merged_range[1]:.4f}]")
+    for name in counts:
+        lines.append(f"        {name} semantic classes: {len(histograms[name].classes)}")
+    lines.append(f"        MERGED semantic classes: {len(histograms[MERGED].classes)}")
+    return lines
+
+
+def check_sizes(rig, used, file_sizes):
+    """Raise if a used sensor's file sizes show a partial point or label, or a point/label count mismatch"""
+    for i in used:
+        points_size, labels_size = file_sizes[i]
+        if points_size % 16 or labels_size % 4:
+            raise ValueError(f"{rig[i].name} files are not whole points/labels: {points_size:,} and "
+                             f"{labels_size:,} bytes")
+        if points_size // 16 != labels_size // 4:
+            raise ValueError(f"{rig[i].name} point/label count mismatch: {points_size // 16:,} points vs "
+                             f"{labels_size // 4:,} labels")
+
+
+def used_sensors(rig, file_sizes):
+    """Indices of the rig's sensors that take part in a frame, given each sensor's (points, labels) file sizes
+
+    The other sensors take part if either of their files has data; then both
+    must be there.
+    """
+    used = []
+    for i, (sensor, (points_size, labels_size)) in enumerate(zip(rig, file_sizes)):
+        if i and not (points_size or labels_size):
+            continue
+        if points_size is None or labels_size is None:
+            raise ValueError(f"{sensor.name} has only one of its .bin/.label files")
+        used.append(i)
+    return used
+
+
+def is_streamed(sizes, max_memory):
+    """Whether a frame's sensors need more than `max_memory` MB together, so the frame is merged in blocks"""
+    return (max_memory is not None
+            and sum(size or 0 for size in sizes[::2]) // 16 * BLOCK_BYTES_PER_POINT > max_memory * 1e6)
+
+
+def merge_streamed(rig, used, files, outputs, block, label_map=None, verbose=False, stats=False):
+    """Merge a frame too large to load block by block, appending every block to the outputs as it is made
+
+    Every sensor's points and labels are walked in memory-mapped windows of
+    `block` points; each window is transformed, remapped and appended to the
+    merged files (and the .sensor file, if among the outputs). Point counts,
+    intensity ranges and label histograms are accumulated over the blocks, so
+    they come out as if the frame had been loaded whole; so do compacted
+    instance ids, numbered in a first pass over every sensor's labels. Returns
+    (counts {sensor: points}, ranges {sensor: (min, max)}, histograms or None).
+    The caller checks the sensors' file sizes (check_sizes) before any block
+    is written.
+    """
+    names = [rig[i].name for i in used]
+    instance_ids = None
+    if label_map is not None and label_map.instances == "compact":
+        with stage("remap"):
+            instance_ids = label_map.instance_ids(labels for i in used
+                                                  for labels in map_windows(files[i][1], np.uint32, None, block))
+
+    counts = dict.fromkeys(names, 0)
+    ranges = {}
+    histograms = {name: LabelHistogram() for name in names + [MERGED]} if verbose or stats else None
+    buffer = np.empty((block, 4), dtype=np.float32)
+    with ExitStack() as stack:
+        writers = [stack.enter_context(AppendWriter(output)) for output in outputs]
+        for i, name in zip(used, names):
+            extrinsic = rig[i].extrinsic
+            for points, labels in zip(map_windows(files[i][0], np.float32, 4, block),
+                                      map_windows(files[i][1], np.uint32, None, block)):
+                with stage("merge"):
+                    merged_points = points if extrinsic is None else transform_into(buffer[:len(points)], points,
+                                                                                     extrinsic)
+                    merged_labels = labels if label_map is None else label_map.apply(labels, instance_ids)
+                if verbose or stats:
+                    with stage("report"):
+                        histogram = LabelHistogram.from_labels(labels)
+                        histograms[name] += histogram
+                        histograms[MERGED] += (histogram if label_map is None
+                                               else LabelHistogram.from_labels(merged_labels))
+                        low, high = points[:, 3].min(), points[:, 3].max()
+                        if name in ranges:
+                            low, high = min(low, ranges[name][0]), max(high, ranges[name][1])
+                        ranges[name] = (low, high)
+                with stage("write"):
+                    writers[0].append(merged_points)
+                    writers[1].append(merged_labels)
+                    if len(writers) > 2:
+                        # Sensor ids follow the rig order, so they mean the same in every frame
+                        writers[2].append(np.full(len(points), i, dtype=np.uint8))
+                counts[name] += len(points)
+    if histograms is not None:
+        for histogram in histograms.values():
+            histogram.frames = 1
+    return counts, ranges, histograms
+
+
+def frame_inputs(item, max_memory=None):
+    """Existing input files of a merge item, for the frame loop to prefetch (none for a streamed frame)"""
+    _, _, inputs, sizes, _, _ = item
+    if is_streamed(sizes, max_memory):
+        return []
+    return [path for path, size in zip(inputs, sizes) if size is not None]
+
+
+def merge_frame(item, rig, voxel_size=None, voxel_mode="centroid", verbose=False, stats=False, codec=None,
+                reorder=None, reorder_bits=CURVE_BITS, label_map=None, max_memory=None):
+    """Merge the points and labels of every sensor of the rig for one frame in one pass
+
+    Sensors with an extrinsic are transformed into the rig frame on the way.
+    With `voxel_size` the merged frame is reduced to one point per voxel.
+    Without either, the merged files are the sensors' files back to back, so
+    they are concatenated inside the kernel (frame_io.concat_files) and the
+    inputs are only memory-mapped, for the checks and any statistics asked
+    for. Label histograms are computed only for `stats`, the per-frame report
+    (intensity ranges, class counts) only when `verbose`. With a `codec` the
+    merged frame is written quantized (point_codec). A `label_map` remaps the
+    merged labels right after the merge. With `reorder` the frame
+    is sorted along that space-filling curve, labels alike. Extra outputs, if
+    the item has them, get the uint8 sensor id of every point (.sensor) and
+    the frame's curve permutation and bounding box (.npz). A frame that would
+    need more than `max_memory` MB is merged in blocks (merge_streamed),
+    unless it is a plain kernel-side concatenation with no statistics to take.
+    """
+    _, frame, inputs, sizes, outputs, _ = item
+    files = list(zip(inputs[::2], inputs[1::2]))
+    file_sizes = list(zip(sizes[::2], sizes[1::2]))
+    reference = rig[0].name
+    prefix = f"Processing frame {frame}: "
+    direct = (outputs is not None and not voxel_size and codec is None and reorder is None and label_map is None
+              and all(sensor.extrinsic is None for sensor in rig))
+    streamed = outputs is not None and is_streamed(sizes, max_memory) and not (direct and not (verbose or stats))
+
+    if file_sizes[0][0] is None:
+        return frame_result("skipped", prefix + f"Missing {reference} file")
+    if file_sizes[0][1] is None:
+        return frame_result("skipped", prefix + f"Missing {reference} label file")
+
+    try:
+        used = used_sensors(rig, file_sizes)
+        check_sizes(rig, used, file_sizes)
+        if streamed:
+            block = block_points(max_memory, BLOCK_BYTES_PER_POINT)
+            sensor_points, ranges, histograms = merge_streamed(rig, used, files, outputs, block, label_map,
+                                                               verbose, stats)
+            total = sum(sensor_points.values())
+            lines = format_merge_report(prefix, sensor_points, ranges, histograms, total) if verbose else []
+            return frame_result("ok", *lines, sensor_points=sensor_points, points_in=total, points_out=total,
+                                histograms=histograms)
+
+        with stage("load"):
+            sensors = [(rig[i].name,) + load_sensor(*files[i], direct) for i in used]
+
+        with stage("merge"):
+            if direct:
+                check_sensors(sensors)
+                merged_points = merged_labels = None
+                points_in = points_out = sum(len(points) for _, points, _ in sensors)
+            else:
+                merged_points, merged_labels = merge_sensors(sensors, [rig[i].extrinsic for i in used])
+                points_in = len(merged_points)
+                if label_map is not None:
+                    merged_labels = label_map.apply(merged_labels)
+                if voxel_size:
+                    merged_points, merged_labels = voxel_downsample(merged_points, merged_labels,
+                                                                    voxel_size, voxel_mode)
+                points_out = len(merged_points)
+
+        order = None
+        if reorder is not None:
+            with stage("reorder"):
+                order, bbox = curve_order(merged_points[:, :3], reorder, reorder_bits)
+                merged_points = merged_points[order]
+                merged_labels = merged_labels[order]
+
+        lines = []
+        histograms = None
+        if verbose or stats:
+            with stage("report"):
+                histograms = frame_histograms(sensors)
+                if voxel_size or label_map is not None:
+                    # The merged statistics describe the written frame
+                    histograms[MERGED] = LabelHistogram.from_labels(merged_labels)
+                if verbose:
+                    lines = merge_report(prefix, sensors, merged_points, histograms)
+                    if voxel_size:
+                        lines.append(compression_report(voxel_size, voxel_mode, points_in, points_out))
+        counts = {"sensor_points": {name: len(points) for name, points, _ in sensors},
+                  "points_in": points_in, "points_out": points_out, "histograms": histograms}
+
+        # Archive output: the parent appends the frame to the scene archive
+        if outputs is None:
+            return frame_result("ok", *lines, merged_points=merged_points, merged_labels=merged_labels, **counts)
+
+        # Save merged files
+        output_file, output_label_file = outputs[:2]
+        extra_outputs = {os.path.splitext(output)[1]: output for output in outputs[2:]}
+        with stage("write"):
+            if direct:
+                concat_files([files[i][0] for i in used], output_file, sum(file_sizes[i][0] for i in used))
+                concat_files([files[i][1] for i in used], output_label_file, sum(file_sizes[i][1] for i in used))
             else:
-                # Use only LIDAR0 data
-                merged_points = points0
-                print(f"LIDAR0 ONLY - {len(points0):,} points (LIDAR1 empty/missing)")
-                print(f"        LIDAR0 intensity: [{points0[:, 3].min():.4f}, {points0[:, 3].max():.4f}]")
-            
-            # Save merged file
-            merged_points.tofile(output_file)
-            
-        except Exception as e:
-            print(f"Error: {e}")
+                write_points(merged_points, output_file, codec)
+                write_labels(merged_labels, output_label_file, codec)
+            if ".sensor" in extra_outputs:
+                # Sensor ids follow the rig order, so they mean the same in every frame
+                point_counts = [0] * len(rig)
+                for i, (_, points, _) in zip(used, sensors):
+                    point_counts[i] = len(points)
+                ids = sensor_ids(point_counts)
+                write_array(ids if order is None else ids[order], extra_outputs[".sensor"])
+            if ".npz" in extra_outputs:
+                # order[i] is the pre-sort index of output point i
+                path = extra_outputs[".npz"]
+                write_behind(path, partial(atomic_savez, path, permutation=order.astype(np.uint32), bbox=bbox))
+        return frame_result("ok", *lines, **counts)
+
+    except Exception as e:
+        return frame_result("error", prefix + f"Error: {e}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Merge the .bin and .label files of every lidar of a rig per frame")
+    add_workers_argument(parser)
+    add_io_depth_argument(parser)
+    add_manifest_arguments(parser)
+    add_stats_argument(parser)
+    add_voxel_arguments(parser)
+    add_metrics_arguments(parser)
+    add_selection_arguments(parser, *FRAME_RANGE, FRAME_STRIDE)
+    add_calibration_argument(parser)
+    parser.add_argument("--sensor-ids", action="store_true",
+                        help="Also write <scene>/sensor/<frame>.sensor: the uint8 index (rig order) "
+                             "of the sensor every merged point came from")
+    add_codec_arguments(parser)
+    add_reorder_arguments(parser)
+    add_label_map_arguments(parser)
+    add_max_memory_argument(parser)
+    parser.add_argument("--store-order", action="store_true",
+                        help="With --reorder, also write <scene>/order/<frame>.npz: the permutation applied "
+                             "and the frame's bounding box")
+    parser.add_argument("--output-archive", metavar="DIR",
+                        help="Write merged scenes to <DIR>/<scene>.pack archives instead of the directory tree")
+    args = parser.parse_args(argv)
+    if args.sensor_ids and (args.voxel_size or args.output_archive):
+        parser.error("--sensor-ids needs plain tree output (no --voxel-size or --output-archive)")
+    try:
+        codec = codec_from_args(args)
+    except ValueError as e:
+        parser.error(str(e))
+    if codec is not None and args.output_archive:
+        parser.error("--codec quantized writes the directory tree; it cannot be combined with --output-archive")
+    if args.store_order and (args.reorder is None or args.output_archive):
+        parser.error("--store-order needs --reorder and plain tree output (no --output-archive)")
+    if args.max_memory is not None:
+        if args.max_memory <= 0:
+            parser.error("--max-memory must be positive")
+        if args.voxel_size or args.reorder or codec is not None or args.output_archive:
+            parser.error("--max-memory streams frames block by block; it cannot be combined with --voxel-size, "
+                         "--reorder, --codec quantized or --output-archive, which need whole frames")
+
+    try:
+        label_map = label_map_from_args(args)
+    except (OSError, ImportError, ValueError) as e:
+        parser.error(f"Bad label map: {e}")
+    try:
+        rig = load_rig(args.calibration, default_rig())
+    except (OSError, ValueError, KeyError) as e:
+        parser.error(f"Bad calibration: {e}")
+
+    print(f"MERGING {' + '.join(sensor.name for sensor in rig)} POINTS AND LABELS INTO SINGLE FILES")
+    print("=" * 80)
+
+    # Create output directory; archives are always rebuilt whole, so they skip the manifest
+    if args.output_archive:
+        os.makedirs(args.output_archive, exist_ok=True)
+        manifest = None
+    else:
+        os.makedirs(OUTPUT_DIR, exist_ok=True)
+        manifest = Manifest(OUTPUT_DIR, content_hash=args.hash)
+
+    settings = {}
+    if args.voxel_size:
+        settings.update(voxel_size=args.voxel_size, voxel_mode=args.voxel_mode)
+    if rig_settings(rig):
+        settings["extrinsics"] = rig_settings(rig)
+    if args.calibration or args.sensor_ids:
+        # Merge order decides where every sensor's points land (and their ids)
+        settings["sensors"] = [sensor.name for sensor in rig]
+        settings["sensor_ids"] = args.sensor_ids
+    if codec is not None:
+        settings["codec"] = codec._asdict()
+    if args.reorder:
+        settings["reorder"] = {"curve": args.reorder, "bits": args.reorder_bits}
+    if label_map is not None:
+        settings["label_map"] = label_map.settings()
+    catalog = input_catalog(rig, args.refresh_catalog)
+    query = frame_query(args)
+    messages = {}
+    plans = []
+    for scene in args.scenes or scenes or catalog.scenes():
+        messages[scene], items = plan_scene(scene, catalog, query, manifest, args.force, settings or None,
+                                            args.sensor_ids, codec, args.store_order)
+        plans.append((scene, items))
+
+    writers = {}
+    stats = LabelStats()
+
+    def record(item, result):
+        if result["status"] != "ok":
+            if result["status"] == "error" and manifest is not None:
+                # Whatever the outputs hold, they no longer match these inputs
+                for output in item[-2]:
+                    manifest.forget(output)
+            return
+        scene, frame = item[:2]
+        histograms = result.pop("histograms")
+        if histograms is not None:
+            stats.add(scene, histograms)
+        if manifest is None:
+            # Stream the frame into its scene archive and drop the arrays
+            if scene not in writers:
+                writers[scene] = ArchiveWriter(archive_path(args.output_archive, scene))
+            writers[scene].add(frame, result.pop("merged_points"), result.pop("merged_labels"))
+            return
+        # Journal each finished frame right away so an interrupted run resumes here
+        outputs, fingerprints = item[-2:]
+        for output in outputs:
+            manifest.record(output, fingerprints)
+
+    errors = 0
+    monitor = Monitor.from_args("merge_lidar", args)
+    merge = partial(merge_frame, rig=rig, voxel_size=args.voxel_size, voxel_mode=args.voxel_mode,
+                    verbose=args.verbose, stats=bool(args.stats), codec=codec,
+                    reorder=args.reorder, reorder_bits=args.reorder_bits, label_map=label_map,
+                    max_memory=args.max_memory)
+    # Plain merges are copied file to file in the kernel; reading the inputs ahead would only cost memory
+    rewritten = (args.voxel_size or args.output_archive or codec or args.reorder or label_map
+                 or any(sensor.extrinsic is not None for sensor in rig))
+    prefetch = partial(frame_inputs, max_memory=args.max_memory) if rewritten else None
+    # Archive results carry the merged arrays: a worker holds a whole chunk of them until it is done
+    max_chunk = max(args.io_depth, 1) if args.output_archive else None
+    for scene, results in run_scenes(merge, plans, args.workers, on_result=record, prefetch=prefetch,
+                                     io_depth=args.io_depth, monitor=monitor, max_chunk=max_chunk):
+        if scene in writers:
+            writers.pop(scene).close()
+        report_scene(scene, messages[scene], results, args.verbose)
+        errors += sum(result["status"] == "error" for result in results)
+    monitor.close()
+
+    if manifest is not None:
+        manifest.close()
+
+    # Histograms cover the frames built in this run (up-to-date frames are not re-read)
+    if args.stats:
+        stats.write(args.stats)
+        print(f"\nLabel statistics written to {args.stats}")
+
+    if errors:
+        print(f"\n{errors} frames failed (see errors above); their outputs were not written")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
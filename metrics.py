@@ -0,0 +1,274 @@
+import json
+import os
+import sys
+import threading
+import time
+from contextlib import contextmanager
+
+# Minimum seconds between two console progress lines
+PROGRESS_INTERVAL = 2.0
+
+# Environment variable carrying the profiling setup to worker processes
+PROFILE_ENV = "LIDAR_PROFILE"
+
+# Counters of the frame being processed in this process (None outside a frame)
+_frame = None
+_lock = threading.Lock()
+
+# Per-process profilers, by stage
+_profiles = {}
+_profiling = False
+_profile_setup = (None, None)
+
+
+def add_metrics_arguments(parser):
+    """Add the shared metrics, verbosity and profiling options to a script's argument parser"""
+    parser.add_argument("--metrics", metavar="FILE",
+                        help="Append one JSON line per frame (timings, bytes, points) and a run summary to FILE")
+    parser.add_argument("--verbose", action="store_true",
+                        help="Print every frame's log and compute its diagnostic statistics "
+                             "(default: throttled progress, problems only)")
+    parser.add_argument("--profile", nargs="+", metavar="STAGE",
+                        help="Profile these stages (\"frame\" is the whole per-frame function); "
+                             "a stage inside one already being profiled is covered by the outer profile")
+    parser.add_argument("--profile-mode", choices=("cprofile", "tracemalloc"), default="cprofile",
+                        help="cProfile stats per stage and process, or tracemalloc peak per stage (default: cprofile)")
+    parser.add_argument("--profile-dir", default="profiles",
+                        help="Where cProfile stats are written (default: ./profiles)")
+
+
+def begin_frame():
+    """Start counting for a new frame in this process"""
+    global _frame
+    _frame = {"read_s": 0.0, "write_s": 0.0, "wait_s": 0.0, "bytes_read": 0, "bytes_written": 0, "stages": {}}
+    return _frame
+
+
+def end_frame(wall):
+    """Finish the current frame; returns its counters (background writes may still add to them)"""
+    global _frame
+    counters, _frame = _frame, None
+    counters["wall_s"] = wall
+    flush_profiles()
+    return counters
+
+
+def current_frame():
+    return _frame
+
+
+def add_read(nbytes, seconds, waited=None, counters=None):
+    """Count a read of the current frame; `waited` is how long the frame blocked on it (default: all of it)"""
+    counters = counters if counters is not None else _frame
+    if counters is None:
+        return
+    with _lock:
+        counters["bytes_read"] += nbytes
+        counters["read_s"] += seconds
+        counters["wait_s"] += seconds if waited is None else waited
+
+
+def add_cache_lookup(hit):
+    """Count a lookup of the current frame in an on-disk cache"""
+    if _frame is None:
+        return
+    key = "cache_hits" if hit else "cache_misses"
+    with _lock:
+        _frame[key] = _frame.get(key, 0) + 1
+
+
+def add_write(nbytes, seconds, waited, counters):
+    """Count a write of a frame (possibly from an I/O thread, after the frame returned)"""
+    if counters is None:
+        return
+    with _lock:
+        counters["bytes_written"] += nbytes
+        counters["write_s"] += seconds
+        counters["wait_s"] += waited
+
+
+def _profile_config():
+    """(stages, mode, directory) from the environment, or None when profiling is off"""
+    global _profile_setup
+    raw = os.environ.get(PROFILE_ENV)
+    if raw != _profile_setup[0]:
+        config = json.loads(raw) if raw else None
+        _profile_setup = (raw, config and (set(config["stages"]), config["mode"], config["dir"]))
+    return _profile_setup[1]
+
+
+@contextmanager
+def stage(name):
+    """Time a stage of the current frame, profiling it when --profile names it
+
+    Only the outermost profiled stage owns the profiler; stages nested in it
+    are covered by its profile.
+    """
+    global _profiling
+    config = _profile_config()
+    owner = bool(config and name in config[0] and not _profiling)
+    profiler = None
+    traced = False
+    if owner:
+        _profiling = True
+        if config[1] == "cprofile":
+            import cProfile
+            profiler = _profiles.setdefault(name, cProfile.Profile())
+            profiler.enable()
+        else:
+            import tracemalloc
+            traced = not tracemalloc.is_tracing()
+            if traced:
+                tracemalloc.start()
+            tracemalloc.reset_peak()
+
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        peak = None
+        if owner:
+            if profiler is not None:
+                profiler.disable()
+            else:
+                import tracemalloc
+                peak = tracemalloc.get_traced_memory()[1]
+                if traced:
+                    tracemalloc.stop()
+            _profiling = False
+
+        if _frame is not None:
+            stats = _frame["stages"].setdefault(name, {"s": 0.0})
+            stats["s"] += elapsed
+            if peak is not None:
+                stats["peak_alloc_bytes"] = max(stats.get("peak_alloc_bytes", 0), peak)
+
+
+def flush_profiles():
+    """Write this process's cProfile stats, one file per stage (overwritten after every frame)"""
+    if not _profiles:
+        return
+    directory = _profile_config()[2]
+    os.makedirs(directory, exist_ok=True)
+    for name, profiler in _profiles.items():
+        profiler.dump_stats(os.path.join(directory, f"{name}-{os.getpid()}.prof"))
+
+
+def describe(item):
+    """Short label of a work item for the metrics log: "scene/frame" where the item has them"""
+    if isinstance(item, tuple):
+        return f"{item[0]}/{item[1]}"
+    if hasattr(item, "scene") and hasattr(item, "frame"):
+        return f"{item.scene}/{item.frame}"
+    return str(item)
+
+
+def report_scene(scene, messages, results, verbose=False, header="Scene"):
+    """Print a scene's messages and frame logs: every frame when verbose, otherwise only frames that were not ok"""
+    shown = [result for result in results if verbose or result["status"] != "ok"]
+    if not (verbose or messages or shown):
+        return
+    print(f"\n{header} {scene}")
+    for message in messages:
+        print(message)
+    for result in shown:
+        print("\n".join(result["lines"]))
+
+
+class Monitor:
+    """Parent-side view of a run: JSON-lines metrics, throttled progress and the final summary
+
+    Every frame result carries the counters its worker recorded under
+    result["metrics"]; update() logs them and adds them to the totals.
+    """
+
+    def __init__(self, script, path=None, verbose=False, profile=None, profile_mode="cprofile",
+                 profile_dir="profiles", interval=PROGRESS_INTERVAL, stream=None):
+        self.script = script
+        self.verbose = verbose
+        self.interval = interval
+        self.stream = stream or sys.stdout
+        self.file = open(path, "a") if path else None
+        self.total = None
+        self.done = 0
+        self.counts = {}
+        self.totals = {"wall_s": 0.0, "read_s": 0.0, "write_s": 0.0, "wait_s": 0.0,
+                       "bytes_read": 0, "bytes_written": 0, "points_in": 0, "points_out": 0,
+                       "cache_hits": 0, "cache_misses": 0}
+        self.stages = {}
+        self.start_time = time.perf_counter()
+        self.last_print = self.start_time
+
+        # Workers read the profiling setup from the environment, under fork or spawn alike
+        if profile:
+            os.environ[PROFILE_ENV] = json.dumps({"stages": profile, "mode": profile_mode,
+                                                  "dir": os.path.abspath(profile_dir)})
+        else:
+            os.environ.pop(PROFILE_ENV, None)
+
+    @classmethod
+    def from_args(cls, script, args):
+        return cls(script, args.metrics, args.verbose, args.profile, args.profile_mode, args.profile_dir)
+
+    def start(self, total):
+        """Set the number of frames the progress line counts towards"""
+        self.total = total
+
+    def update(self, item, result):
+        """Account for one finished frame"""
+        self.done += 1
+        self.counts[result["status"]] = self.counts.get(result["status"], 0) + 1
+        counters = result.get("metrics", {})
+        record = {"script": self.script, "item": describe(item), "status": result["status"],
+                  "points_in": result.get("points_in", 0), "points_out": result.get("points_out", 0)}
+        record.update(counters)
+        if "wall_s" in record:
+            record["compute_s"] = max(record["wall_s"] - record["wait_s"], 0.0)
+
+        for key in self.totals:
+            self.totals[key] += record.get(key, 0)
+        for name, stats in counters.get("stages", {}).items():
+            totals = self.stages.setdefault(name, {"s": 0.0})
+            totals["s"] += stats["s"]
+            if "peak_alloc_bytes" in stats:
+                totals["peak_alloc_bytes"] = max(totals.get("peak_alloc_bytes", 0), stats["peak_alloc_bytes"])
+
+        if self.file:
+            self.file.write(json.dumps(record) + "\n")
+        self._progress()
+
+    def _progress(self, force=False):
+        now = time.perf_counter()
+        if not force and (self.verbose or now - self.last_print < self.interval):
+            return
+        self.last_print = now
+        elapsed = now - self.start_time
+        rate = self.totals["points_in"] / elapsed if elapsed else 0.0
+        done = f"{self.done}/{self.total}" if self.total is not None else f"{self.done}"
+        line = f"[PROGRESS] {self.script}: {done} frames, {rate / 1e6:.2f} Mpoints/s"
+        if self.total and self.done and self.done < self.total:
+            line += f", ~{elapsed / self.done * (self.total - self.done):.0f}s left"
+        print(line, file=self.stream, flush=True)
+
+    def summary(self):
+        elapsed = time.perf_counter() - self.start_time
+        return {"script": self.script, "summary": True, "frames": self.done, "status": self.counts,
+                "elapsed_s": elapsed, **self.totals,
+                "compute_s": max(self.totals["wall_s"] - self.totals["wait_s"], 0.0), "stages": self.stages}
+
+    def close(self):
+        """Print the final summary line and write the summary record"""
+        summary = self.summary()
+        status = ", ".join(f"{count} {status}" for status, count in sorted(self.counts.items()))
+        print(f"[SUMMARY] {self.script}: {self.done} frames ({status or 'none'}) in {summary['elapsed_s']:.1f}s, "
+              f"{summary['points_in']:,} points in, {summary['points_out']:,} out, "
+              f"{summary['bytes_read'] / 1e6:.1f} MB read, {summary['bytes_written'] / 1e6:.1f} MB written, "
+              f"I/O wait {summary['wait_s']:.1f}s of {summary['wall_s']:.1f}s frame time"
+              + (f", cache {summary['cache_hits']:,} hits / {summary['cache_misses']:,} misses"
+                 if summary["cache_hits"] or summary["cache_misses"] else ""),
+              file=self.stream, flush=True)
+        if self.file:
+            self.file.write(json.dumps(summary) + "\n")
+            self.file.close()
+        os.environ.pop(PROFILE_ENV, None)
@@ -0,0 +1,110 @@
+import time
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+
+from frame_io import run_frames
+from metrics import begin_frame, end_frame, stage
+
+
+def add_workers_argument(parser):
+    """Add the shared --workers option to a script's argument parser"""
+    parser.add_argument("--workers", type=int, default=1,
+                        help="Number of worker processes for per-frame work (default: 1, serial)")
+
+
+def frame_result(status, *lines, **counts):
+    """Build the per-item result returned to the parent process
+
+    `status` is "ok", "skipped" or "error"; `lines` are the log lines the parent
+    prints for this item and `counts` any numbers it sums into its summary.
+    """
+    return {"status": status, "lines": list(lines), **counts}
+
+
+def _call(func, item):
+    """Run one work item, turning an exception into an error result
+
+    The item's timings and I/O counters (metrics.py) are attached as
+    result["metrics"].
+    """
+    begin_frame()
+    start = time.perf_counter()
+    try:
+        with stage("frame"):
+            result = func(item)
+    except Exception as e:
+        result = frame_result("error", f"[ERROR] {item}: {e}")
+    result["metrics"] = end_frame(time.perf_counter() - start)
+    return result
+
+
+def _run_chunk(func, prefetch, io_depth, items):
+    """Run a run of consecutive items in one worker with read-ahead/write-behind"""
+    return list(run_frames(partial(_call, func), items, prefetch, io_depth))
+
+
+def run_items(func, items, workers=1, chunksize=1, prefetch=None, io_depth=0, monitor=None, max_chunk=None):
+    """Yield func(item) for every item, in item order
+
+    With workers > 1 the items are fanned out over a process pool; results still
+    come back in submission order so output and summaries are deterministic.
+    A failing item yields an "error" result instead of stopping the run.
+
+    With `prefetch` (item -> input paths) and io_depth > 0 every worker reads
+    the inputs of its next io_depth items ahead and writes behind (frame_io);
+    workers then get the items in runs of consecutive items, and a run's
+    results come back together once it is done; `max_chunk` caps the run
+    length for results that carry whole arrays. A metrics.Monitor passed as
+    `monitor` sees every result as it arrives.
+    """
+    items = list(items)
+    if monitor is not None:
+        monitor.start(len(items))
+    for item, result in zip(items, _results(func, items, workers, chunksize, prefetch, io_depth, max_chunk)):
+        if monitor is not None:
+            monitor.update(item, result)
+        yield result
+
+
+def _results(func, items, workers, chunksize, prefetch, io_depth, max_chunk):
+    if prefetch is not None and io_depth > 0:
+        if workers <= 1:
+            yield from run_frames(partial(_call, func), items, prefetch, io_depth)
+            return
+        size = max(chunksize, -(-len(items) // (workers * 4)))
+        if max_chunk is not None:
+            size = min(size, max_chunk)
+        chunks = [items[i:i + size] for i in range(0, len(items), size)]
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            for results in pool.map(partial(_run_chunk, func, prefetch, io_depth), chunks):
+                yield from results
+        return
+
+    if workers <= 1:
+        for item in items:
+            yield _call(func, item)
+        return
+
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        yield from pool.map(partial(_call, func), items, chunksize=chunksize)
+
+
+def run_scenes(func, plans, workers=1, on_result=None, prefetch=None, io_depth=0, monitor=None, max_chunk=None):
+    """Run func over the items of every (scene, items) plan
+
+    All items go into one pool so it stays busy across scene boundaries; yields
+    (scene, results) per scene, in plan order. `on_result(item, result)` is
+    called in the parent as soon as each item's result arrives. `max_chunk`
+    is as for run_items.
+    """
+    plans = list(plans)
+    results = run_items(func, [item for _, items in plans for item in items], workers,
+                        prefetch=prefetch, io_depth=io_depth, monitor=monitor, max_chunk=max_chunk)
+    for scene, items in plans:
+        scene_results = []
+        for item in items:
+            result = next(results)
+            if on_result is not None:
+                on_result(item, result)
+            scene_results.append(result)
+        yield scene, scene_results
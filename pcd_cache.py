@@ -0,0 +1,112 @@
+import hashlib
+import os
+import numpy as np
+
+from metrics import add_cache_lookup
+from pcd_io import read_pcd, read_pcd_header
+
+# Default cap on the cache's size; the least recently used fields go first
+PCD_CACHE_SIZE_MB = 2048
+
+
+def add_pcd_cache_arguments(parser):
+    """Add the shared decoded-PCD cache options to a script's argument parser"""
+    parser.add_argument("--pcd-cache", metavar="DIR",
+                        help="Keep decoded PCD fields in DIR (one .npy file per PCD and field) and reuse them while "
+                             "the PCD is unchanged (default: off, every PCD is parsed)")
+    parser.add_argument("--pcd-cache-size", type=float, default=PCD_CACHE_SIZE_MB, metavar="MB",
+                        help="Size cap of the PCD cache; least recently used fields are evicted at the end of a run "
+                             f"(default: {PCD_CACHE_SIZE_MB})")
+
+
+def pcd_cache_from_args(args):
+    """FieldCache of parsed options, or None if the cache is off"""
+    if not args.pcd_cache:
+        return None
+    return FieldCache(args.pcd_cache, args.pcd_cache_size)
+
+
+def read_fields(pcd_path, names, cache=None, header=None):
+    """{name: 1-D array} of some fields of a PCD, through `cache` if given"""
+    if cache is not None:
+        return cache.read(pcd_path, names, header)
+    cloud = read_pcd(pcd_path, header)
+    return {name: cloud[name] for name in names}
+
+
+class FieldCache:
+    """Decoded PCD fields kept as .npy files, keyed by PCD path, size, mtime and field name
+
+    A hit is memory-mapped, so reading one field of a cached PCD costs the
+    pages of that field only and no parsing. A miss parses the PCD once for
+    all the fields asked for and saves each of them. Every hit refreshes the
+    file's mtime, so evict() drops the least recently used fields first.
+    Pickling keeps only the directory and cap.
+    """
+
+    def __init__(self, directory, max_mb=PCD_CACHE_SIZE_MB):
+        self.directory = directory
+        self.max_mb = max_mb
+
+    def __repr__(self):
+        return f"FieldCache({self.directory!r}, {self.max_mb} MB)"
+
+    def path(self, pcd_path, st, name):
+        key = f"{os.path.abspath(pcd_path)}\0{st.st_size}\0{st.st_mtime_ns}\0{name}"
+        return os.path.join(self.directory, f"{hashlib.sha1(key.encode()).hexdigest()}.npy")
+
+    def read(self, pcd_path, names, header=None):
+        """{name: read-only array} of fields of a PCD, from the cache or parsed and cached"""
+        st = os.stat(pcd_path)
+        fields = {}
+        missing = []
+        for name in names:
+            path = self.path(pcd_path, st, name)
+            try:
+                fields[name] = np.load(path, mmap_mode="r")
+                os.utime(path)
+            except (FileNotFoundError, ValueError):
+                # Absent, evicted meanwhile or cut short: parse again
+                missing.append(name)
+            add_cache_lookup(name not in missing)
+        if not missing:
+            return fields
+
+        header = header or read_pcd_header(pcd_path)
+        cloud = read_pcd(pcd_path, header)
+        os.makedirs(self.directory, exist_ok=True)
+        for name in missing:
+            values = np.ascontiguousarray(cloud[name])
+            path = self.path(pcd_path, st, name)
+            tmp_path = f"{path}.tmp.{os.getpid()}"
+            try:
+                with open(tmp_path, "wb") as f:
+                    np.save(f, values)
+                os.replace(tmp_path, path)
+            except OSError:
+                # A full or read-only cache only costs the speedup
+                if os.path.exists(tmp_path):
+                    os.remove(tmp_path)
+            fields[name] = values
+        return fields
+
+    def evict(self):
+        """Delete the least recently used fields until the cache fits its cap; returns (files, bytes) removed"""
+        try:
+            entries = [entry for entry in os.scandir(self.directory) if entry.name.endswith(".npy")]
+        except FileNotFoundError:
+            return 0, 0
+        stats = sorted(((entry.stat(), entry.path) for entry in entries), key=lambda item: item[0].st_mtime_ns)
+        excess = sum(st.st_size for st, _ in stats) - self.max_mb * 1e6
+        removed = freed = 0
+        for st, path in stats:
+            if excess <= 0:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                continue
+            excess -= st.st_size
+            removed += 1
+            freed += st.st_size
+        return removed, freed
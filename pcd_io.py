@@ -0,0 +1,307 @@
+import struct
+import numpy as np
+
+try:
+    import lzf  # python-lzf, optional: only used to shrink binary_compressed output
+except ImportError:
+    lzf = None
+
+# numpy dtype kind -> PCD TYPE
+PCD_TYPES = {"f": "F", "i": "I", "u": "U"}
+
+# PCD TYPE -> numpy dtype kind
+NUMPY_KINDS = {"F": "f", "I": "i", "U": "u"}
+
+# Maximum literal run length of an LZF control byte
+LZF_MAX_LITERAL = 32
+
+
+def unpack_rgb(cloud, field="rgb"):
+    """Return the three color bytes of a cloud's packed float32 'rgb' field as Nx3 uint8
+
+    Inverse of pack_rgb. `cloud` may also be the 'rgb' field on its own. The
+    result is a strided view into `cloud` (e.g. the memmap returned by
+    read_pcd), not a copy.
+    """
+    if not len(cloud):
+        return np.empty((0, 3), dtype=np.uint8)
+    cloud = np.ascontiguousarray(cloud)
+    offset = cloud.dtype.fields[field][1] if cloud.dtype.names else 0
+    return np.ndarray((len(cloud), 3), dtype=np.uint8, buffer=cloud,
+                      offset=offset, strides=(cloud.dtype.itemsize, 1))
+
+
+def pack_rgb(colors):
+    """Pack Nx3 uint8 colors into the float32 'rgb' field with a single view
+
+    The three channels are stored as the first three bytes of each packed value,
+    i.e. the same byte layout read_pcd_file returns them in.
+    """
+    colors = np.asarray(colors)
+    rgba = np.zeros((len(colors), 4), dtype=np.uint8)
+    rgba[:, :3] = colors[:, :3]
+    return rgba.view("<u4").ravel().view("<f4")
+
+
+def make_cloud(points, colors=None, extra_fields=None):
+    """Build a PCD structured array from Nx3 xyz, optional Nx3 colors and extra fields
+
+    `extra_fields` maps field name -> array of length N (shape (N,) or (N, count));
+    each keeps its own dtype so fields such as intensity, ring or timestamp
+    survive unchanged.
+    """
+    extra_fields = extra_fields or {}
+    points = np.asarray(points)
+
+    dtype = [("x", "<f4"), ("y", "<f4"), ("z", "<f4")]
+    if colors is not None:
+        dtype.append(("rgb", "<f4"))
+    for name, values in extra_fields.items():
+        values = np.asarray(values)
+        dtype.append((name, values.dtype.newbyteorder("<"), values.shape[1:]))
+
+    data = np.empty(len(points), dtype=dtype)
+    data["x"] = points[:, 0]
+    data["y"] = points[:, 1]
+    data["z"] = points[:, 2]
+    if colors is not None:
+        data["rgb"] = pack_rgb(colors)
+    for name, values in extra_fields.items():
+        data[name] = values
+    return data
+
+
+def _field_layout(dtype):
+    """Return (names, sizes, types, counts) of a structured dtype for the PCD header"""
+    names, sizes, types, counts = [], [], [], []
+    for name in dtype.names:
+        field_dtype = dtype.fields[name][0]
+        base = field_dtype.base
+        if base.kind not in PCD_TYPES:
+            raise ValueError(f"Field '{name}' has unsupported dtype {base}")
+        names.append(name)
+        sizes.append(base.itemsize)
+        types.append(PCD_TYPES[base.kind])
+        counts.append(int(np.prod(field_dtype.shape)) if field_dtype.shape else 1)
+    return names, sizes, types, counts
+
+
+def make_header(dtype, num_points, data="binary", viewpoint=(0, 0, 0, 1, 0, 0, 0)):
+    """Build the ASCII header of a PCD v0.7 file"""
+    names, sizes, types, counts = _field_layout(dtype)
+    lines = [
+        "# .PCD v0.7 - Point Cloud Data file format",
+        "VERSION 0.7",
+        "FIELDS " + " ".join(names),
+        "SIZE " + " ".join(str(s) for s in sizes),
+        "TYPE " + " ".join(types),
+        "COUNT " + " ".join(str(c) for c in counts),
+        f"WIDTH {num_points}",
+        "HEIGHT 1",
+        "VIEWPOINT " + " ".join(str(v) for v in viewpoint),
+        f"POINTS {num_points}",
+        f"DATA {data}",
+    ]
+    return ("\n".join(lines) + "\n").encode("ascii")
+
+
+def lzf_literal(raw):
+    """Encode bytes as a literal-only LZF stream (valid LZF, no compression)
+
+    Used when python-lzf is not installed: every 32-byte run gets a one-byte
+    control prefix, built in one vectorized pass.
+    """
+    raw = np.frombuffer(raw, dtype=np.uint8)
+    full, tail = divmod(len(raw), LZF_MAX_LITERAL)
+
+    chunks = np.empty((full, LZF_MAX_LITERAL + 1), dtype=np.uint8)
+    chunks[:, 0] = LZF_MAX_LITERAL - 1
+    chunks[:, 1:] = raw[:full * LZF_MAX_LITERAL].reshape(full, LZF_MAX_LITERAL)
+
+    out = chunks.tobytes()
+    if tail:
+        out += bytes([tail - 1]) + raw[full * LZF_MAX_LITERAL:].tobytes()
+    return out
+
+
+def compress_columns(cloud):
+    """Return the binary_compressed payload (size prefix + LZF) of a structured array"""
+    # binary_compressed stores the cloud column by column
+    raw = b"".join(np.ascontiguousarray(cloud[name]).tobytes() for name in cloud.dtype.names)
+
+    compressed = lzf.compress(raw) if lzf is not None and raw else None
+    if compressed is None:
+        compressed = lzf_literal(raw)
+    return struct.pack("<II", len(compressed), len(raw)) + compressed
+
+
+def write_pcd(output_path, cloud, data="binary"):
+    """Write a structured array to a PCD file as 'binary' or 'binary_compressed'"""
+    if data == "binary":
+        payload = np.ascontiguousarray(cloud).tobytes()
+    elif data == "binary_compressed":
+        payload = compress_columns(cloud)
+    else:
+        raise ValueError(f"Unsupported PCD data type: {data}")
+
+    with open(output_path, "wb") as f:
+        f.write(make_header(cloud.dtype, len(cloud), data))
+        f.write(payload)
+
+
+def read_pcd_header(pcd_path):
+    """Parse only the header of a PCD file
+
+    Returns a dict with the header entries ('fields', 'size', 'type', 'count',
+    'width', 'height', 'points', 'data'), the numpy record 'dtype' and the
+    byte 'offset' of the payload. The payload itself is not read.
+    """
+    header = {}
+    with open(pcd_path, "rb") as f:
+        while True:
+            line = f.readline()
+            if not line:
+                raise ValueError(f"PCD header of {pcd_path} has no DATA line")
+            line = line.decode("ascii").strip()
+            if not line or line.startswith("#"):
+                continue
+            key, _, value = line.partition(" ")
+            header[key.lower()] = value.split()
+            if key.upper() == "DATA":
+                header["offset"] = f.tell()
+                break
+
+    fields = header["fields"]
+    header["fields"] = tuple(fields)
+    header["size"] = [int(s) for s in header["size"]]
+    header["count"] = [int(c) for c in header.get("count", ["1"] * len(fields))]
+    header["width"] = int(header["width"][0])
+    header["height"] = int(header.get("height", ["1"])[0])
+    header["points"] = int(header.get("points", [header["width"] * header["height"]])[0])
+    header["data"] = header["data"][0].lower()
+
+    dtype = []
+    for name, size, pcd_type, count in zip(fields, header["size"], header["type"], header["count"]):
+        base = np.dtype(f"<{NUMPY_KINDS[pcd_type]}{size}")
+        dtype.append((name, base, (count,)) if count > 1 else (name, base))
+    header["dtype"] = np.dtype(dtype)
+    return header
+
+
+def lzf_decompress_into(src, out):
+    """Decode an LZF stream into the preallocated uint8 buffer `out`; returns bytes written"""
+    out = memoryview(out).cast("B")
+    ip = op = 0
+    end = len(src)
+    while ip < end:
+        ctrl = src[ip]
+        ip += 1
+        if ctrl < LZF_MAX_LITERAL:
+            # Literal run
+            length = ctrl + 1
+            out[op:op + length] = src[ip:ip + length]
+            ip += length
+            op += length
+            continue
+
+        # Back reference
+        length = ctrl >> 5
+        if length == 7:
+            length += src[ip]
+            ip += 1
+        ref = op - ((ctrl & 0x1F) << 8) - src[ip] - 1
+        ip += 1
+        length += 2
+        if ref + length <= op:
+            out[op:op + length] = out[ref:ref + length]
+        else:
+            # Overlapping copy has to repeat byte by byte
+            for i in range(length):
+                out[op + i] = out[ref + i]
+        op += length
+    return op
+
+
+def _read_compressed(pcd_path, header):
+    """Decompress a binary_compressed payload into a structured array"""
+    dtype = header["dtype"]
+    num_points = header["points"]
+
+    with open(pcd_path, "rb") as f:
+        f.seek(header["offset"])
+        compressed_size, uncompressed_size = struct.unpack("<II", f.read(8))
+        compressed = f.read(compressed_size)
+
+    if uncompressed_size != num_points * dtype.itemsize:
+        raise ValueError(f"{pcd_path}: compressed payload holds {uncompressed_size} bytes, "
+                         f"expected {num_points * dtype.itemsize}")
+
+    raw = np.empty(uncompressed_size, dtype=np.uint8)
+    if lzf is not None and compressed_size:
+        raw[:] = np.frombuffer(lzf.decompress(compressed, uncompressed_size), dtype=np.uint8)
+    else:
+        lzf_decompress_into(compressed, raw)
+
+    # Payload is stored column by column
+    cloud = np.empty(num_points, dtype=dtype)
+    start = 0
+    for name in dtype.names:
+        field_dtype = dtype.fields[name][0]
+        end = start + num_points * field_dtype.itemsize
+        cloud[name] = raw[start:end].view(field_dtype.base).reshape((num_points,) + field_dtype.shape)
+        start = end
+    return cloud
+
+
+def _read_ascii(pcd_path, header):
+    """Parse an ascii payload into a structured array (slow path)"""
+    dtype = header["dtype"]
+    with open(pcd_path, "rb") as f:
+        f.seek(header["offset"])
+        values = np.loadtxt(f, dtype=np.float64, ndmin=2, max_rows=header["points"])
+
+    cloud = np.empty(len(values), dtype=dtype)
+    column = 0
+    for name, count in zip(dtype.names, header["count"]):
+        field = values[:, column:column + count]
+        cloud[name] = field[:, 0] if count == 1 else field
+        column += count
+    return cloud
+
+
+def read_pcd(pcd_path, header=None):
+    """Read a PCD file into a structured array
+
+    'binary' payloads are returned as a read-only np.memmap so field access is
+    zero-copy; 'binary_compressed' is decompressed into a preallocated buffer;
+    'ascii' goes through np.loadtxt.
+    """
+    if header is None:
+        header = read_pcd_header(pcd_path)
+
+    if header["data"] == "binary":
+        if header["points"] == 0:
+            return np.empty(0, dtype=header["dtype"])
+        return np.memmap(pcd_path, dtype=header["dtype"], mode="r",
+                         offset=header["offset"], shape=(header["points"],))
+    if header["data"] == "binary_compressed":
+        return _read_compressed(pcd_path, header)
+    if header["data"] == "ascii":
+        return _read_ascii(pcd_path, header)
+    raise ValueError(f"Unsupported PCD data type: {header['data']}")
+
+
+def field_columns(cloud, names):
+    """Return fields `names` of a structured array as an (N, len(names)) array
+
+    When the fields are adjacent and share a dtype (x/y/z in practice) this is a
+    strided view into the cloud; otherwise the columns are stacked.
+    """
+    fields = [cloud.dtype.fields[name] for name in names]
+    base = fields[0][0]
+    adjacent = all(dt == base and offset == fields[0][1] + i * base.itemsize
+                   for i, (dt, offset) in enumerate(fields))
+    if adjacent and len(cloud):
+        return np.ndarray((len(cloud), len(names)), dtype=base, buffer=cloud,
+                          offset=fields[0][1], strides=(cloud.dtype.itemsize, base.itemsize))
+    return np.stack([cloud[name] for name in names], axis=1)
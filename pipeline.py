@@ -0,0 +1,364 @@
+import argparse
+import os
+import sys
+from functools import partial
+
+import merge_lidar
+import split_lidar
+from catalog import Catalog, add_selection_arguments, excluded_messages, frame_query, select_frames
+from extract_intensity import load_intensity, normalize_intensity
+from label_map import add_label_map_arguments, label_map_from_args
+from label_stats import MERGED, LabelHistogram, LabelStats, add_stats_argument, frame_histograms
+from frame_io import add_io_depth_argument, mapped
+from metrics import Monitor, add_metrics_arguments, report_scene, stage
+from manifest import scan_dir
+from merge_lidar import merge_report, merge_sensors
+from parallel import add_workers_argument, frame_result, run_scenes
+from point_codec import add_codec_arguments, codec_from_args, encoded_path, write_labels, write_points
+from point_filter import add_filter_arguments, filter_from_args, removed_report
+from scene_archive import ArchiveWriter, archive_path, list_archives, load_frame, scene_sources, source_paths
+from spatial_index import add_voxel_arguments, compression_report, voxel_downsample
+from split_lidar import split_scan
+
+# Raw scans in, merged frames out; nothing in between touches the disk by default
+INPUT_DIR = split_lidar.base_input_dir
+OUTPUT_DIR = merge_lidar.OUTPUT_DIR
+
+# Remission tag -> sensor the tag's partition belongs to
+SENSORS = {0: "LIDAR0", 1: "LIDAR1"}
+
+# PCD directory holding each sensor's intensity ("{scene}" is filled in per scene).
+# Sensors without an entry keep the remission of the raw scan.
+INTENSITY_PCD_DIRS = {
+    1: "/home/ezarisma/Downloads/Practice/Semantic-KITTI-API-DPAI-main-ver3/pcd_data/{scene}/{scene}/lidar_point_cloud_top_rear_lidar",
+}
+
+# Where the intermediate stages land with --keep-intermediates (the trees the
+# standalone scripts read and write)
+FILTERED_DIRS = split_lidar.PARTITIONS
+INTENSITY_DIRS = {0: merge_lidar.LIDAR0_DIR, 1: merge_lidar.LIDAR1_DIR}
+
+
+def index_pcd_dir(pcd_dir):
+    """Map frame number -> PCD path for every numeric .pcd file of a directory"""
+    index = {}
+    for name in scan_dir(pcd_dir):
+        stem, ext = os.path.splitext(name)
+        if ext == ".pcd" and stem.isdigit():
+            index[int(stem)] = os.path.join(pcd_dir, name)
+    return index
+
+
+def input_catalog(refresh=False):
+    """Catalog of the raw scan and label tree"""
+    return Catalog({"RAW": {"points": INPUT_DIR, "labels": INPUT_DIR}}, refresh=refresh)
+
+
+def scene_tree_sources(scene, catalog):
+    """(messages, {frame: source}) for the labelled frames of a scene in the raw directory tree"""
+    scans = catalog.files("RAW", "points", scene)
+    if not scans:
+        return [f"[WARNING] Velodyne directory not found or empty: {os.path.join(INPUT_DIR, scene, 'velodyne')}"], {}
+    labels = catalog.files("RAW", "labels", scene)
+    return [], {frame: ("files", scan.path, labels[frame].path) for frame, scan in scans.items() if frame in labels}
+
+
+def plan_scene(scene, query, catalog=None, keep_intermediates=False, input_archive=None, to_archive=False):
+    """Return (messages, items) for one scene: one work item per selected frame to build
+
+    Frames come from the catalog of the raw tree, or from the scene archive
+    with `input_archive`; `query` holds the select_frames arguments.
+    """
+    if input_archive is not None:
+        messages, sources = scene_sources(input_archive, scene)
+    else:
+        messages, sources = scene_tree_sources(scene, catalog)
+    if not sources:
+        return messages, []
+
+    pcd_indexes = {tag: index_pcd_dir(pcd_dir.format(scene=scene))
+                   for tag, pcd_dir in INTENSITY_PCD_DIRS.items()}
+
+    frames, missing, excluded = select_frames(list(sources), **query)
+    messages += [f"[WARNING] Missing scan or label file for frame {frame}" for frame in missing]
+    messages += excluded_messages(excluded)
+    items = []
+    for frame in frames:
+        problems = catalog.check(scene, frame) if catalog is not None else []
+        if problems:
+            messages.append(f"[WARNING] Skipping frame {frame}: {'; '.join(problems)}")
+            continue
+        pcd_paths = {tag: index.get(int(frame)) for tag, index in pcd_indexes.items()}
+        items.append((scene, frame, sources[frame], pcd_paths, keep_intermediates, to_archive))
+    return messages, items
+
+
+def write_frame(base_dir, scene, frame, points, labels=None, codec=None):
+    """Write one frame's points (and labels) into a SemanticKITTI-style tree, quantized with a `codec`"""
+    velodyne_dir = os.path.join(base_dir, scene, "velodyne")
+    os.makedirs(velodyne_dir, exist_ok=True)
+    write_points(points, encoded_path(os.path.join(velodyne_dir, f"{frame}.bin"), codec), codec)
+    if labels is not None:
+        label_dir = os.path.join(base_dir, scene, "labels")
+        os.makedirs(label_dir, exist_ok=True)
+        write_labels(labels, encoded_path(os.path.join(label_dir, f"{frame}.label"), codec), codec)
+
+
+def frame_inputs(item):
+    """Files the pipeline reads for one item: the raw scan and labels, and the sensors' (mapped) PCDs"""
+    _, _, source, pcd_paths, _, _ = item
+    return source_paths(source) + [mapped(path) for path in pcd_paths.values() if path is not None]
+
+
+def read_stage(items):
+    """Load the raw scan and labels of every frame"""
+    for item in items:
+        scene, frame, source = item[:3]
+        with stage("read"):
+            points, labels = load_frame(source)
+        if len(points) != len(labels):
+            raise ValueError(f"Size mismatch in {scene}/{frame}: {len(labels)} labels vs {len(points)} points")
+        yield {"item": item, "points": points, "labels": labels, "lines": []}
+
+
+def split_stage(frames, point_filter=None, verbose=False, label_map=None):
+    """Split every scan by sensor, mark the points rejected by `point_filter` and remap labels with `label_map`
+
+    The filter sees the raw points and labels. Only the labels are dropped
+    here: the points keep their count until intensity_stage has injected the
+    PCD intensity, matched point for point, and are filtered there with the
+    masks left in frame["keep"].
+    """
+    for frame in frames:
+        scene, frame_id, _, _, keep_intermediates, _ = frame["item"]
+        frame["points_in"] = len(frame["points"])
+        frame["removed"] = {}
+        frame["keep"] = {}
+        with stage("split"):
+            frame["sensors"] = split_scan(frame.pop("points"), frame.pop("labels"), list(SENSORS))
+        if point_filter is not None:
+            with stage("filter"):
+                frame["removed"] = dict.fromkeys(point_filter.expressions, 0)
+                for tag, (points, labels) in frame["sensors"].items():
+                    keep, removed = point_filter.mask(points, labels)
+                    if any(removed.values()):
+                        frame["keep"][tag] = keep
+                        frame["sensors"][tag] = (points, labels[keep])
+                    for expression, count in removed.items():
+                        frame["removed"][expression] += count
+            if verbose:
+                frame["lines"].append(f"        Filtered out: {removed_report(frame['removed'])}")
+        if label_map is not None:
+            with stage("remap"):
+                # Compacted instance ids are numbered over the whole frame, not per sensor
+                instance_ids = (label_map.instance_ids(labels for _, labels in frame["sensors"].values())
+                                if label_map.instances == "compact" else None)
+                frame["sensors"] = {tag: (points, label_map.apply(labels, instance_ids))
+                                    for tag, (points, labels) in frame["sensors"].items()}
+
+        if keep_intermediates:
+            with stage("write"):
+                for tag, (points, labels) in frame["sensors"].items():
+                    if tag in frame["keep"]:
+                        points = points[frame["keep"][tag]]
+                    write_frame(FILTERED_DIRS[tag], scene, frame_id, points, labels)
+        yield frame
+
+
+def intensity_stage(frames, verbose=False):
+    """Replace each sensor's remission with the normalized intensity of its PCD, then drop the filtered points
+
+    The intensity range report is only computed when `verbose`.
+    """
+    for frame in frames:
+        scene, frame_id, _, pcd_paths, keep_intermediates, _ = frame["item"]
+        with stage("intensity"):
+            for tag, pcd_path in pcd_paths.items():
+                points, labels = frame["sensors"][tag]
+                if not len(points):
+                    continue
+                if pcd_path is None:
+                    raise FileNotFoundError(f"No {SENSORS[tag]} PCD for frame {frame_id}")
+
+                intensity = normalize_intensity(load_intensity(pcd_path), frame["lines"] if verbose else None)
+                if len(intensity) != len(points):
+                    raise ValueError(f"{SENSORS[tag]} point counts do not match! BIN: {len(points)}, PCD: {len(intensity)}")
+                if keep_intermediates and tag not in frame["keep"]:
+                    # split_stage queued these points for writing behind; they must stay untouched
+                    points = points.copy()
+                    frame["sensors"][tag] = (points, labels)
+                points[:, 3] = intensity
+        keeps = frame.pop("keep")
+        if keeps:
+            with stage("filter"):
+                for tag, keep in keeps.items():
+                    points, labels = frame["sensors"][tag]
+                    frame["sensors"][tag] = (points[keep], labels)
+
+        if keep_intermediates:
+            with stage("write"):
+                for tag, (points, _) in frame["sensors"].items():
+                    write_frame(INTENSITY_DIRS[tag], scene, frame_id, points)
+        yield frame
+
+
+def merge_stage(frames, voxel_size=None, voxel_mode="centroid", verbose=False, stats=False):
+    """Concatenate the sensors of every frame (LIDAR0 always, the others when they have points)
+
+    With `voxel_size` every merged frame is reduced to one point per voxel.
+    Label histograms are computed only for `stats`, the frame report only when
+    `verbose`.
+    """
+    for frame in frames:
+        sensors = [(SENSORS[tag], points, labels)
+                   for i, (tag, (points, labels)) in enumerate(frame.pop("sensors").items())
+                   if i == 0 or len(points)]
+        with stage("merge"):
+            frame["points"], frame["labels"] = merge_sensors(sensors)
+            before = len(frame["points"])
+            if voxel_size:
+                frame["points"], frame["labels"] = voxel_downsample(frame["points"], frame["labels"],
+                                                                    voxel_size, voxel_mode)
+
+        frame["histograms"] = None
+        if verbose or stats:
+            with stage("report"):
+                frame["histograms"] = frame_histograms(sensors)
+                if voxel_size:
+                    frame["histograms"][MERGED] = LabelHistogram.from_labels(frame["labels"])
+                if verbose:
+                    frame["lines"] = merge_report(f"Processing frame {frame['item'][1]}: ", sensors,
+                                                  frame["points"], frame["histograms"]) + frame["lines"]
+                    if voxel_size:
+                        frame["lines"].append(compression_report(voxel_size, voxel_mode, before, len(frame["points"])))
+        yield frame
+
+
+def write_stage(frames, codec=None):
+    """Write the merged outputs (quantized with a `codec`) and turn every frame into its result"""
+    for frame in frames:
+        scene, frame_id = frame["item"][:2]
+        counts = {"points": len(frame["points"]), "histograms": frame["histograms"], "removed": frame["removed"],
+                  "points_in": frame["points_in"], "points_out": len(frame["points"])}
+        if frame["item"][-1]:
+            # Archive output: the parent appends the frame to the scene archive
+            yield frame_result("ok", *frame["lines"], **counts,
+                               merged_points=frame["points"], merged_labels=frame["labels"])
+            continue
+        with stage("write"):
+            write_frame(OUTPUT_DIR, scene, frame_id, frame["points"], frame["labels"], codec)
+        yield frame_result("ok", *frame["lines"], **counts)
+
+
+def run_pipeline(items, voxel_size=None, voxel_mode="centroid", verbose=False, stats=False, codec=None,
+                 point_filter=None, label_map=None):
+    """Chain all stages over the given frames; only one frame is in memory at a time"""
+    frames = intensity_stage(split_stage(read_stage(items), point_filter, verbose, label_map), verbose)
+    return write_stage(merge_stage(frames, voxel_size, voxel_mode, verbose, stats), codec)
+
+
+def process_frame(item, voxel_size=None, voxel_mode="centroid", verbose=False, stats=False, codec=None,
+                  point_filter=None, label_map=None):
+    """Run the whole pipeline for one frame"""
+    try:
+        return next(run_pipeline([item], voxel_size, voxel_mode, verbose, stats, codec, point_filter, label_map))
+    except Exception as e:
+        return frame_result("error", f"Processing frame {item[1]}: Error: {e}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Filter, inject intensity and merge frames in memory")
+    add_workers_argument(parser)
+    add_io_depth_argument(parser)
+    parser.add_argument("--keep-intermediates", action="store_true",
+                        help="Also write the filtered and intensity-injected trees")
+    add_stats_argument(parser)
+    add_voxel_arguments(parser)
+    add_metrics_arguments(parser)
+    add_selection_arguments(parser, *merge_lidar.FRAME_RANGE, merge_lidar.FRAME_STRIDE)
+    parser.add_argument("--input-archive", metavar="DIR",
+                        help="Read raw scans from <DIR>/<scene>.pack archives instead of the directory tree")
+    parser.add_argument("--output-archive", metavar="DIR",
+                        help="Write merged scenes to <DIR>/<scene>.pack archives instead of the directory tree")
+    add_codec_arguments(parser)
+    add_filter_arguments(parser)
+    add_label_map_arguments(parser)
+    args = parser.parse_args(argv)
+    try:
+        codec = codec_from_args(args)
+    except ValueError as e:
+        parser.error(str(e))
+    try:
+        point_filter = filter_from_args(args)
+    except (OSError, ValueError) as e:
+        parser.error(f"Bad filter: {e}")
+    try:
+        label_map = label_map_from_args(args)
+    except (OSError, ImportError, ValueError) as e:
+        parser.error(f"Bad label map: {e}")
+    if codec is not None and args.output_archive:
+        parser.error("--codec quantized writes the directory tree; it cannot be combined with --output-archive")
+
+    print("FILTER -> INTENSITY -> MERGE PIPELINE")
+    print("=" * 80)
+
+    catalog = input_catalog(args.refresh_catalog) if args.input_archive is None else None
+    query = frame_query(args)
+    messages = {}
+    plans = []
+    for scene in (args.scenes or merge_lidar.scenes
+                  or (catalog.scenes() if catalog is not None else list_archives(args.input_archive))):
+        messages[scene], items = plan_scene(scene, query, catalog, args.keep_intermediates,
+                                            args.input_archive, args.output_archive is not None)
+        plans.append((scene, items))
+
+    writers = {}
+    stats = LabelStats()
+
+    def collect(item, result):
+        if result["status"] != "ok":
+            return
+        histograms = result.pop("histograms")
+        if histograms is not None:
+            stats.add(item[0], histograms)
+        # Stream archive output into the scene's archive and drop the arrays
+        if "merged_points" in result:
+            scene, frame = item[:2]
+            if scene not in writers:
+                os.makedirs(args.output_archive, exist_ok=True)
+                writers[scene] = ArchiveWriter(archive_path(args.output_archive, scene))
+            writers[scene].add(frame, result.pop("merged_points"), result.pop("merged_labels"))
+
+    errors = 0
+    monitor = Monitor.from_args("pipeline", args)
+    process = partial(process_frame, voxel_size=args.voxel_size, voxel_mode=args.voxel_mode,
+                      verbose=args.verbose, stats=bool(args.stats), codec=codec, point_filter=point_filter,
+                      label_map=label_map)
+    # Archive results carry the merged arrays: a worker holds a whole chunk of them until it is done
+    max_chunk = max(args.io_depth, 1) if args.output_archive else None
+    for scene, results in run_scenes(process, plans, args.workers, on_result=collect, prefetch=frame_inputs,
+                                     io_depth=args.io_depth, monitor=monitor, max_chunk=max_chunk):
+        if scene in writers:
+            writers.pop(scene).close()
+        report_scene(scene, messages[scene], results, args.verbose)
+        errors += sum(result["status"] == "error" for result in results)
+        if point_filter is not None:
+            # Points each filter expression removed, summed over the scene
+            removed = dict.fromkeys(point_filter.expressions, 0)
+            for result in results:
+                for expression, count in result.get("removed", {}).items():
+                    removed[expression] += count
+            print(f"Points filtered out: {removed_report(removed)}")
+    monitor.close()
+
+    if args.stats:
+        stats.write(args.stats)
+        print(f"\nLabel statistics written to {args.stats}")
+
+    if errors:
+        print(f"\n{errors} frames failed (see errors above); their outputs were not written")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
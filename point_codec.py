@@ -0,0 +1,365 @@
+import argparse
+import lzma
+import os
+import zlib
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+
+from frame_io import fromfile, write_array
+from manifest import atomic_tofile, scan_dir
+
+# Encoded counterparts of the raw frame files
+ENCODED_EXTS = {".bin": ".qbin", ".label": ".qlabel"}
+RAW_EXTS = {encoded: raw for raw, encoded in ENCODED_EXTS.items()}
+
+MAGIC = b"LDRQUANT"
+VERSION = 1
+
+KIND_POINTS = 0
+KIND_LABELS = 1
+
+# zlib level 4 compresses delta-coded chunks within 2% of level 6 at less
+# than half the cost; lzma is the choice when size matters more than speed
+ZLIB_LEVEL = 4
+LZMA_PRESET = 6
+
+# Compression name -> (id, compress, decompress); chunks are compressed independently
+COMPRESSORS = {
+    "zlib": (1, lambda data: zlib.compress(data, ZLIB_LEVEL), zlib.decompress),
+    "lzma": (2, lambda data: lzma.compress(data, preset=LZMA_PRESET), lzma.decompress),
+}
+COMPRESSION_IDS = {code: name for name, (code, _, _) in COMPRESSORS.items()}
+
+# File layout: header, compressed size of every chunk, the chunks back to back.
+# A point is origin + q * precision per axis and remission_offset + q *
+# remission_scale; every column is stored delta-coded and byte-shuffled.
+HEADER_DTYPE = np.dtype([
+    ("magic", "S8"),
+    ("version", "<u4"),
+    ("kind", "u1"),
+    ("compression", "u1"),
+    ("coord_bytes", "u1"),
+    ("remission_bytes", "u1"),
+    ("count", "<u8"),
+    ("chunk_points", "<u4"),
+    ("num_chunks", "<u4"),
+    ("precision", "<f8"),
+    ("origin", "<f8", (3,)),
+    ("remission_offset", "<f8"),
+    ("remission_scale", "<f8"),
+])
+CHUNK_DTYPE = np.dtype("<u8")
+
+COORD_DTYPES = {2: np.dtype("<i2"), 4: np.dtype("<i4")}
+REMISSION_DTYPES = {1: np.dtype("<u1"), 2: np.dtype("<u2")}
+LABEL_DTYPE = np.dtype("<u4")
+
+# Output settings of the quantized codec
+Codec = namedtuple("Codec", "precision remission_bits compression chunk_points")
+
+# Threads decoding the chunks of one file by default: a few, as frames are often
+# spread over worker processes too
+DECODE_THREADS = min(4, os.cpu_count() or 1)
+
+
+def add_codec_arguments(parser):
+    """Add the shared output codec options to a script's argument parser"""
+    parser.add_argument("--codec", choices=("raw", "quantized"), default="raw",
+                        help="Output encoding: raw float32/uint32 .bin/.label, or quantized, "
+                             "chunk-compressed .qbin/.qlabel (default: raw)")
+    parser.add_argument("--precision", type=float, default=0.001,
+                        help="Quantized xyz step in meters (default: 0.001)")
+    parser.add_argument("--remission-bits", type=int, choices=(8, 16), default=16,
+                        help="Quantized remission width; integer remissions that fit are kept exact (default: 16)")
+    parser.add_argument("--compression", choices=list(COMPRESSORS), default="zlib",
+                        help="Chunk compression of the quantized codec (default: zlib)")
+    parser.add_argument("--chunk-points", type=int, default=65536,
+                        help="Points per independently compressed chunk (default: 65536)")
+
+
+def codec_from_args(args):
+    """Codec of parsed codec options, or None for raw output"""
+    if args.codec == "raw":
+        return None
+    if args.precision <= 0 or args.chunk_points <= 0:
+        raise ValueError("--precision and --chunk-points must be positive")
+    return Codec(args.precision, args.remission_bits, args.compression, args.chunk_points)
+
+
+def encoded_name(path):
+    """The .qbin/.qlabel counterpart of a .bin/.label path"""
+    stem, ext = os.path.splitext(path)
+    return stem + ENCODED_EXTS[ext]
+
+
+def encoded_path(path, codec):
+    """Where a .bin/.label output goes with this codec"""
+    return path if codec is None else encoded_name(path)
+
+
+def _delta(q):
+    """Differences of consecutive values, wrapping around in q's dtype (cumsum undoes it)"""
+    delta = np.empty_like(q)
+    if len(q):
+        delta[0] = q[0]
+        np.subtract(q[1:], q[:-1], out=delta[1:])
+    return delta
+
+
+def _shuffle(values):
+    """Bytes of an integer array grouped by byte position, which compresses better"""
+    return values.view(np.uint8).reshape(-1, values.dtype.itemsize).T.tobytes()
+
+
+def _unshuffle(data, dtype, count):
+    return np.frombuffer(data, dtype=np.uint8).reshape(dtype.itemsize, count).T.copy().view(dtype).ravel()
+
+
+def _header(kind, codec, count, num_chunks, **fields):
+    header = np.zeros(1, dtype=HEADER_DTYPE)
+    header["magic"] = MAGIC
+    header["version"] = VERSION
+    header["kind"] = kind
+    header["compression"] = COMPRESSORS[codec.compression][0]
+    header["count"] = count
+    header["chunk_points"] = codec.chunk_points
+    header["num_chunks"] = num_chunks
+    for name, value in fields.items():
+        header[name] = value
+    return header
+
+
+def _pack(header, chunks, compress):
+    """Header, chunk table and compressed chunks as one uint8 array"""
+    chunks = [compress(chunk) for chunk in chunks]
+    table = np.array([len(chunk) for chunk in chunks], dtype=CHUNK_DTYPE)
+    return np.frombuffer(b"".join([header.tobytes(), table.tobytes(), *chunks]), dtype=np.uint8)
+
+
+def _chunk_bounds(count, chunk_points):
+    return [(start, min(start + chunk_points, count)) for start in range(0, count, chunk_points)]
+
+
+def encode_points(points, codec):
+    """Nx4 [x, y, z, remission] points in the quantized format, as a uint8 array
+
+    Coordinates are stored relative to the center of the frame's bounding box,
+    as int16 when the frame fits, else int32. Remissions that are all
+    integers within the chosen width (e.g. sensor tags) are stored exactly.
+    """
+    points = np.asarray(points)
+    if not np.isfinite(points).all():
+        raise ValueError("Cannot quantize non-finite points")
+    xyz = points[:, :3]
+    remission = points[:, 3]
+
+    # Coordinates: int16 if the half extent fits at this precision, else int32
+    low = xyz.min(axis=0).astype(np.float64) if len(points) else np.zeros(3)
+    high = xyz.max(axis=0).astype(np.float64) if len(points) else np.zeros(3)
+    origin = (low + high) / 2
+    half_steps = ((high - low) / 2 / codec.precision).max() + 1
+    if half_steps > np.iinfo(np.int32).max:
+        raise ValueError(f"Frame extent too large for a {codec.precision} m precision")
+    coord_bytes = 2 if half_steps <= np.iinfo(np.int16).max else 4
+    coord_dtype = COORD_DTYPES[coord_bytes]
+
+    # Remission: exact if integral and in range, else linear over the frame's range
+    remission_bytes = codec.remission_bits // 8
+    remission_dtype = REMISSION_DTYPES[remission_bytes]
+    top = np.iinfo(remission_dtype).max
+    r_low = float(remission.min()) if len(points) else 0.0
+    r_high = float(remission.max()) if len(points) else 0.0
+    if r_low >= 0 and r_high <= top and np.array_equal(remission, np.rint(remission)):
+        r_offset, r_scale = 0.0, 1.0
+    else:
+        r_offset, r_scale = r_low, (r_high - r_low) / top or 1.0
+
+    chunks = []
+    for start, end in _chunk_bounds(len(points), codec.chunk_points):
+        columns = [np.rint((xyz[start:end, axis] - origin[axis]) / codec.precision).astype(coord_dtype)
+                   for axis in range(3)]
+        columns.append(np.rint((remission[start:end] - r_offset) / r_scale).astype(remission_dtype))
+        chunks.append(b"".join(_shuffle(_delta(column)) for column in columns))
+
+    header = _header(KIND_POINTS, codec, len(points), len(chunks), coord_bytes=coord_bytes,
+                     remission_bytes=remission_bytes, precision=codec.precision, origin=origin,
+                     remission_offset=r_offset, remission_scale=r_scale)
+    return _pack(header, chunks, COMPRESSORS[codec.compression][1])
+
+
+def encode_labels(labels, codec):
+    """uint32 labels in the quantized format (run-length coded, run values delta-coded), as a uint8 array"""
+    labels = np.asarray(labels, dtype=LABEL_DTYPE)
+    chunks = []
+    for start, end in _chunk_bounds(len(labels), codec.chunk_points):
+        chunk = labels[start:end]
+        starts = np.concatenate(([0], np.flatnonzero(chunk[1:] != chunk[:-1]) + 1))
+        lengths = np.diff(np.append(starts, len(chunk))).astype(LABEL_DTYPE)
+        runs = np.array([len(starts)], dtype=LABEL_DTYPE)
+        chunks.append(runs.tobytes() + lengths.tobytes() + _shuffle(_delta(chunk[starts])))
+
+    header = _header(KIND_LABELS, codec, len(labels), len(chunks))
+    return _pack(header, chunks, COMPRESSORS[codec.compression][1])
+
+
+def _decode_points_chunk(out, data, header):
+    count = len(out)
+    coord_dtype = COORD_DTYPES[int(header["coord_bytes"])]
+    remission_dtype = REMISSION_DTYPES[int(header["remission_bytes"])]
+    offset = 0
+    for column, dtype in enumerate((coord_dtype,) * 3 + (remission_dtype,)):
+        size = count * dtype.itemsize
+        q = np.cumsum(_unshuffle(data[offset:offset + size], dtype, count), dtype=dtype)
+        offset += size
+        if column < 3:
+            out[:, column] = q * header["precision"] + header["origin"][column]
+        else:
+            out[:, column] = q * header["remission_scale"] + header["remission_offset"]
+
+
+def _decode_labels_chunk(out, data, header):
+    runs = int(np.frombuffer(data, dtype=LABEL_DTYPE, count=1)[0])
+    lengths = np.frombuffer(data, dtype=LABEL_DTYPE, count=runs, offset=LABEL_DTYPE.itemsize)
+    values = np.cumsum(_unshuffle(data[(1 + runs) * LABEL_DTYPE.itemsize:], LABEL_DTYPE, runs), dtype=LABEL_DTYPE)
+    out[:] = np.repeat(values, lengths)
+
+
+def decode(buffer, threads=None):
+    """Nx4 float32 points or N uint32 labels from an encoded file's bytes
+
+    Chunks are independent, so with `threads` > 1 they are decompressed and
+    decoded concurrently (zlib, lzma and numpy release the GIL), each straight
+    into its slice of the output.
+    """
+    data = np.frombuffer(buffer, dtype=np.uint8)
+    header = np.frombuffer(data, dtype=HEADER_DTYPE, count=1)[0] if len(data) >= HEADER_DTYPE.itemsize else None
+    if header is None or header["magic"] != MAGIC:
+        raise ValueError("Not a quantized point file")
+    if header["version"] != VERSION:
+        raise ValueError(f"Unsupported quantized point file version {header['version']}")
+
+    count = int(header["count"])
+    num_chunks = int(header["num_chunks"])
+    sizes = np.frombuffer(data, dtype=CHUNK_DTYPE, count=num_chunks, offset=HEADER_DTYPE.itemsize)
+    starts = HEADER_DTYPE.itemsize + sizes.nbytes + np.concatenate(([0], np.cumsum(sizes))).astype(np.int64)
+    decompress = COMPRESSORS[COMPRESSION_IDS[int(header["compression"])]][2]
+
+    if header["kind"] == KIND_POINTS:
+        out = np.empty((count, 4), dtype=np.float32)
+        decode_chunk = _decode_points_chunk
+    else:
+        out = np.empty(count, dtype=np.uint32)
+        decode_chunk = _decode_labels_chunk
+
+    bounds = _chunk_bounds(count, int(header["chunk_points"]))
+
+    def run(i):
+        start, end = bounds[i]
+        decode_chunk(out[start:end], decompress(data[starts[i]:starts[i + 1]]), header)
+
+    threads = threads or DECODE_THREADS
+    if threads > 1 and num_chunks > 1:
+        with ThreadPoolExecutor(max_workers=threads) as pool:
+            list(pool.map(run, range(num_chunks)))
+    else:
+        for i in range(num_chunks):
+            run(i)
+    return out
+
+
+def decode_threads(workers=1):
+    """Decode threads per process when `workers` processes decode at once, without oversubscribing the CPUs"""
+    return max(1, min(DECODE_THREADS, (os.cpu_count() or 1) // max(workers, 1)))
+
+
+def is_encoded(path):
+    return os.path.splitext(path)[1] in RAW_EXTS
+
+
+def load_points(path, threads=None):
+    """Nx4 float32 points of a .bin or .qbin file"""
+    if is_encoded(path):
+        return decode(fromfile(path, np.uint8), threads)
+    return fromfile(path, np.float32).reshape(-1, 4)
+
+
+def load_labels(path, threads=None):
+    """uint32 labels of a .label or .qlabel file"""
+    if is_encoded(path):
+        return decode(fromfile(path, np.uint8), threads)
+    return fromfile(path, np.uint32)
+
+
+def write_points(points, path, codec=None):
+    """Write points to `path` (from encoded_path) raw or encoded, through the write-behind queue"""
+    write_array(points if codec is None else encode_points(points, codec), path)
+
+
+def write_labels(labels, path, codec=None):
+    """Write labels to `path` (from encoded_path) raw or encoded, through the write-behind queue"""
+    write_array(labels if codec is None else encode_labels(labels, codec), path)
+
+
+def convert_scene(scene_dir, output_dir, codec, threads=None):
+    """Re-encode every frame file of <scene_dir>/{velodyne,labels} into output_dir; returns (files, bytes in, bytes out)
+
+    With a codec the raw files are encoded, without one the encoded files are
+    decoded back to raw .bin/.label.
+    """
+    files = size_in = size_out = 0
+    for subdir in ("velodyne", "labels"):
+        input_dir = os.path.join(scene_dir, subdir)
+        out_dir = os.path.join(output_dir, subdir)
+        for name, st in sorted(scan_dir(input_dir).items()):
+            stem, ext = os.path.splitext(name)
+            path = os.path.join(input_dir, name)
+            if codec is not None and ext == ".bin":
+                array = encode_points(load_points(path), codec)
+            elif codec is not None and ext == ".label":
+                array = encode_labels(load_labels(path), codec)
+            elif codec is None and ext in RAW_EXTS:
+                array = decode(np.fromfile(path, dtype=np.uint8), threads)
+            else:
+                continue
+            output_path = os.path.join(out_dir, stem + (RAW_EXTS[ext] if codec is None else ENCODED_EXTS[ext]))
+            os.makedirs(out_dir, exist_ok=True)
+            atomic_tofile(array, output_path)
+            files += 1
+            size_in += st.st_size
+            size_out += array.nbytes
+    return files, size_in, size_out
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Convert scene trees between raw and quantized frame files")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    encode = subparsers.add_parser("encode", help="<root>/<scene>/{velodyne,labels} .bin/.label -> .qbin/.qlabel")
+    encode.add_argument("root")
+    encode.add_argument("output_root")
+    encode.add_argument("--scenes", nargs="+", help="Scenes to convert (default: all)")
+    add_codec_arguments(encode)
+    encode.set_defaults(codec="quantized")
+
+    decode_parser = subparsers.add_parser("decode", help="<root>/<scene>/{velodyne,labels} .qbin/.qlabel -> .bin/.label")
+    decode_parser.add_argument("root")
+    decode_parser.add_argument("output_root")
+    decode_parser.add_argument("--scenes", nargs="+", help="Scenes to convert (default: all)")
+    decode_parser.add_argument("--threads", type=int, default=os.cpu_count(),
+                               help="Threads decoding the chunks of each file (default: all cores)")
+
+    args = parser.parse_args(argv)
+    codec = codec_from_args(args) if args.command == "encode" else None
+    threads = getattr(args, "threads", None)
+
+    scenes = args.scenes or sorted(name for name in os.listdir(args.root)
+                                   if os.path.isdir(os.path.join(args.root, name)))
+    for scene in scenes:
+        files, size_in, size_out = convert_scene(os.path.join(args.root, scene),
+                                                 os.path.join(args.output_root, scene), codec, threads)
+        print(f"[OK] Scene {scene}: {args.command}d {files} files, {size_in / 1e6:.1f} MB -> {size_out / 1e6:.1f} MB")
+
+
+if __name__ == "__main__":
+    main()
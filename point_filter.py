@@ -0,0 +1,185 @@
+import json
+import re
+import numpy as np
+
+# Points evaluated per step: a 16 KB mask and a 256 KB slice of points stay in cache
+CHUNK_POINTS = 16384
+
+# Columns of an Nx4 frame that comparisons can name
+COLUMNS = {"x": 0, "y": 1, "z": 2, "remission": 3}
+
+COMPARISONS = {"<": np.less, "<=": np.less_equal, ">": np.greater, ">=": np.greater_equal,
+               "==": np.equal, "!=": np.not_equal}
+
+# Lower 16 bits of a SemanticKITTI label: its semantic class
+SEMANTIC_MASK = 0xFFFF
+
+_NUMBER = r"[-+]?(?:\d+\.?\d*|\.\d+)(?:[eE][-+]?\d+)?"
+_COMPARISON = re.compile(rf"^\s*(x|y|z|remission|range)\s*(<=|>=|==|!=|<|>)\s*({_NUMBER})\s*$")
+_BOX = re.compile(rf"^\s*(!?)box\s*=\s*({_NUMBER}(?:\s*,\s*{_NUMBER}){{5}})\s*$")
+_LABELS = re.compile(r"^\s*label\s+(not\s+)?in\s+(\d+(?:\s*,\s*\d+)*)\s*$")
+
+
+def add_filter_arguments(parser):
+    """Add the shared point filter options to a script's argument parser"""
+    parser.add_argument("--filter", nargs="+", default=[], metavar="EXPR",
+                        help="Keep only points matching every expression: 'x|y|z|remission|range OP VALUE' "
+                             "(OP one of < <= > >= == !=), 'box=XMIN,YMIN,ZMIN,XMAX,YMAX,ZMAX' (keep inside), "
+                             "'!box=...' (drop inside, e.g. the ego vehicle), 'label in C1,C2,...' or "
+                             "'label not in C1,C2,...' (semantic classes)")
+    parser.add_argument("--filter-file", metavar="FILE",
+                        help="JSON list of filter expressions, applied before any --filter")
+
+
+def filter_from_args(args):
+    """PointFilter of parsed filter options, or None if there is nothing to filter"""
+    expressions = []
+    if args.filter_file:
+        with open(args.filter_file) as f:
+            expressions = json.load(f)
+        if not isinstance(expressions, list):
+            raise ValueError(f"{args.filter_file} must hold a JSON list of filter expressions")
+    expressions += args.filter
+    return PointFilter(expressions) if expressions else None
+
+
+def _comparison(column, compare, value):
+    def evaluate(points, labels, out, scratch):
+        compare(points[:, column], value, out=out)
+    return evaluate
+
+
+def _range(compare, value):
+    # Compare squared ranges: no square root per point
+    squared = np.float32(value) ** 2 * (1 if value >= 0 else -1)
+
+    def evaluate(points, labels, out, scratch):
+        work = scratch["float"][:len(points)]
+        term = scratch["float2"][:len(points)]
+        np.multiply(points[:, 0], points[:, 0], out=work)
+        for column in (1, 2):
+            np.multiply(points[:, column], points[:, column], out=term)
+            work += term
+        compare(work, squared, out=out)
+    return evaluate
+
+
+def _box(low, high, inside):
+    def evaluate(points, labels, out, scratch):
+        work = scratch["bool"][:len(points)]
+        out[:] = True
+        for column in range(3):
+            np.greater_equal(points[:, column], low[column], out=work)
+            out &= work
+            np.less_equal(points[:, column], high[column], out=work)
+            out &= work
+        if not inside:
+            np.logical_not(out, out=out)
+    return evaluate
+
+
+def _labels(classes, keep):
+    # One lookup per point instead of one comparison per listed class
+    table = np.full(SEMANTIC_MASK + 1, not keep, dtype=bool)
+    table[classes] = keep
+
+    def evaluate(points, labels, out, scratch):
+        if labels is None:
+            raise ValueError("Label filters need the frame's labels")
+        work = scratch["uint"][:len(labels)]
+        np.bitwise_and(labels, SEMANTIC_MASK, out=work)
+        np.take(table, work, out=out, mode="clip")
+    return evaluate
+
+
+def compile_expression(expression):
+    """The evaluate(points, labels, out, scratch) function of one filter expression
+
+    `out` receives the keep mask of the given chunk; `scratch` holds chunk-sized
+    work buffers, so evaluating allocates nothing per point.
+    """
+    match = _COMPARISON.match(expression)
+    if match:
+        field, op, value = match.groups()
+        if field == "range":
+            return _range(COMPARISONS[op], float(value))
+        return _comparison(COLUMNS[field], COMPARISONS[op], np.float32(value))
+
+    match = _BOX.match(expression)
+    if match:
+        bounds = np.array([float(v) for v in match.group(2).split(",")], dtype=np.float32)
+        if (bounds[:3] > bounds[3:]).any():
+            raise ValueError(f"Filter box has a minimum above its maximum: {expression}")
+        return _box(bounds[:3], bounds[3:], inside=not match.group(1))
+
+    match = _LABELS.match(expression)
+    if match:
+        classes = [int(c) for c in match.group(2).split(",")]
+        if max(classes) > SEMANTIC_MASK:
+            raise ValueError(f"Semantic classes are 16-bit: {expression}")
+        return _labels(classes, keep=not match.group(1))
+
+    raise ValueError(f"Cannot parse filter expression: {expression!r}")
+
+
+class PointFilter:
+    """A list of filter expressions compiled into one pass over a frame
+
+    The frame is walked in CHUNK_POINTS chunks; every predicate writes its
+    keep mask for the chunk into a reused buffer and is folded into the
+    frame's single mask, so no full-size temporary is made per predicate.
+    Points and labels are then indexed with that one mask. Each point
+    removed is counted against the first predicate that rejected it.
+    """
+
+    def __init__(self, expressions):
+        self.expressions = [expression.strip() for expression in expressions]
+        self.predicates = [compile_expression(expression) for expression in self.expressions]
+        self.needs_labels = any(_LABELS.match(expression) for expression in self.expressions)
+
+    def __repr__(self):
+        return f"PointFilter({self.expressions})"
+
+    def __getstate__(self):
+        # Compiled predicates are closures; workers recompile from the expressions
+        return {"expressions": self.expressions}
+
+    def __setstate__(self, state):
+        self.__init__(state["expressions"])
+
+    def mask(self, points, labels=None):
+        """(keep mask, {expression: points it removed}) of a frame"""
+        count = len(points)
+        keep = np.ones(count, dtype=bool)
+        removed = dict.fromkeys(self.expressions, 0)
+        size = min(CHUNK_POINTS, count)
+        scratch = {"float": np.empty(size, dtype=np.float32), "float2": np.empty(size, dtype=np.float32),
+                   "uint": np.empty(size, dtype=np.uint32), "bool": np.empty(size, dtype=bool)}
+        result = np.empty(size, dtype=bool)
+
+        for start in range(0, count, CHUNK_POINTS):
+            end = min(start + CHUNK_POINTS, count)
+            chunk_points = points[start:end]
+            chunk_labels = labels[start:end] if labels is not None else None
+            chunk_keep = keep[start:end]
+            chunk_result = result[:end - start]
+            for expression, predicate in zip(self.expressions, self.predicates):
+                predicate(chunk_points, chunk_labels, chunk_result, scratch)
+                before = np.count_nonzero(chunk_keep)
+                chunk_keep &= chunk_result
+                removed[expression] += before - int(np.count_nonzero(chunk_keep))
+        return keep, removed
+
+    def apply(self, points, labels=None):
+        """(points, labels, removed): the points (and labels) that pass every predicate"""
+        if labels is not None and len(labels) != len(points):
+            raise ValueError(f"{len(points)} points but {len(labels)} labels")
+        keep, removed = self.mask(points, labels)
+        if all(count == 0 for count in removed.values()):
+            return points, labels, removed
+        return points[keep], labels[keep] if labels is not None else None, removed
+
+
+def removed_report(removed):
+    """One line naming how many points each predicate removed"""
+    return ", ".join(f"{expression}: {count:,}" for expression, count in removed.items())
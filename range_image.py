@@ -0,0 +1,218 @@
+import argparse
+import os
+import sys
+from functools import partial
+import numpy as np
+
+import merge_lidar
+from catalog import Catalog, add_selection_arguments, excluded_messages, frame_query, select_frames
+from frame_io import add_io_depth_argument, write_behind
+from manifest import Manifest, add_manifest_arguments, atomic_savez, scan_dir
+from metrics import Monitor, add_metrics_arguments, report_scene, stage
+from parallel import add_workers_argument, frame_result, run_scenes
+from point_codec import decode_threads, load_labels, load_points
+
+# Merged frames in; range images are cached next to them as <scene>/range_image/<frame>.npz
+INPUT_DIR = merge_lidar.OUTPUT_DIR
+RANGE_DIR = "range_image"
+
+# Journal of the range images, kept beside merge_lidar's own manifest of the tree
+RANGE_MANIFEST_NAME = ".manifest-range"
+
+# Default projection: a 64-beam sensor, 2048 columns over 360 degrees, beams from +3 to -25 degrees
+PROJ_H = 64
+PROJ_W = 2048
+FOV_UP = 3.0
+FOV_DOWN = -25.0
+
+# Value of pixels no point projects to
+EMPTY = -1
+
+
+def add_projection_arguments(parser):
+    """Add the range-image size and field-of-view options to a script's argument parser"""
+    parser.add_argument("--height", type=int, default=PROJ_H, help=f"Image rows (default: {PROJ_H})")
+    parser.add_argument("--width", type=int, default=PROJ_W, help=f"Image columns (default: {PROJ_W})")
+    parser.add_argument("--fov-up", type=float, default=FOV_UP,
+                        help=f"Upper edge of the vertical field of view in degrees (default: {FOV_UP})")
+    parser.add_argument("--fov-down", type=float, default=FOV_DOWN,
+                        help=f"Lower edge of the vertical field of view in degrees (default: {FOV_DOWN})")
+
+
+def project(points, labels=None, height=PROJ_H, width=PROJ_W, fov_up=FOV_UP, fov_down=FOV_DOWN):
+    """Spherical projection of Nx4 [x, y, z, remission] points into height x width images
+
+    Returns a dict of images: "range", "xyz", "remission" (EMPTY where no point
+    lands), "index" (the point shown by every pixel, EMPTY where none) and,
+    with labels, "label" (0 where empty); plus the number of points outside
+    the vertical field of view, which are clamped to the nearest row as in
+    SemanticKITTI. Every pixel shows its nearest point: the points are
+    lexsorted by (pixel, range) and the first of every pixel wins.
+    """
+    xyz = points[:, :3]
+    depth = np.linalg.norm(xyz, axis=1)
+    valid = np.flatnonzero(depth > 0)
+    x, y, z = xyz[valid, 0], xyz[valid, 1], xyz[valid, 2]
+    depth_valid = depth[valid]
+
+    # Column from the azimuth, row from the elevation
+    fov_up = np.radians(fov_up)
+    fov = fov_up - np.radians(fov_down)
+    column = np.floor(0.5 * (1 - np.arctan2(y, x) / np.pi) * width).astype(np.int64)
+    row = np.floor((fov_up - np.arcsin(z / depth_valid)) / fov * height).astype(np.int64)
+    outside = int(np.count_nonzero((row < 0) | (row >= height)))
+    np.clip(column, 0, width - 1, out=column)
+    np.clip(row, 0, height - 1, out=row)
+    pixel = row * width + column
+
+    # z-buffer: nearest point of every pixel
+    order = np.lexsort((depth_valid, pixel))
+    sorted_pixel = pixel[order]
+    first = np.empty(len(order), dtype=bool)
+    first[:1] = True
+    np.not_equal(sorted_pixel[1:], sorted_pixel[:-1], out=first[1:])
+    shown = valid[order[first]]
+    pixels = sorted_pixel[first]
+
+    images = {
+        "range": np.full(height * width, EMPTY, dtype=np.float32),
+        "xyz": np.full((height * width, 3), EMPTY, dtype=np.float32),
+        "remission": np.full(height * width, EMPTY, dtype=np.float32),
+        "index": np.full(height * width, EMPTY, dtype=np.int32),
+    }
+    images["range"][pixels] = depth[shown]
+    images["xyz"][pixels] = xyz[shown]
+    images["remission"][pixels] = points[shown, 3]
+    images["index"][pixels] = shown
+    if labels is not None:
+        images["label"] = np.zeros(height * width, dtype=np.uint32)
+        images["label"][pixels] = labels[shown]
+    images = {name: image.reshape((height, width) + image.shape[1:]) for name, image in images.items()}
+    return images, outside
+
+
+def load_images(path):
+    """The images of a cached range-image file"""
+    with np.load(path) as data:
+        return dict(data)
+
+
+def input_catalog(refresh=False):
+    """Catalog of the merged tree, raw or quantized"""
+    return Catalog({"MERGED": {modality: INPUT_DIR for modality in ("points", "labels", "qpoints", "qlabels")}},
+                   refresh=refresh)
+
+
+def plan_scene(scene, catalog, query, manifest, force=False, settings=None):
+    """Return (messages, items) for one scene: one work item per selected merged frame whose images are stale"""
+    points = {**catalog.files("MERGED", "qpoints", scene), **catalog.files("MERGED", "points", scene)}
+    labels = {**catalog.files("MERGED", "qlabels", scene), **catalog.files("MERGED", "labels", scene)}
+    if not points:
+        return [f"[WARNING] No merged frames in {os.path.join(INPUT_DIR, scene, 'velodyne')}"], []
+
+    output_dir = os.path.join(INPUT_DIR, scene, RANGE_DIR)
+    os.makedirs(output_dir, exist_ok=True)
+    stats = scan_dir(output_dir)
+
+    frames, missing, excluded = select_frames(list(points), **query)
+    messages = [f"[WARNING] No merged frame {frame}" for frame in missing] + excluded_messages(excluded)
+    items = []
+    up_to_date = []
+    for frame in frames:
+        entries = {points[frame].path: points[frame]}
+        if frame in labels:
+            entries[labels[frame].path] = labels[frame]
+        output = os.path.join(output_dir, f"{frame}.npz")
+
+        # Skip frames whose images were already projected from these exact inputs
+        fingerprints = manifest.fingerprints(list(entries), entries)
+        fingerprints["settings"] = settings
+        if not force and manifest.is_current(output, fingerprints, stats.get(f"{frame}.npz")):
+            up_to_date.append(frame)
+            continue
+        label_file = labels[frame].path if frame in labels else None
+        items.append((scene, frame, points[frame].path, label_file, output, fingerprints))
+
+    if up_to_date:
+        messages.append(f"Up to date, skipped {len(up_to_date)} frames: {', '.join(up_to_date)}")
+    return messages, items
+
+
+def frame_inputs(item):
+    """The merged files of a frame, for the frame loop to prefetch"""
+    _, _, points_file, label_file, _, _ = item
+    return [points_file] if label_file is None else [points_file, label_file]
+
+
+def project_frame(item, height=PROJ_H, width=PROJ_W, fov_up=FOV_UP, fov_down=FOV_DOWN, threads=None):
+    """Project one merged frame and cache its images; quantized frames are decoded with `threads`"""
+    _, frame, points_file, label_file, output, _ = item
+    prefix = f"Processing frame {frame}: "
+    try:
+        with stage("load"):
+            points = load_points(points_file, threads)
+            labels = load_labels(label_file, threads) if label_file is not None else None
+        if labels is not None and len(labels) != len(points):
+            return frame_result("error", prefix + f"{len(points):,} points but {len(labels):,} labels")
+
+        with stage("project"):
+            images, outside = project(points, labels, height, width, fov_up, fov_down)
+        shown = int(np.count_nonzero(images["index"] != EMPTY))
+
+        with stage("write"):
+            write_behind(output, partial(atomic_savez, output, **images))
+        return frame_result("ok", prefix + f"{len(points):,} points -> {shown:,} of {height * width:,} pixels "
+                                           f"({len(points) - shown:,} hidden, {outside:,} outside the FOV)",
+                            points_in=len(points), points_out=shown)
+    except Exception as e:
+        return frame_result("error", prefix + f"Error: {e}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Project merged frames into range/xyz/remission/label images")
+    add_workers_argument(parser)
+    add_io_depth_argument(parser)
+    add_manifest_arguments(parser)
+    add_projection_arguments(parser)
+    add_metrics_arguments(parser)
+    add_selection_arguments(parser)
+    args = parser.parse_args(argv)
+    if args.height <= 0 or args.width <= 0 or args.fov_up <= args.fov_down:
+        parser.error("Image size must be positive and --fov-up above --fov-down")
+
+    print(f"PROJECTING MERGED FRAMES INTO {args.height}x{args.width} RANGE IMAGES")
+    print("=" * 80)
+
+    manifest = Manifest(INPUT_DIR, content_hash=args.hash, name=RANGE_MANIFEST_NAME)
+    settings = {"height": args.height, "width": args.width, "fov_up": args.fov_up, "fov_down": args.fov_down}
+    catalog = input_catalog(args.refresh_catalog)
+    query = frame_query(args)
+    messages = {}
+    plans = []
+    for scene in args.scenes or merge_lidar.scenes or catalog.scenes():
+        messages[scene], items = plan_scene(scene, catalog, query, manifest, args.force, settings)
+        plans.append((scene, items))
+
+    def record(item, result):
+        # Journal each finished frame right away so an interrupted run resumes here
+        if result["status"] == "ok":
+            manifest.record(item[-2], item[-1])
+
+    errors = 0
+    monitor = Monitor.from_args("range_image", args)
+    process = partial(project_frame, height=args.height, width=args.width,
+                      fov_up=args.fov_up, fov_down=args.fov_down, threads=decode_threads(args.workers))
+    for scene, results in run_scenes(process, plans, args.workers, on_result=record,
+                                     prefetch=frame_inputs, io_depth=args.io_depth, monitor=monitor):
+        report_scene(scene, messages[scene], results, args.verbose)
+        errors += sum(result["status"] == "error" for result in results)
+    monitor.close()
+    manifest.close()
+
+    if errors:
+        print(f"\n{errors} frames failed (see errors above); their images were not written")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
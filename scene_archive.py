@@ -0,0 +1,311 @@
+import argparse
+import os
+import shutil
+import numpy as np
+
+from frame_io import fromfile
+from manifest import atomic_tofile, scan_dir
+
+# One archive per scene: <archive_dir>/<scene>.pack
+ARCHIVE_EXT = ".pack"
+
+MAGIC = b"LDRSCENE"
+VERSION = 1
+
+# File layout: header, frame index, all points back to back, all labels back to back.
+# Offsets and counts in the index are in points (16 bytes) / labels (4 bytes).
+HEADER_DTYPE = np.dtype([
+    ("magic", "S8"),
+    ("version", "<u4"),
+    ("num_frames", "<u4"),
+    ("points_start", "<u8"),
+    ("labels_start", "<u8"),
+])
+INDEX_DTYPE = np.dtype([
+    ("frame", "S16"),
+    ("offset", "<u8"),
+    ("count", "<u8"),
+    ("label_offset", "<u8"),
+    ("label_count", "<u8"),
+    ("has_labels", "<u8"),
+])
+
+# Data blocks start on this boundary so the float32/uint32 views are aligned
+ALIGN = 64
+
+POINT_DTYPE = np.dtype("<f4")
+LABEL_DTYPE = np.dtype("<u4")
+POINT_SIZE = 4 * POINT_DTYPE.itemsize
+LABEL_SIZE = LABEL_DTYPE.itemsize
+
+
+def archive_path(archive_dir, scene):
+    return os.path.join(archive_dir, f"{scene}{ARCHIVE_EXT}")
+
+
+def _align(offset):
+    return -(-offset // ALIGN) * ALIGN
+
+
+class SceneArchive:
+    """Reader for one packed scene
+
+    The file is mapped once; every frame comes back as zero-copy (points,
+    labels) slices of that mapping (labels is None for frames packed without
+    a .label file). Pickling keeps only the path.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, "rb") as f:
+            header = np.fromfile(f, dtype=HEADER_DTYPE, count=1)
+            if len(header) == 0 or header["magic"][0] != MAGIC:
+                raise ValueError(f"{path} is not a scene archive")
+            if header["version"][0] != VERSION:
+                raise ValueError(f"{path}: unsupported archive version {header['version'][0]}")
+            self.index = np.fromfile(f, dtype=INDEX_DTYPE, count=int(header["num_frames"][0]))
+        self.points_start = int(header["points_start"][0])
+        self.labels_start = int(header["labels_start"][0])
+        self.frames = [frame.decode("ascii") for frame in self.index["frame"]]
+        self._positions = {frame: i for i, frame in enumerate(self.frames)}
+        self._map = None
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state["_map"] = None
+        return state
+
+    def __len__(self):
+        return len(self.frames)
+
+    def __iter__(self):
+        return iter(self.frames)
+
+    def __contains__(self, frame):
+        return frame in self._positions
+
+    def _blocks(self):
+        """(points, labels) views over the whole data blocks, mapped on first use"""
+        if self._map is None:
+            data = np.memmap(self.path, dtype=np.uint8, mode="r")
+            num_points = int((self.index["offset"] + self.index["count"]).max(initial=0))
+            num_labels = int((self.index["label_offset"] + self.index["label_count"]).max(initial=0))
+            points = data[self.points_start:self.points_start + num_points * POINT_SIZE]
+            labels = data[self.labels_start:self.labels_start + num_labels * LABEL_SIZE]
+            self._map = (points.view(POINT_DTYPE).reshape(-1, 4), labels.view(LABEL_DTYPE))
+        return self._map
+
+    def count(self, frame):
+        """Point count of a frame, from the index only"""
+        return int(self.index["count"][self._positions[frame]])
+
+    def has_labels(self, frame):
+        return bool(self.index["has_labels"][self._positions[frame]])
+
+    def __getitem__(self, frame):
+        if isinstance(frame, int):
+            frame = self.frames[frame]
+        entry = self.index[self._positions[frame]]
+        points, labels = self._blocks()
+        frame_points = points[entry["offset"]:entry["offset"] + entry["count"]]
+        if not entry["has_labels"]:
+            return frame_points, None
+        return frame_points, labels[entry["label_offset"]:entry["label_offset"] + entry["label_count"]]
+
+
+class ArchiveWriter:
+    """Build a scene archive frame by frame
+
+    Points and labels are streamed to two side files while frames are added;
+    close() writes header and index and appends both blocks, then renames the
+    result into place.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._tmp = f"{path}.tmp.{os.getpid()}"
+        self._points = open(self._tmp + ".points", "wb")
+        self._labels = open(self._tmp + ".labels", "wb")
+        self._index = []
+        self._num_points = 0
+        self._num_labels = 0
+
+    def _append(self, frame, count, label_count, has_labels):
+        if len(frame.encode("ascii")) > INDEX_DTYPE["frame"].itemsize:
+            raise ValueError(f"Frame id too long for the archive index: {frame}")
+        self._index.append((frame, self._num_points, count, self._num_labels, label_count, has_labels))
+        self._num_points += count
+        self._num_labels += label_count
+
+    def add(self, frame, points, labels=None):
+        """Append one frame from arrays"""
+        np.ascontiguousarray(points, dtype=POINT_DTYPE).tofile(self._points)
+        if labels is not None:
+            np.ascontiguousarray(labels, dtype=LABEL_DTYPE).tofile(self._labels)
+        self._append(frame, len(points), 0 if labels is None else len(labels), labels is not None)
+
+    def add_files(self, frame, bin_path, label_path=None):
+        """Append one frame by copying its .bin/.label bytes without parsing them
+
+        Raises ValueError, before anything is copied, if a file is not a whole
+        number of points/labels.
+        """
+        for path, item_size in ((bin_path, POINT_SIZE), (label_path, LABEL_SIZE)):
+            if path is not None and os.path.getsize(path) % item_size:
+                raise ValueError(f"{path}: size {os.path.getsize(path):,} is not a multiple of {item_size} bytes")
+        with open(bin_path, "rb") as f:
+            shutil.copyfileobj(f, self._points)
+        count = os.path.getsize(bin_path) // POINT_SIZE
+        label_count = 0
+        if label_path is not None:
+            with open(label_path, "rb") as f:
+                shutil.copyfileobj(f, self._labels)
+            label_count = os.path.getsize(label_path) // LABEL_SIZE
+        self._append(frame, count, label_count, label_path is not None)
+
+    def close(self):
+        self._points.close()
+        self._labels.close()
+
+        index = np.array(self._index, dtype=INDEX_DTYPE)
+        points_start = _align(HEADER_DTYPE.itemsize + index.nbytes)
+        labels_start = _align(points_start + self._num_points * POINT_SIZE)
+        header = np.array([(MAGIC, VERSION, len(index), points_start, labels_start)], dtype=HEADER_DTYPE)
+
+        try:
+            with open(self._tmp, "wb") as out:
+                out.write(header.tobytes())
+                out.write(index.tobytes())
+                for start, side in ((points_start, ".points"), (labels_start, ".labels")):
+                    out.write(b"\0" * (start - out.tell()))
+                    with open(self._tmp + side, "rb") as f:
+                        shutil.copyfileobj(f, out)
+            os.replace(self._tmp, self.path)
+        finally:
+            for side in (".points", ".labels"):
+                os.remove(self._tmp + side)
+            if os.path.exists(self._tmp):
+                os.remove(self._tmp)
+
+
+# Archives already opened by this process, by (path, size, mtime)
+_open_archives = {}
+
+
+def open_archive(path):
+    """SceneArchive for a path, opened (and mapped) once per process until the file changes"""
+    st = os.stat(path)
+    key = (path, st.st_size, st.st_mtime_ns)
+    if key not in _open_archives:
+        _open_archives[key] = SceneArchive(path)
+    return _open_archives[key]
+
+
+def load_frame(source):
+    """Load one frame's (points, labels) from either storage layout
+
+    `source` is ("files", bin_path, label_path) for a directory tree or
+    ("archive", archive_path, frame) for a packed scene. Archive frames are
+    read-only views into the mapped archive.
+    """
+    kind, path, key = source
+    if kind == "archive":
+        return open_archive(path)[key]
+    points = fromfile(path, np.float32).reshape(-1, 4)
+    labels = fromfile(key, np.uint32) if key is not None else None
+    return points, labels
+
+
+def source_paths(source):
+    """Files load_frame(source) reads, for the frame loop to prefetch (archives are mapped instead)"""
+    kind, path, key = source
+    if kind == "archive":
+        return []
+    return [path] if key is None else [path, key]
+
+
+def scene_sources(archive_dir, scene):
+    """(messages, {frame: source}) for every labelled frame of a packed scene"""
+    path = archive_path(archive_dir, scene)
+    if not os.path.exists(path):
+        return [f"[WARNING] Scene archive not found: {path}"], {}
+    archive = open_archive(path)
+    sources = {}
+    messages = []
+    for frame in archive:
+        if archive.has_labels(frame):
+            sources[frame] = ("archive", path, frame)
+        else:
+            messages.append(f"[WARNING] No labels for frame {frame} in {path}")
+    return messages, sources
+
+
+def pack_scene(scene_dir, path, frames=None):
+    """Pack <scene_dir>/velodyne/*.bin (+ labels/*.label) into one archive; returns the frame count"""
+    velodyne_dir = os.path.join(scene_dir, "velodyne")
+    label_dir = os.path.join(scene_dir, "labels")
+    bin_files = scan_dir(velodyne_dir)
+    label_files = scan_dir(label_dir)
+    if frames is None:
+        frames = sorted(name[:-4] for name in bin_files if name.endswith(".bin"))
+
+    writer = ArchiveWriter(path)
+    for frame in frames:
+        label_path = os.path.join(label_dir, f"{frame}.label") if f"{frame}.label" in label_files else None
+        writer.add_files(frame, os.path.join(velodyne_dir, f"{frame}.bin"), label_path)
+    writer.close()
+    return len(frames)
+
+
+def unpack_scene(path, scene_dir):
+    """Write every frame of an archive back as <scene_dir>/velodyne/*.bin and labels/*.label"""
+    archive = SceneArchive(path)
+    velodyne_dir = os.path.join(scene_dir, "velodyne")
+    label_dir = os.path.join(scene_dir, "labels")
+    os.makedirs(velodyne_dir, exist_ok=True)
+    for frame in archive:
+        points, labels = archive[frame]
+        atomic_tofile(points, os.path.join(velodyne_dir, f"{frame}.bin"))
+        if labels is not None:
+            os.makedirs(label_dir, exist_ok=True)
+            atomic_tofile(labels, os.path.join(label_dir, f"{frame}.label"))
+    return len(archive)
+
+
+def list_archives(archive_dir):
+    """Scenes that have an archive in a directory"""
+    return sorted(name[:-len(ARCHIVE_EXT)] for name in scan_dir(archive_dir) if name.endswith(ARCHIVE_EXT))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Pack scene trees into single-file archives and back")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    pack = subparsers.add_parser("pack", help="<root>/<scene>/{velodyne,labels} -> <archive_dir>/<scene>.pack")
+    pack.add_argument("root")
+    pack.add_argument("archive_dir")
+    pack.add_argument("--scenes", nargs="+", help="Scenes to pack (default: all)")
+
+    unpack = subparsers.add_parser("unpack", help="<archive_dir>/<scene>.pack -> <root>/<scene>/{velodyne,labels}")
+    unpack.add_argument("archive_dir")
+    unpack.add_argument("root")
+    unpack.add_argument("--scenes", nargs="+", help="Scenes to unpack (default: all)")
+
+    args = parser.parse_args(argv)
+
+    if args.command == "pack":
+        os.makedirs(args.archive_dir, exist_ok=True)
+        scenes = args.scenes or sorted(name for name in os.listdir(args.root)
+                                       if os.path.isdir(os.path.join(args.root, name, "velodyne")))
+        for scene in scenes:
+            path = archive_path(args.archive_dir, scene)
+            count = pack_scene(os.path.join(args.root, scene), path)
+            print(f"[OK] Scene {scene}: packed {count} frames -> {path}")
+    else:
+        for scene in args.scenes or list_archives(args.archive_dir):
+            count = unpack_scene(archive_path(args.archive_dir, scene), os.path.join(args.root, scene))
+            print(f"[OK] Scene {scene}: unpacked {count} frames -> {os.path.join(args.root, scene)}")
+
+
+if __name__ == "__main__":
+    main()
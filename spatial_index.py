@@ -0,0 +1,291 @@
+import numpy as np
+
+# Voxel coordinates are packed into one int64 key, 21 bits per axis
+KEY_BITS = 21
+KEY_OFFSET = 1 << (KEY_BITS - 1)
+
+# The 27 voxels around (and including) a query's own voxel
+NEIGHBOR_OFFSETS = np.array([(dx, dy, dz) for dx in (-1, 0, 1) for dy in (-1, 0, 1) for dz in (-1, 0, 1)],
+                            dtype=np.int64)
+
+
+def pack_keys(cells):
+    """Pack (N, 3) integer voxel coordinates into int64 keys"""
+    cells = cells + KEY_OFFSET
+    return (cells[:, 0] << (2 * KEY_BITS)) | (cells[:, 1] << KEY_BITS) | cells[:, 2]
+
+
+# Reductions VoxelGrid.representatives supports
+VOXEL_MODES = ("centroid", "first", "max-intensity")
+
+# Space-filling curves points can be reordered along, and the default bits
+# per axis of the grid they are quantized to (at most KEY_BITS)
+CURVES = ("morton", "hilbert")
+CURVE_BITS = 16
+
+
+def spread_bits(values):
+    """Spread the low 21 bits of uint64 values two zero bits apart (bit b moves to bit 3b)"""
+    x = values.astype(np.uint64) & np.uint64(0x1FFFFF)
+    for shift, mask in ((32, 0x1F00000000FFFF), (16, 0x1F0000FF0000FF), (8, 0x100F00F00F00F00F),
+                        (4, 0x10C30C30C30C30C3), (2, 0x1249249249249249)):
+        x = (x | (x << np.uint64(shift))) & np.uint64(mask)
+    return x
+
+
+def morton_keys(cells):
+    """Z-order keys of (N, 3) non-negative integer cells: the bits of x, y and z interleaved"""
+    cells = np.asarray(cells, dtype=np.uint64)
+    return (spread_bits(cells[:, 0]) << np.uint64(2)) | (spread_bits(cells[:, 1]) << np.uint64(1)) \
+        | spread_bits(cells[:, 2])
+
+
+def hilbert_keys(cells, bits):
+    """Hilbert-curve keys of (N, 3) integer cells in [0, 2**bits)
+
+    Skilling's transform ("Programming the Hilbert curve", 2004) run on all
+    points at once: one vectorized step per bit, then the transposed index is
+    interleaved like a Morton key.
+    """
+    axes = [np.array(cells[:, i], dtype=np.uint64) for i in range(3)]
+    zero = np.uint64(0)
+
+    # Undo the curve's rotations and reflections, from the top bit down
+    q = 1 << (bits - 1)
+    while q > 1:
+        p = np.uint64(q - 1)
+        for i in range(3):
+            high = (axes[i] & np.uint64(q)) != 0
+            axes[0] ^= np.where(high, p, zero)
+            swap = np.where(high, zero, (axes[0] ^ axes[i]) & p)
+            axes[0] ^= swap
+            axes[i] ^= swap
+        q >>= 1
+
+    # Gray encode
+    axes[1] ^= axes[0]
+    axes[2] ^= axes[1]
+    flips = np.zeros(len(axes[0]), dtype=np.uint64)
+    q = 1 << (bits - 1)
+    while q > 1:
+        flips ^= np.where((axes[2] & np.uint64(q)) != 0, np.uint64(q - 1), zero)
+        q >>= 1
+    for axis in axes:
+        axis ^= flips
+    return morton_keys(np.stack(axes, axis=1))
+
+
+def curve_order(xyz, curve="morton", bits=CURVE_BITS):
+    """(order, bbox): the permutation sorting points along a space-filling curve, and their bounding box
+
+    xyz is quantized to a cubic grid of 2**bits cells per axis spanning the
+    bounding box (bbox is [min, max] per axis, float32) and the cells are
+    keyed along the Morton (Z-order) or Hilbert curve. Points sharing a cell
+    keep their original order.
+    """
+    if curve not in CURVES:
+        raise ValueError(f"Unknown curve {curve!r}, expected one of {CURVES}")
+    if not 1 <= bits <= KEY_BITS:
+        raise ValueError(f"Curve bits must be within 1..{KEY_BITS}, got {bits}")
+    xyz = np.asarray(xyz)
+    if not len(xyz):
+        return np.empty(0, dtype=np.int64), np.zeros((2, 3), dtype=np.float32)
+
+    low = xyz.min(axis=0)
+    high = xyz.max(axis=0)
+    extent = float((high - low).max()) or 1.0
+    scale = ((1 << bits) - 1) / extent
+    cells = ((xyz - low) * scale).astype(np.int64)
+    keys = morton_keys(cells) if curve == "morton" else hilbert_keys(cells, bits)
+    return np.argsort(keys, kind="stable"), np.stack([low, high]).astype(np.float32)
+
+
+def add_reorder_arguments(parser):
+    """Add the shared space-filling-curve reordering options to a script's argument parser"""
+    parser.add_argument("--reorder", choices=CURVES,
+                        help="Sort every merged frame along this space-filling curve (default: off)")
+    parser.add_argument("--reorder-bits", type=int, default=CURVE_BITS,
+                        help=f"Grid bits per axis the curve is computed on (default: {CURVE_BITS}, max {KEY_BITS})")
+
+
+class VoxelGrid:
+    """A point set bucketed into cubic voxels of side `voxel_size`
+
+    Points are sorted by packed voxel key; `order[voxel_starts[v]:][:voxel_counts[v]]`
+    are the indices of the points in voxel v. All per-voxel reductions are
+    segment operations on that order (reduceat / sorts), not Python dicts.
+    """
+
+    def __init__(self, xyz, voxel_size):
+        if voxel_size <= 0:
+            raise ValueError(f"voxel_size must be positive, got {voxel_size}")
+        self.voxel_size = float(voxel_size)
+        self.xyz = np.ascontiguousarray(xyz, dtype=np.float64)
+
+        cells = np.floor(self.xyz / self.voxel_size).astype(np.int64)
+        if len(cells) and (np.abs(cells).max() >= KEY_OFFSET - 1):
+            raise ValueError(f"Point coordinates too large for voxel size {voxel_size}")
+        keys = pack_keys(cells)
+        self.order = np.argsort(keys, kind="stable")
+
+        # One entry per occupied voxel: its key and its run in `order`
+        sorted_keys = keys[self.order]
+        first = np.ones(len(sorted_keys), dtype=bool)
+        first[1:] = sorted_keys[1:] != sorted_keys[:-1]
+        self.voxel_keys = sorted_keys[first]
+        self.voxel_starts = np.flatnonzero(first)
+        self.voxel_counts = np.diff(np.append(self.voxel_starts, len(sorted_keys)))
+
+    @property
+    def num_voxels(self):
+        return len(self.voxel_keys)
+
+    def voxel_ids(self):
+        """Voxel number of every point, in original point order"""
+        ids = np.empty(len(self.order), dtype=np.int64)
+        ids[self.order] = np.repeat(np.arange(self.num_voxels), self.voxel_counts)
+        return ids
+
+    def first(self):
+        """Index of the first point (in original order) of every voxel"""
+        return self.order[self.voxel_starts]
+
+    def argmax(self, values):
+        """Index of the point with the largest value in every voxel (first one on ties)"""
+        ranked = np.lexsort((np.arange(len(values)), -np.asarray(values, dtype=np.float64), self.voxel_ids()))
+        return ranked[self.voxel_starts]
+
+    def mean(self, values):
+        """Per-voxel mean of an (N,) or (N, k) array, as float64"""
+        values = np.asarray(values, dtype=np.float64)[self.order]
+        sums = np.add.reduceat(values, self.voxel_starts, axis=0)
+        counts = self.voxel_counts if sums.ndim == 1 else self.voxel_counts[:, None]
+        return sums / counts
+
+    def majority(self, labels):
+        """Most common label of every voxel (the smallest label on ties)"""
+        labels = np.asarray(labels)
+        voxel_ids = self.voxel_ids()
+        by_label = np.lexsort((labels, voxel_ids))
+        sorted_ids = voxel_ids[by_label]
+        sorted_labels = labels[by_label]
+
+        # Runs of equal (voxel, label) and their lengths
+        new_run = np.ones(len(by_label), dtype=bool)
+        new_run[1:] = (sorted_ids[1:] != sorted_ids[:-1]) | (sorted_labels[1:] != sorted_labels[:-1])
+        run_starts = np.flatnonzero(new_run)
+        run_lengths = np.diff(np.append(run_starts, len(by_label)))
+        run_voxels = sorted_ids[run_starts]
+
+        # Longest run per voxel: sort runs by (voxel, -length, label) and take each voxel's first
+        best = np.lexsort((sorted_labels[run_starts], -run_lengths, run_voxels))
+        first = np.ones(len(best), dtype=bool)
+        first[1:] = run_voxels[best][1:] != run_voxels[best][:-1]
+        return sorted_labels[run_starts[best[first]]]
+
+    def representatives(self, mode, intensity=None):
+        """One point index per voxel for the "first" and "max-intensity" modes"""
+        if mode == "first":
+            return self.first()
+        if mode == "max-intensity":
+            if intensity is None:
+                raise ValueError("max-intensity voxel reduction needs an intensity column")
+            return self.argmax(intensity)
+        raise ValueError(f"Unknown voxel reduction {mode!r}, expected one of {VOXEL_MODES}")
+
+
+def add_voxel_arguments(parser):
+    """Add the shared voxel-grid options to a script's argument parser"""
+    parser.add_argument("--voxel-size", type=float, metavar="METERS",
+                        help="Reduce merged clouds to one point per voxel of this size (default: off)")
+    parser.add_argument("--voxel-mode", choices=VOXEL_MODES, default="centroid",
+                        help="Point kept per voxel (default: centroid); labels are always the majority vote")
+
+
+def voxel_downsample(points, labels, voxel_size, mode="centroid"):
+    """Reduce an Nx4 [x, y, z, remission] scan and its labels to one point per voxel
+
+    "centroid" averages xyz and remission over each voxel, "first" keeps the
+    first point and "max-intensity" the point with the largest remission.
+    Labels are the majority vote of each voxel's labels in every mode. The
+    output is in voxel-key order; labels is None if none were given.
+    """
+    grid = VoxelGrid(points[:, :3], voxel_size)
+    if mode == "centroid":
+        reduced = grid.mean(points).astype(points.dtype)
+    else:
+        reduced = points[grid.representatives(mode, points[:, 3])]
+    return reduced, grid.majority(labels) if labels is not None else None
+
+
+def compression_report(voxel_size, mode, before, after):
+    """Log line describing one voxel-grid reduction"""
+    ratio = before / after if after else float("inf")
+    return f"        Voxel grid {voxel_size} m ({mode}): {before:,} -> {after:,} points ({ratio:.2f}x)"
+
+
+class VoxelIndex(VoxelGrid):
+    """Nearest-neighbour lookups within a fixed radius over a static point set
+
+    A query only looks at the 27 voxels around it, so any match closer than
+    `voxel_size` is found exactly. Every query runs as one batch of numpy
+    operations, without a Python loop over points.
+    """
+
+    def __len__(self):
+        return len(self.xyz)
+
+    def query(self, xyz, max_distance=None):
+        """Nearest indexed point for every query point
+
+        Returns (indices, distances); queries with no indexed point within
+        `max_distance` (default and upper bound: the voxel size) get index -1
+        and distance inf.
+        """
+        max_distance = self.voxel_size if max_distance is None else min(max_distance, self.voxel_size)
+        queries = np.ascontiguousarray(xyz, dtype=np.float64)
+        num_queries = len(queries)
+        indices = np.full(num_queries, -1, dtype=np.int64)
+        distances = np.full(num_queries, np.inf)
+        if num_queries == 0 or len(self) == 0:
+            return indices, distances
+
+        # Walk the queries in voxel order so the binary searches below see sorted needles
+        cells = np.floor(queries / self.voxel_size).astype(np.int64)
+        query_order = np.argsort(pack_keys(cells), kind="stable")
+        cells = cells[query_order]
+        queries = queries[query_order]
+
+        best_sq = np.full(num_queries, max_distance * max_distance)
+        found = np.full(num_queries, -1, dtype=np.int64)
+        last = len(self.voxel_keys) - 1
+        for offset in NEIGHBOR_OFFSETS:
+            keys = pack_keys(cells + offset)
+            slots = np.minimum(np.searchsorted(self.voxel_keys, keys), last)
+            hit = np.flatnonzero(self.voxel_keys[slots] == keys)
+            if not len(hit):
+                continue
+
+            # One row per (query, candidate) pair of this neighbouring voxel
+            hit_starts = self.voxel_starts[slots[hit]]
+            hit_counts = self.voxel_counts[slots[hit]]
+            query_ids = np.repeat(hit, hit_counts)
+            run_starts = np.repeat(hit_starts - np.cumsum(hit_counts) + hit_counts, hit_counts)
+            candidates = self.order[run_starts + np.arange(len(query_ids))]
+            diff = self.xyz[candidates] - queries[query_ids]
+            dist_sq = np.einsum("ij,ij->i", diff, diff)
+
+            # Closest candidate per query in this voxel, kept if it beats the best so far
+            by_distance = np.lexsort((dist_sq, query_ids))
+            first = np.ones(len(by_distance), dtype=bool)
+            first[1:] = query_ids[by_distance][1:] != query_ids[by_distance][:-1]
+            closest = by_distance[first]
+            better = dist_sq[closest] <= best_sq[query_ids[closest]]
+            closest = closest[better]
+            best_sq[query_ids[closest]] = dist_sq[closest]
+            found[query_ids[closest]] = candidates[closest]
+
+        matched = found >= 0
+        indices[query_order] = found
+        distances[query_order[matched]] = np.sqrt(best_sq[matched])
+        return indices, distances
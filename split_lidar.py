@@ -0,0 +1,332 @@
+import argparse
+import os
+from contextlib import ExitStack
+from functools import partial
+import numpy as np
+
+from catalog import Catalog, add_selection_arguments, excluded_messages, frame_query, select_frames
+from frame_io import (AppendWriter, add_io_depth_argument, add_max_memory_argument, block_points, map_windows,
+                      write_array)
+from label_map import add_label_map_arguments, label_map_from_args
+from metrics import Monitor, add_metrics_arguments, report_scene, stage
+from parallel import add_workers_argument, frame_result, run_scenes
+from point_filter import add_filter_arguments, filter_from_args, removed_report
+from scene_archive import list_archives, load_frame, scene_sources, source_paths
+
+# Base input directory
+base_input_dir = "/home/ezarisma/Downloads/Practice/Semantic-KITTI-API-DPAI-main-ver3/data/sequences"
+
+# Remission tag -> output directory. Every scan is read once and split into
+# all of these trees in the same pass (replaces filter_lidar0.py / filter_lidar1.py).
+PARTITIONS = {
+    0: "./filtered/sequences_lidar0",
+    1: "./filtered/sequences_lidar1",
+}
+
+# Scenes to process (None: every scene of the input tree)
+scenes = None
+
+# Working memory per point of a streamed block: its mapped window, the filter's
+# copy, the remapped labels and the partition's sort buffers (with headroom)
+BLOCK_BYTES_PER_POINT = 128
+
+
+def partition_by_tag(remissions, tags):
+    """Stable partition of point indices by remission tag.
+
+    Returns (order, counts): `order` sorts the points so that each tag's points
+    are contiguous (in their original order), `counts[i]` is the number of points
+    tagged `tags[i]`. Points matching no tag are grouped last in
+    `counts[len(tags)]`.
+    """
+    tags = np.asarray(tags, dtype=remissions.dtype)
+    tag_order = np.argsort(tags)
+    sorted_tags = tags[tag_order]
+
+    # Bucket index of every point (len(tags) for "no tag")
+    pos = np.searchsorted(sorted_tags, remissions)
+    pos = np.minimum(pos, len(tags) - 1)
+    hit = sorted_tags[pos] == remissions
+    buckets = np.where(hit, tag_order[pos], len(tags))
+
+    counts = np.bincount(buckets, minlength=len(tags) + 1)
+    order = np.argsort(buckets, kind="stable")
+    return order, counts
+
+
+def split_scan(points, labels, tags):
+    """Split one scan into per-tag (points, labels) views using a single partition"""
+    order, counts = partition_by_tag(points[:, 3], tags)
+    sorted_points = points[order]
+    sorted_labels = labels[order]
+
+    offsets = np.concatenate(([0], np.cumsum(counts)))
+    parts = {}
+    for i, tag in enumerate(tags):
+        start, end = offsets[i], offsets[i + 1]
+        parts[tag] = (sorted_points[start:end], sorted_labels[start:end])
+    return parts
+
+
+def input_catalog(refresh=False):
+    """Catalog of the raw scan and label tree"""
+    return Catalog({"RAW": {"points": base_input_dir, "labels": base_input_dir}}, refresh=refresh)
+
+
+def plan_scene(scene, partitions=PARTITIONS, input_archive=None, catalog=None, query=None):
+    """Check one scene's input folders (or archive) and list its selected frames
+
+    Returns (messages, items): warnings to print for the scene and one work item
+    per frame that has both a .bin and a .label file whose sizes agree.
+    Without an archive, frames come from `catalog`; `query` holds the
+    select_frames arguments (default: every frame).
+    """
+    query = query or {}
+
+    # Input folders for current scene
+    velodyne_dir = os.path.join(base_input_dir, scene, "velodyne")
+    label_dir = os.path.join(base_input_dir, scene, "labels")
+
+    # Check if input directories exist
+    if input_archive is None:
+        catalog = catalog or input_catalog()
+        scans = catalog.files("RAW", "points", scene)
+        labels = catalog.files("RAW", "labels", scene)
+        if not scans:
+            return [f"[WARNING] Velodyne directory not found or empty: {velodyne_dir}"], []
+        if not labels:
+            return [f"[WARNING] Label directory not found or empty: {label_dir}"], []
+
+    # Output folders for current scene, one pair per partition
+    output_dirs = {}
+    for tag, output_base in partitions.items():
+        output_velodyne_dir = os.path.join(output_base, scene, "velodyne")
+        output_label_dir = os.path.join(output_base, scene, "labels")
+        os.makedirs(output_velodyne_dir, exist_ok=True)
+        os.makedirs(output_label_dir, exist_ok=True)
+        output_dirs[tag] = (output_velodyne_dir, output_label_dir)
+
+    # Frames of a packed scene
+    if input_archive is not None:
+        messages, sources = scene_sources(input_archive, scene)
+        frames, missing, excluded = select_frames(list(sources), **query)
+        messages += [f"[WARNING] Frame {frame} not in the scene archive" for frame in missing]
+        messages += excluded_messages(excluded)
+        items = [(scene, f"{frame}.bin", sources[frame], output_dirs) for frame in frames]
+        return messages, items
+
+    frames, missing, excluded = select_frames(list(scans), **query)
+    messages = [f"[WARNING] Scan file not found for frame {frame}" for frame in missing]
+    messages += excluded_messages(excluded)
+    items = []
+    for frame in frames:
+        # Check if label file exists and matches the scan
+        if frame not in labels:
+            messages.append(f"[WARNING] Label file not found: {os.path.join(label_dir, f'{frame}.label')}")
+            continue
+        problems = catalog.check(scene, frame)
+        if problems:
+            messages.append(f"[WARNING] Skipping {scene}/{frame}.bin: {'; '.join(problems)}")
+            continue
+
+        source = ("files", scans[frame].path, labels[frame].path)
+        items.append((scene, f"{frame}.bin", source, output_dirs))
+    return messages, items
+
+
+def is_streamed(source, max_memory):
+    """Whether a frame of the directory tree needs more than `max_memory` MB whole, so it is split in blocks"""
+    return (max_memory is not None and source[0] == "files"
+            and os.path.getsize(source[1]) // 16 * BLOCK_BYTES_PER_POINT > max_memory * 1e6)
+
+
+def frame_inputs(item, max_memory=None):
+    """Files process_frame reads for an item (none for a streamed frame, which is never read whole)"""
+    return [] if is_streamed(item[2], max_memory) else source_paths(item[2])
+
+
+def split_block(points, labels, tags, point_filter=None, label_map=None, instance_ids=None):
+    """(parts, removed): a frame, or a block of one, filtered, remapped and split by tag
+
+    `instance_ids` are the frame's kept instance ids when this is a block of
+    it (see LabelMap.instance_ids).
+    """
+    removed = {}
+    if point_filter is not None:
+        with stage("filter"):
+            points, labels, removed = point_filter.apply(points, labels)
+    if label_map is not None:
+        with stage("remap"):
+            labels = label_map.apply(labels, instance_ids)
+    with stage("split"):
+        parts = split_scan(points, labels, tags)
+    return parts, removed
+
+
+def kept_labels(points_file, label_file, block, point_filter=None):
+    """Yield the labels of a frame's points that pass `point_filter`, block by block"""
+    for points, labels in zip(map_windows(points_file, np.float32, 4, block),
+                              map_windows(label_file, np.uint32, None, block)):
+        if point_filter is not None:
+            labels = point_filter.apply(points, labels)[1]
+        yield labels
+
+
+def split_streamed(points_file, label_file, output_files, block, point_filter=None, label_map=None):
+    """Split a frame too large to load block by block, appending every block's partitions to their files
+
+    `output_files` maps tag -> (points path, labels path). Returns
+    (kept, removed), totalled over the blocks. Compacted instance ids take a
+    first pass over the frame so that they are numbered frame-wide.
+    """
+    kept = dict.fromkeys(output_files, 0)
+    removed = {}
+    instance_ids = None
+    if label_map is not None and label_map.instances == "compact":
+        with stage("remap"):
+            instance_ids = label_map.instance_ids(kept_labels(points_file, label_file, block, point_filter))
+    with ExitStack() as stack:
+        writers = {tag: [stack.enter_context(AppendWriter(path)) for path in paths]
+                   for tag, paths in output_files.items()}
+        for points, labels in zip(map_windows(points_file, np.float32, 4, block),
+                                  map_windows(label_file, np.uint32, None, block)):
+            parts, block_removed = split_block(points, labels, list(output_files), point_filter, label_map,
+                                               instance_ids)
+            with stage("write"):
+                for tag, (part_points, part_labels) in parts.items():
+                    writers[tag][0].append(part_points)
+                    writers[tag][1].append(part_labels)
+                    kept[tag] += len(part_points)
+            for expression, count in block_removed.items():
+                removed[expression] = removed.get(expression, 0) + count
+    return kept, removed
+
+
+def process_frame(item, point_filter=None, label_map=None, max_memory=None):
+    """Split one frame into all partition trees, keeping only the points that pass `point_filter`
+
+    The filter sees the raw labels; a `label_map` then remaps the kept labels
+    before they are split and written. A frame of the directory tree that
+    would need more than `max_memory` MB is streamed through in blocks.
+    """
+    scene, filename, source, output_dirs = item
+    label_filename = filename.replace(".bin", ".label")
+    tags = list(output_dirs)
+    output_files = {tag: (os.path.join(output_velodyne_dir, filename), os.path.join(output_label_dir, label_filename))
+                    for tag, (output_velodyne_dir, output_label_dir) in output_dirs.items()}
+
+    try:
+        streamed = is_streamed(source, max_memory)
+        if streamed:
+            points_before = os.path.getsize(source[1]) // 16
+            num_labels = os.path.getsize(source[2]) // 4
+        else:
+            # Load point cloud: Nx4 [x, y, z, remission] and labels
+            with stage("load"):
+                points, labels = load_frame(source)
+            points_before, num_labels = len(points), len(labels)
+
+        # Validate sizes
+        if num_labels != points_before:
+            return frame_result("error", f"[ERROR] Size mismatch in {scene}/{filename}: {num_labels} labels vs {points_before} points")
+
+        if streamed:
+            kept, removed = split_streamed(source[1], source[2], output_files,
+                                           block_points(max_memory, BLOCK_BYTES_PER_POINT), point_filter, label_map)
+        else:
+            parts, removed = split_block(points, labels, tags, point_filter, label_map)
+
+            # Save every partition from the same read
+            kept = {}
+            with stage("write"):
+                for tag, (part_points, part_labels) in parts.items():
+                    write_array(part_points, output_files[tag][0])
+                    write_array(part_labels, output_files[tag][1])
+                    kept[tag] = len(part_points)
+
+        summary = ", ".join(f"remission={tag}: {kept[tag]}" for tag in tags)
+        lines = [f"[OK] Scene {scene}: {filename} - {points_before} points -> {summary}"]
+        if removed:
+            lines.append(f"        Filtered out: {removed_report(removed)}")
+        return frame_result("ok", *lines, points_before=points_before, kept=kept, removed=removed,
+                            points_in=points_before, points_out=sum(kept.values()))
+
+    except Exception as e:
+        return frame_result("error", f"[ERROR] Processing {scene}/{filename}: {str(e)}")
+
+
+def print_scene_summary(scene, results, num_files, partitions=PARTITIONS):
+    """Print the per-partition totals of one scene"""
+    processed = [r for r in results if r["status"] == "ok"]
+    if not processed:
+        return
+
+    print(f"\nScene {scene} Summary")
+    print(f"Processed files: {len(processed)}/{num_files}")
+    total_points_before = sum(r["points_before"] for r in processed)
+    total_points_kept = 0
+    for tag, output_base in partitions.items():
+        kept = sum(r["kept"][tag] for r in processed)
+        total_points_kept += kept
+        print(f"Points kept (remission={tag}): {kept} -> {os.path.join(output_base, scene, 'velodyne')}")
+
+    # Points each filter expression removed, summed over the scene
+    removed = {}
+    for r in processed:
+        for expression, count in r["removed"].items():
+            removed[expression] = removed.get(expression, 0) + count
+    if removed:
+        print(f"Points filtered out: {removed_report(removed)}")
+    print(f"Points in no partition: {total_points_before - total_points_kept - sum(removed.values())}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Split scans into one output tree per remission tag")
+    add_workers_argument(parser)
+    add_io_depth_argument(parser)
+    parser.add_argument("--input-archive", metavar="DIR",
+                        help="Read scans from <DIR>/<scene>.pack archives instead of the directory tree")
+    add_metrics_arguments(parser)
+    add_selection_arguments(parser)
+    add_filter_arguments(parser)
+    add_label_map_arguments(parser)
+    add_max_memory_argument(parser)
+    args = parser.parse_args(argv)
+    if args.max_memory is not None and args.max_memory <= 0:
+        parser.error("--max-memory must be positive")
+    try:
+        point_filter = filter_from_args(args)
+    except (OSError, ValueError) as e:
+        parser.error(f"Bad filter: {e}")
+    try:
+        label_map = label_map_from_args(args)
+    except (OSError, ImportError, ValueError) as e:
+        parser.error(f"Bad label map: {e}")
+
+    catalog = input_catalog(args.refresh_catalog) if args.input_archive is None else None
+    query = frame_query(args)
+    selected = (args.scenes or scenes
+                or (catalog.scenes() if catalog is not None else list_archives(args.input_archive)))
+    messages = {}
+    plans = []
+    for scene in selected:
+        messages[scene], items = plan_scene(scene, input_archive=args.input_archive, catalog=catalog, query=query)
+        plans.append((scene, items))
+
+    monitor = Monitor.from_args("split_lidar", args)
+    process = partial(process_frame, point_filter=point_filter, label_map=label_map, max_memory=args.max_memory)
+    prefetch = partial(frame_inputs, max_memory=args.max_memory)
+    for scene, results in run_scenes(process, plans, args.workers,
+                                     prefetch=prefetch, io_depth=args.io_depth, monitor=monitor):
+        report_scene(scene, messages[scene], results, args.verbose, header="Processing Scene")
+        print_scene_summary(scene, results, len(results) + len(messages[scene]))
+    monitor.close()
+
+    print("\nProcessing Complete")
+    print(f"Processed scenes: {selected}")
+    for tag, output_base in PARTITIONS.items():
+        print(f"Output directory (remission={tag}): {output_base}")
+
+
+if __name__ == "__main__":
+    main()
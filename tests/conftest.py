@@ -0,0 +1,39 @@
+import os
+import sys
+import numpy as np
+import pytest
+
+# The scripts are flat modules at the repository root
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import catalog  # noqa: E402
+
+FRAMES = ("000", "005")
+
+
+@pytest.fixture(autouse=True)
+def catalog_cache(tmp_path, monkeypatch):
+    """Keep the catalog's listing cache inside the test's directory"""
+    monkeypatch.setattr(catalog, "CATALOG_CACHE_DIR", str(tmp_path / "catalog_cache"))
+
+
+@pytest.fixture
+def raw_tree(tmp_path):
+    """A SemanticKITTI-style tree <tmp>/raw/00/{velodyne,labels} of small frames
+
+    Remissions are the sensor tags 0 and 1, coordinates lie in [0, 10).
+    Returns (root, {frame: (points, labels)}).
+    """
+    rng = np.random.default_rng(0)
+    root = tmp_path / "raw"
+    frames = {}
+    for frame in FRAMES:
+        n = 200 + int(frame)
+        points = (rng.random((n, 4)) * 10).astype(np.float32)
+        points[:, 3] = rng.integers(0, 2, n)
+        labels = (rng.integers(0, 30, n) | (rng.integers(0, 4, n) << 16)).astype(np.uint32)
+        for subdir, array, ext in (("velodyne", points, "bin"), ("labels", labels, "label")):
+            os.makedirs(root / "00" / subdir, exist_ok=True)
+            array.tofile(root / "00" / subdir / f"{frame}.{ext}")
+        frames[frame] = (points, labels)
+    return str(root), frames
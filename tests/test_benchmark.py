@@ -0,0 +1,21 @@
+import sys
+
+import benchmark
+
+
+def test_compare_flags_failed_stages_and_skips_zero_baselines():
+    results = {"stages": {"split": {"points_per_sec": 100}, "merge": {"failed": True, "exit_status": 1},
+                          "pipeline": {"points_per_sec": 50}}}
+    baseline = {"stages": {"split": {"points_per_sec": 0}, "merge": {"points_per_sec": 100},
+                           "pipeline": {"points_per_sec": 100}}}
+    lines, regressions = benchmark.compare(results, baseline)
+    assert regressions == ["merge", "pipeline"]
+    assert lines[0].startswith("[WARNING] split")
+
+
+def test_run_stage_reports_exit_status(monkeypatch, tmp_path):
+    monkeypatch.setattr(benchmark, "configure", lambda *args: None)
+    monkeypatch.setitem(benchmark.STAGES, "split", lambda root, scenes, args: sys.exit(1))
+    monkeypatch.setitem(benchmark.STAGES, "merge", lambda root, scenes, args: None)
+    assert benchmark._run_stage("split", str(tmp_path), [], 1, None)[2] == 1
+    assert benchmark._run_stage("merge", str(tmp_path), [], 1, None)[2] == 0
@@ -0,0 +1,34 @@
+import argparse
+
+from catalog import add_selection_arguments, frame_query, select_frames
+
+FRAME_IDS = [f"{i:03d}" for i in range(200)]
+
+
+def query(*argv):
+    parser = argparse.ArgumentParser()
+    add_selection_arguments(parser, 0, 100, 5)
+    return frame_query(parser.parse_args(argv))
+
+
+def test_defaults_apply_without_frames():
+    selected, missing, excluded = select_frames(FRAME_IDS, **query())
+    assert selected == [f"{i:03d}" for i in range(0, 100, 5)]
+    assert missing == excluded == []
+
+
+def test_explicit_frames_ignore_default_selection():
+    assert select_frames(FRAME_IDS, **query("--frames", "7", "12", "150")) == (["007", "012", "150"], [], [])
+
+
+def test_explicit_frames_narrowed_by_explicit_range():
+    selected, missing, excluded = select_frames(FRAME_IDS + ["abc"], **query("--frames", "7", "150", "999",
+                                                                              "--range", "0", "100"))
+    assert selected == ["007"]
+    assert missing == [999]
+    assert excluded == ["150"]
+
+
+def test_stride_counts_from_start():
+    selected, _, _ = select_frames(FRAME_IDS, start=3, stop=20, stride=5)
+    assert selected == ["003", "008", "013", "018"]
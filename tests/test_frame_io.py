@@ -0,0 +1,44 @@
+import numpy as np
+
+import frame_io
+from frame_io import fromfile, mapped, run_frames
+from metrics import begin_frame, end_frame
+
+
+def frame_files(tmp_path, count=4):
+    paths = []
+    for i in range(count):
+        path = tmp_path / f"{i}.bin"
+        np.full(256, i, dtype=np.float32).tofile(path)
+        paths.append(str(path))
+    return paths
+
+
+def test_prefetched_files_are_served_from_memory(tmp_path):
+    paths = frame_files(tmp_path)
+
+    def call(path):
+        begin_frame()
+        array = fromfile(path, np.float32)
+        return {"status": "ok", "lines": [], "first": float(array[0]), "metrics": end_frame(0.0)}
+
+    results = list(run_frames(call, paths, lambda path: [path], io_depth=2))
+    assert [result["first"] for result in results] == [0.0, 1.0, 2.0, 3.0]
+    assert all(result["metrics"]["bytes_read"] == 1024 for result in results)
+    assert not frame_io._prefetched
+
+
+def test_mapped_files_are_only_advised(tmp_path, monkeypatch):
+    paths = frame_files(tmp_path)
+    monkeypatch.setattr(frame_io, "_read_file", lambda path: (_ for _ in ()).throw(AssertionError(path)))
+
+    def call(path):
+        begin_frame()
+        return {"status": "ok", "lines": [], "sum": float(np.memmap(path, dtype=np.float32, mode="r").sum()),
+                "metrics": end_frame(0.0)}
+
+    results = list(run_frames(call, paths, lambda path: [mapped(path)], io_depth=2))
+    assert [result["sum"] for result in results] == [0.0, 256.0, 512.0, 768.0]
+    # The advised bytes are counted as read once the frame is done
+    assert all(result["metrics"]["bytes_read"] == 1024 for result in results)
+    assert not frame_io._advised
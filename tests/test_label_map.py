@@ -0,0 +1,39 @@
+import argparse
+import json
+import numpy as np
+import pytest
+
+from label_map import LabelMap, add_label_map_arguments, label_map_from_args
+
+
+def from_file(tmp_path, config, *argv):
+    path = tmp_path / "map.json"
+    path.write_text(json.dumps(config))
+    parser = argparse.ArgumentParser()
+    add_label_map_arguments(parser)
+    return label_map_from_args(parser.parse_args(["--label-map", str(path), *argv]))
+
+
+def test_flat_map_with_reserved_keys(tmp_path):
+    label_map = from_file(tmp_path, {"10": 1, "11": 2, "default": 0, "instances": "strip"})
+    assert label_map.mapping == {10: 1, 11: 2}
+    assert label_map.default == 0 and label_map.instances == "strip"
+
+
+def test_nested_map(tmp_path):
+    label_map = from_file(tmp_path, {"learning_map": {"10": 1}, "instances": "compact"}, "--instances", "keep")
+    assert label_map.mapping == {10: 1} and label_map.default is None and label_map.instances == "keep"
+
+
+def test_bad_keys_are_reported(tmp_path):
+    with pytest.raises(ValueError, match="integer class ids"):
+        from_file(tmp_path, {"10": 1, "car": 2})
+
+
+def test_apply_remaps_semantics_and_compacts_instances():
+    labels = np.array([10 | 7 << 16, 11, 12 | 300 << 16, 10 | 7 << 16], dtype=np.uint32)
+    label_map = LabelMap({10: 1, 11: 2}, default=0, instances="compact")
+    np.testing.assert_array_equal(label_map.apply(labels), [1 | 1 << 16, 2, 0 | 2 << 16, 1 | 1 << 16])
+    # Numbered over ids of the whole frame, as when it is remapped block by block
+    ids = label_map.instance_ids([labels, np.array([5 << 16], dtype=np.uint32)])
+    np.testing.assert_array_equal(label_map.apply(labels[:2], ids), [1 | 2 << 16, 2])
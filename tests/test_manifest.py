@@ -0,0 +1,60 @@
+import os
+import numpy as np
+
+from manifest import Manifest, atomic_tofile, stat_files
+
+
+def build(tmp_path, content_hash=False):
+    """One input and one output built from it; returns (manifest, input, output, fingerprints)"""
+    source = tmp_path / "in.bin"
+    if not source.exists():
+        np.arange(10, dtype=np.float32).tofile(source)
+    output = tmp_path / "out" / "out.bin"
+    os.makedirs(output.parent, exist_ok=True)
+    manifest = Manifest(str(tmp_path / "out"), content_hash)
+    return manifest, str(source), str(output), manifest.fingerprints([str(source)])
+
+
+def test_resume_after_interruption(tmp_path):
+    manifest, source, output, fingerprints = build(tmp_path)
+    atomic_tofile(np.fromfile(source, dtype=np.float32) * 2, output)
+    manifest.record(output, fingerprints)
+    # No close(): the journal line alone must be enough to resume
+    with open(manifest.path, "a") as f:
+        f.write('{"output": "torn')
+
+    manifest, source, output, fingerprints = build(tmp_path)
+    assert manifest.is_current(output, fingerprints)
+
+
+def test_changed_input_or_output_is_stale(tmp_path):
+    manifest, source, output, fingerprints = build(tmp_path)
+    np.zeros(10, dtype=np.float32).tofile(output)
+    manifest.record(output, fingerprints)
+    manifest.close()
+
+    np.zeros(11, dtype=np.float32).tofile(source)
+    manifest, source, output, changed = build(tmp_path)
+    assert not manifest.is_current(output, changed)
+    assert manifest.is_current(output, fingerprints)
+
+    np.zeros(12, dtype=np.float32).tofile(output)
+    assert not manifest.is_current(output, fingerprints)
+
+
+def test_forget_survives_reload(tmp_path):
+    manifest, source, output, fingerprints = build(tmp_path)
+    np.zeros(10, dtype=np.float32).tofile(output)
+    manifest.record(output, fingerprints)
+    manifest.forget(output)
+    assert not build(tmp_path)[0].entries
+    manifest.close()
+    assert not build(tmp_path)[0].entries
+
+
+def test_fingerprints_of_missing_and_hashed_inputs(tmp_path):
+    manifest, source, _, _ = build(tmp_path, content_hash=True)
+    missing = str(tmp_path / "missing.bin")
+    fingerprints = manifest.fingerprints([source, missing], stat_files([source, missing]))
+    assert fingerprints[missing] is None
+    assert fingerprints[source]["size"] == 40 and "sha1" in fingerprints[source]
@@ -0,0 +1,46 @@
+import json
+import tracemalloc
+
+import metrics
+from metrics import begin_frame, end_frame, stage
+
+
+def profile(monkeypatch, tmp_path, mode, *stages):
+    monkeypatch.setenv(metrics.PROFILE_ENV, json.dumps({"stages": list(stages), "mode": mode,
+                                                        "dir": str(tmp_path / "profiles")}))
+
+
+def test_stage_times_accumulate():
+    begin_frame()
+    for _ in range(2):
+        with stage("load"):
+            pass
+    counters = end_frame(1.0)
+    assert set(counters["stages"]) == {"load"}
+    assert counters["stages"]["load"]["s"] >= 0
+
+
+def test_nested_tracemalloc_stage_is_covered_by_outer(monkeypatch, tmp_path):
+    profile(monkeypatch, tmp_path, "tracemalloc", "frame", "load")
+    begin_frame()
+    with stage("frame"):
+        with stage("load"):
+            data = bytearray(1 << 20)
+        del data
+        assert tracemalloc.is_tracing()
+    counters = end_frame(1.0)
+    assert counters["stages"]["frame"]["peak_alloc_bytes"] >= 1 << 20
+    assert "peak_alloc_bytes" not in counters["stages"]["load"]
+    assert not tracemalloc.is_tracing()
+
+
+def test_nested_cprofile_stage(monkeypatch, tmp_path):
+    profile(monkeypatch, tmp_path, "cprofile", "frame", "load")
+    monkeypatch.setattr(metrics, "_profiles", {})
+    begin_frame()
+    with stage("frame"):
+        with stage("load"):
+            sum(range(1000))
+    end_frame(1.0)
+    assert set(metrics._profiles) == {"frame"}
+    assert list((tmp_path / "profiles").iterdir())
@@ -0,0 +1,34 @@
+import argparse
+import numpy as np
+
+from pcd_cache import FieldCache, add_pcd_cache_arguments, pcd_cache_from_args
+from pcd_io import make_cloud, write_pcd
+
+
+def parse(*argv):
+    parser = argparse.ArgumentParser()
+    add_pcd_cache_arguments(parser)
+    return parser.parse_args(argv)
+
+
+def test_cache_is_opt_in(tmp_path):
+    assert pcd_cache_from_args(parse()) is None
+    cache = pcd_cache_from_args(parse("--pcd-cache", str(tmp_path), "--pcd-cache-size", "1"))
+    assert cache.directory == str(tmp_path) and cache.max_mb == 1
+
+
+def test_fields_are_cached_and_evicted(tmp_path):
+    xyz = np.random.default_rng(0).random((100, 3)).astype(np.float32)
+    intensity = np.arange(100, dtype=np.float32)
+    pcd_path = str(tmp_path / "0.pcd")
+    write_pcd(pcd_path, make_cloud(xyz, None, {"intensity": intensity}))
+
+    cache = FieldCache(str(tmp_path / "cache"), max_mb=1)
+    for _ in range(2):
+        fields = cache.read(pcd_path, ["x", "intensity"])
+        np.testing.assert_array_equal(fields["x"], xyz[:, 0])
+        np.testing.assert_array_equal(fields["intensity"], intensity)
+    assert len(list((tmp_path / "cache").iterdir())) == 2
+
+    cache.max_mb = 0
+    assert cache.evict()[0] == 2
@@ -0,0 +1,35 @@
+import numpy as np
+import pytest
+
+from pcd_io import field_columns, make_cloud, read_pcd, read_pcd_header, unpack_rgb, write_pcd
+
+
+@pytest.fixture
+def cloud():
+    rng = np.random.default_rng(0)
+    xyz = rng.random((500, 3)).astype(np.float32)
+    colors = rng.integers(0, 256, (500, 3)).astype(np.uint8)
+    return make_cloud(xyz, colors, {"intensity": rng.random(500).astype(np.float32),
+                                    "ring": rng.integers(0, 64, 500).astype(np.uint16)})
+
+
+@pytest.mark.parametrize("data", ["binary", "binary_compressed"])
+def test_round_trip(tmp_path, cloud, data):
+    path = str(tmp_path / "0.pcd")
+    write_pcd(path, cloud, data)
+    header = read_pcd_header(path)
+    assert header["data"] == data and header["points"] == len(cloud)
+
+    read = read_pcd(path, header)
+    assert read.dtype.names == cloud.dtype.names
+    for name in cloud.dtype.names:
+        np.testing.assert_array_equal(read[name], cloud[name])
+    np.testing.assert_array_equal(unpack_rgb(read), unpack_rgb(cloud))
+    np.testing.assert_array_equal(field_columns(read, ("x", "y", "z")),
+                                  np.column_stack([cloud[name] for name in ("x", "y", "z")]))
+
+
+def test_empty_cloud(tmp_path):
+    path = str(tmp_path / "empty.pcd")
+    write_pcd(path, make_cloud(np.empty((0, 3), dtype=np.float32)))
+    assert len(read_pcd(path)) == 0
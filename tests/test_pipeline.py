@@ -0,0 +1,69 @@
+import os
+import numpy as np
+import pytest
+
+import merge_lidar
+import pcd_io
+import pipeline
+
+
+@pytest.fixture
+def pipeline_tree(tmp_path, raw_tree, monkeypatch):
+    """raw_tree plus a LIDAR1 intensity PCD per frame, with the pipeline pointed at them"""
+    root, frames = raw_tree
+    pcd_dir = tmp_path / "pcd" / "00"
+    os.makedirs(pcd_dir)
+    rng = np.random.default_rng(1)
+    intensities = {}
+    for frame, (points, _) in frames.items():
+        lidar1 = points[points[:, 3] == 1]
+        intensities[frame] = rng.integers(0, 256, len(lidar1)).astype(np.float32)
+        pcd_io.write_pcd(str(pcd_dir / f"{int(frame)}.pcd"),
+                         pcd_io.make_cloud(lidar1[:, :3], None, {"intensity": intensities[frame]}))
+
+    monkeypatch.setattr(pipeline, "INPUT_DIR", root)
+    monkeypatch.setattr(pipeline, "OUTPUT_DIR", str(tmp_path / "merged"))
+    monkeypatch.setattr(pipeline, "INTENSITY_PCD_DIRS", {1: str(tmp_path / "pcd" / "{scene}")})
+    monkeypatch.setattr(pipeline, "FILTERED_DIRS", {tag: str(tmp_path / f"filtered{tag}") for tag in (0, 1)})
+    monkeypatch.setattr(pipeline, "INTENSITY_DIRS", {tag: str(tmp_path / f"intensity{tag}") for tag in (0, 1)})
+    monkeypatch.setattr(merge_lidar, "scenes", ["00"])
+    return tmp_path, frames, intensities
+
+
+def read_frame(base_dir, frame, with_labels=True):
+    points = np.fromfile(os.path.join(base_dir, "00", "velodyne", f"{frame}.bin"), dtype=np.float32).reshape(-1, 4)
+    if not with_labels:
+        return points
+    return points, np.fromfile(os.path.join(base_dir, "00", "labels", f"{frame}.label"), dtype=np.uint32)
+
+
+@pytest.mark.parametrize("io_depth", ["0", "2"])
+def test_filter_and_intermediates(pipeline_tree, io_depth, capsys):
+    tmp_path, frames, intensities = pipeline_tree
+    pipeline.main(["--filter", "x < 5", "--keep-intermediates", "--io-depth", io_depth])
+    out = capsys.readouterr().out
+    assert "(2 ok)" in out
+
+    removed = 0
+    for frame, (points, labels) in frames.items():
+        parts = {}
+        for tag in (0, 1):
+            tagged = points[:, 3] == tag
+            keep = points[tagged, 0] < 5
+            removed += np.count_nonzero(~keep)
+            raw = points[tagged][keep]
+            injected = raw.copy()
+            if tag == 1:
+                injected[:, 3] = (intensities[frame] / 255.0)[keep]
+            parts[tag] = (raw, injected, labels[tagged][keep])
+
+            # The filtered tree keeps the raw remission, the intensity tree the injected one
+            filtered_points, filtered_labels = read_frame(str(tmp_path / f"filtered{tag}"), frame)
+            np.testing.assert_array_equal(filtered_points, raw)
+            np.testing.assert_array_equal(filtered_labels, parts[tag][2])
+            np.testing.assert_array_equal(read_frame(str(tmp_path / f"intensity{tag}"), frame, False), injected)
+
+        merged_points, merged_labels = read_frame(str(tmp_path / "merged"), frame)
+        np.testing.assert_array_equal(merged_points, np.concatenate([parts[0][1], parts[1][1]]))
+        np.testing.assert_array_equal(merged_labels, np.concatenate([parts[0][2], parts[1][2]]))
+    assert f"Points filtered out: x < 5: {removed:,}" in out
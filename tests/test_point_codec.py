@@ -0,0 +1,44 @@
+import numpy as np
+import pytest
+
+from point_codec import Codec, decode, decode_threads, encode_labels, encode_points, load_points
+
+
+@pytest.fixture
+def frame():
+    rng = np.random.default_rng(0)
+    points = (rng.random((1000, 4)) * 50 - 25).astype(np.float32)
+    points[:, 3] = rng.integers(0, 256, len(points))
+    labels = np.repeat(rng.integers(0, 1 << 20, 50), 20).astype(np.uint32)
+    return points, labels
+
+
+@pytest.mark.parametrize("compression", ["zlib", "lzma"])
+@pytest.mark.parametrize("threads", [1, 3])
+def test_round_trip(frame, compression, threads):
+    points, labels = frame
+    codec = Codec(0.001, 16, compression, 128)
+    decoded = decode(encode_points(points, codec), threads)
+    assert decoded.dtype == np.float32 and decoded.shape == points.shape
+    np.testing.assert_allclose(decoded[:, :3], points[:, :3], atol=0.0005 + 1e-5)
+    # Integer remissions that fit the remission width are kept exactly
+    np.testing.assert_array_equal(decoded[:, 3], points[:, 3])
+    np.testing.assert_array_equal(decode(encode_labels(labels, codec), threads), labels)
+
+
+def test_load_points_of_raw_and_encoded_files(frame, tmp_path):
+    points, _ = frame
+    points.tofile(tmp_path / "000.bin")
+    encode_points(points, Codec(0.001, 16, "zlib", 256)).tofile(tmp_path / "000.qbin")
+    np.testing.assert_array_equal(load_points(str(tmp_path / "000.bin")), points)
+    np.testing.assert_allclose(load_points(str(tmp_path / "000.qbin")), points, atol=0.001)
+
+
+def test_decode_threads_share_the_cpus():
+    assert decode_threads(1) >= 1
+    assert decode_threads(10 ** 6) == 1
+
+
+def test_rejects_foreign_bytes():
+    with pytest.raises(ValueError):
+        decode(np.zeros(100, dtype=np.uint8))
@@ -0,0 +1,44 @@
+import os
+import numpy as np
+import pytest
+
+from scene_archive import ArchiveWriter, SceneArchive, pack_scene, unpack_scene
+
+
+def test_pack_unpack_round_trip(raw_tree, tmp_path):
+    root, frames = raw_tree
+    path = str(tmp_path / "00.pack")
+    assert pack_scene(os.path.join(root, "00"), path) == len(frames)
+
+    archive = SceneArchive(path)
+    assert list(archive) == sorted(frames)
+    for frame, (points, labels) in frames.items():
+        np.testing.assert_array_equal(archive[frame][0], points)
+        np.testing.assert_array_equal(archive[frame][1], labels)
+
+    unpacked = tmp_path / "unpacked" / "00"
+    assert unpack_scene(path, str(unpacked)) == len(frames)
+    for frame in frames:
+        for subdir, ext in (("velodyne", "bin"), ("labels", "label")):
+            with open(os.path.join(root, "00", subdir, f"{frame}.{ext}"), "rb") as a, \
+                    open(unpacked / subdir / f"{frame}.{ext}", "rb") as b:
+                assert a.read() == b.read()
+
+
+def test_frames_without_labels(tmp_path):
+    path = str(tmp_path / "00.pack")
+    writer = ArchiveWriter(path)
+    writer.add("000", np.ones((3, 4), dtype=np.float32))
+    writer.add("005", np.zeros((2, 4), dtype=np.float32), np.arange(2, dtype=np.uint32))
+    writer.close()
+    archive = SceneArchive(path)
+    assert not archive.has_labels("000") and archive.has_labels("005")
+    assert archive["000"][1] is None and len(archive["005"][0]) == 2
+
+
+def test_partial_files_are_rejected(raw_tree, tmp_path):
+    root, _ = raw_tree
+    with open(os.path.join(root, "00", "labels", "005.label"), "ab") as f:
+        f.write(b"\0")
+    with pytest.raises(ValueError, match="not a multiple of 4"):
+        pack_scene(os.path.join(root, "00"), str(tmp_path / "00.pack"))
@@ -0,0 +1,41 @@
+import os
+import numpy as np
+import pytest
+
+import split_lidar
+from split_lidar import partition_by_tag, split_scan
+
+
+def test_partition_is_stable_and_counts_untagged_points():
+    order, counts = partition_by_tag(np.array([1, 0, 2, 1, 0], dtype=np.float32), [0, 1])
+    assert order.tolist() == [1, 4, 0, 3, 2]
+    assert counts.tolist() == [2, 2, 1]
+
+
+def test_split_scan_keeps_point_order():
+    points = np.arange(24, dtype=np.float32).reshape(6, 4)
+    points[:, 3] = [1, 0, 1, 0, 0, 1]
+    labels = np.arange(6, dtype=np.uint32)
+    parts = split_scan(points, labels, [0, 1])
+    assert parts[0][1].tolist() == [1, 3, 4]
+    assert parts[1][1].tolist() == [0, 2, 5]
+    np.testing.assert_array_equal(parts[1][0], points[[0, 2, 5]])
+
+
+@pytest.mark.parametrize("extra", [[], ["--max-memory", "0.005"], ["--workers", "2"]])
+def test_main_writes_one_tree_per_tag(raw_tree, tmp_path, monkeypatch, capsys, extra):
+    root, frames = raw_tree
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(split_lidar, "base_input_dir", root)
+    monkeypatch.setattr(split_lidar, "scenes", ["00"])
+    split_lidar.main(["--filter", "x < 5", *extra])
+    capsys.readouterr()
+
+    for frame, (points, labels) in frames.items():
+        keep = points[:, 0] < 5
+        for tag, tree in split_lidar.PARTITIONS.items():
+            selected = keep & (points[:, 3] == tag)
+            written = np.fromfile(os.path.join(tree, "00", "velodyne", f"{frame}.bin"), dtype=np.float32)
+            np.testing.assert_array_equal(written.reshape(-1, 4), points[selected])
+            np.testing.assert_array_equal(
+                np.fromfile(os.path.join(tree, "00", "labels", f"{frame}.label"), dtype=np.uint32), labels[selected])